@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the hot paths of pyrosbag.
+
+"""
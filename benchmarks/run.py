@@ -0,0 +1,576 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark playback startup, control latency and read throughput.
+
+Synthetic bag files of the requested size, topic count, message size and
+compression are generated in a working directory, and kept there so that
+later runs reuse them. For each bag file, the benchmarks measure:
+
+* ``index_open``: reading the index with ``BagIndex``, and with a warm
+  ``IndexCache``;
+* ``sequential_read``: reading every message with ``Bag.read_messages``,
+  with and without decompression threads;
+* ``random_read``: ``Bag.seek`` to random times;
+* ``time_to_first_message``: from ``BagPlayer.play()`` to the first message
+  played in-process, and to the first ``RUNNING`` status of ``rosbag play``,
+  started cold or resumed from a warm standby player;
+* ``pause_latency`` and ``step_latency``: the latency of the acknowledged
+  ``pause()`` and ``step()`` of ``rosbag play``, and from ``step()`` to the
+  message played in-process.
+
+If ``rosbag`` is not on the PATH, or with ``--stub``, the stand-in used by the
+tests plays instead, so the overhead of pyrosbag itself is measured.
+
+The results are written as JSON. Given a baseline from an earlier run, the
+medians are compared, and the exit status is 1 if any got worse by more than
+the tolerance::
+
+    python -m benchmarks.run --size 64 --compression none lz4 -o new.json
+    python -m benchmarks.run --baseline old.json --tolerance 0.25
+
+"""
+import argparse
+from collections import namedtuple
+import json
+import os
+import platform
+import random
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+import pyrosbag as prb
+from pyrosbag.bagfile import BagIndex
+
+
+FAKE_ROSBAG = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "tests", "fake_rosbag.py")
+STRING_TYPE = ("std_msgs/String", "992ce8a1687cec8c8bd883ec73ca41d1",
+               "string data\n")
+BAG_START = 1483228800 * 10 ** 9
+
+#: How long to wait for a player to react before giving up, in seconds.
+TIMEOUT = 10.0
+
+
+class BagSpec(namedtuple("BagSpec", ["size_mb", "topics", "compression",
+                                     "message_size", "duration"])):
+    """
+    The parameters of a synthetic bag file.
+
+    Attributes
+    ----------
+    size_mb : float
+        The amount of message data, in megabytes.
+    topics : int
+        The number of topics, which share the messages equally.
+    compression : str
+        The chunk compression.
+    message_size : int
+        The size of every message, in bytes.
+    duration : float
+        The length of the bag, in seconds.
+
+    """
+    __slots__ = ()
+
+    @property
+    def filename(self):
+        return "bench_{:g}MB_{}t_{}_{}B_{:g}s.bag".format(*self)
+
+    @property
+    def message_count(self):
+        return max(1, int(self.size_mb * 1e6 // self.message_size))
+
+
+class Result(namedtuple("Result", ["name", "variant", "bag", "unit",
+                                   "better", "samples", "error"])):
+    """
+    The measurements of one benchmark.
+
+    Attributes
+    ----------
+    name : str
+        The benchmark.
+    variant : str
+        The configuration measured, such as "cached" or "rosbag".
+    bag : BagSpec
+        The bag file used.
+    unit : str
+        The unit of the samples.
+    better : str
+        "lower" or "higher".
+    samples : List[float]
+        The measurements.
+    error : str | None
+        Why the benchmark could not run, if it failed.
+
+    """
+    __slots__ = ()
+
+    @property
+    def key(self):
+        return "{}/{}/{}".format(self.name, self.variant, self.bag.filename)
+
+    def as_dict(self):
+        samples = sorted(self.samples)
+        summary = dict(self._asdict(), bag=self.bag._asdict(), key=self.key)
+        if samples:
+            summary.update(
+                min=samples[0], max=samples[-1],
+                mean=sum(samples) / len(samples),
+                median=percentile(samples, 0.5),
+                p95=percentile(samples, 0.95))
+        return summary
+
+
+def percentile(samples, fraction):
+    """
+    Find a percentile of sorted samples, by linear interpolation.
+
+    """
+    position = (len(samples) - 1) * fraction
+    low = int(position)
+    high = min(low + 1, len(samples) - 1)
+    return samples[low] + (samples[high] - samples[low]) * (position - low)
+
+
+def generate_bag(spec, directory):
+    """
+    Write a synthetic bag file, unless it already exists.
+
+    Half of every message is random, and half is zeros, so that compression
+    has something to do. The messages are spread evenly over the duration,
+    and over the topics.
+
+    Returns
+    -------
+    str
+        The bag file.
+
+    """
+    path = os.path.join(directory, spec.filename)
+    if os.path.exists(path):
+        return path
+    rng = random.Random(0)
+    half = spec.message_size // 2
+    payloads = [bytes(bytearray(rng.getrandbits(8) for _ in range(half))) +
+                b"\0" * (spec.message_size - half) for _ in range(64)]
+    count = spec.message_count
+    period = int(spec.duration * 1e9 / count)
+    temp = path + ".tmp"
+    with prb.BagWriter(temp, spec.compression) as bag:
+        topics = ["/bench_{}".format(i) for i in range(spec.topics)]
+        for topic in topics:
+            bag.add_connection(topic, *STRING_TYPE)
+        for i in range(count):
+            bag.write(topics[i % spec.topics], payloads[i % len(payloads)],
+                      BAG_START + i * period)
+    os.rename(temp, path)
+    return path
+
+
+def which(name):
+    """
+    Find an executable on the PATH.
+
+    """
+    for directory in os.environ.get("PATH", "").split(os.pathsep):
+        candidate = os.path.join(directory, name)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+def install_stub(directory):
+    """
+    Put the stand-in ``rosbag`` first on the PATH.
+
+    The stand-in plays for as long as the synthetic bags last, so that
+    control latency can be measured.
+
+    """
+    bin_dir = os.path.join(directory, "bin")
+    if not os.path.isdir(bin_dir):
+        os.makedirs(bin_dir)
+    executable = os.path.join(bin_dir, "rosbag")
+    with open(executable, "w") as stub:
+        stub.write('#!/bin/sh\nexec "{}" "{}" "$@"\n'.format(
+            sys.executable, FAKE_ROSBAG))
+    os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+
+
+def _timed(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.monotonic()
+        function()
+        samples.append(time.monotonic() - start)
+    return samples
+
+
+def _measure(name, variant, spec, unit, better, function):
+    try:
+        return Result(name, variant, spec, unit, better, function(), None)
+    except Exception as e:
+        return Result(name, variant, spec, unit, better, [],
+                      "{}: {}".format(type(e).__name__, e))
+
+
+def bench_index_open(path, spec, repeat):
+    def uncached():
+        return _timed(lambda: BagIndex(path), repeat)
+
+    def cached():
+        directory = tempfile.mkdtemp()
+        try:
+            cache = prb.IndexCache(directory)
+            cache.load(path)
+            return _timed(lambda: cache.load(path), repeat)
+        finally:
+            shutil.rmtree(directory)
+
+    yield _measure("index_open", "file", spec, "s", "lower", uncached)
+    yield _measure("index_open", "cached", spec, "s", "lower", cached)
+
+
+def bench_sequential_read(path, spec, repeat, workers=4):
+    size = os.path.getsize(path) / 1e6
+
+    def read(workers):
+        def run():
+            samples = []
+            for elapsed in _timed(lambda: _drain(path, workers), repeat):
+                samples.append(size / elapsed)
+            return samples
+        return run
+
+    yield _measure("sequential_read", "serial", spec, "MB/s", "higher",
+                   read(0))
+    if spec.compression != "none":
+        yield _measure("sequential_read", "{}_workers".format(workers), spec,
+                       "MB/s", "higher", read(workers))
+
+
+def _drain(path, workers):
+    for message in prb.Bag(path).read_messages(workers=workers):
+        len(message.data)
+
+
+def bench_random_read(path, spec, repeat, seeks=100):
+    def run():
+        rng = random.Random(1)
+        bag = prb.Bag(path)
+        bag.indexes
+        times = [(BAG_START + rng.random() * spec.duration * 1e9) / 1e9
+                 for _ in range(seeks * repeat)]
+        samples = []
+        for t in times:
+            start = time.monotonic()
+            bag.seek(t)
+            samples.append(time.monotonic() - start)
+        return samples
+
+    yield _measure("random_read", "seek", spec, "s", "lower", run)
+
+
+def _wait(condition, timeout=TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise RuntimeError("Timed out after {} s".format(timeout))
+        time.sleep(0.0005)
+    return time.monotonic()
+
+
+def _stop(player):
+    if player.is_running:
+        player.stop()
+    player.wait()
+
+
+def bench_time_to_first_message(path, spec, repeat, rosbag=True):
+    def engine():
+        samples = []
+        for _ in range(repeat):
+            first = threading.Event()
+            player = prb.BagPlayer(path)
+            start = time.monotonic()
+            player.play(sink=lambda message: first.set())
+            first.wait(TIMEOUT)
+            samples.append(time.monotonic() - start)
+            _stop(player)
+            if not first.is_set():
+                raise RuntimeError("No message after {} s".format(TIMEOUT))
+        return samples
+
+    def subprocess():
+        samples = []
+        for _ in range(repeat):
+            player = prb.BagPlayer(path)
+            start = time.monotonic()
+            player.play(progress=True)
+            try:
+                samples.append(_wait(lambda: _state(player) == "RUNNING") -
+                               start)
+            finally:
+                _stop(player)
+        return samples
+
+    def standby():
+        samples = []
+        player = prb.BagPlayer(path)
+        pool = player.warm_up()
+        try:
+            for _ in range(repeat):
+                _wait(lambda: pool.stats().ready)
+                start = time.monotonic()
+                player.play(progress=True)
+                try:
+                    samples.append(_wait(
+                        lambda: _state(player) == "RUNNING") - start)
+                finally:
+                    _stop(player)
+        finally:
+            player.cool_down()
+        return samples
+
+    yield _measure("time_to_first_message", "engine", spec, "s", "lower",
+                   engine)
+    if rosbag:
+        yield _measure("time_to_first_message", "rosbag", spec, "s",
+                       "lower", subprocess)
+        yield _measure("time_to_first_message", "rosbag_standby", spec, "s",
+                       "lower", standby)
+
+
+def _state(player):
+    latest = player.progress.latest
+    return None if latest is None else latest.state
+
+
+def bench_control_latency(path, spec, repeat, rosbag=True):
+    def engine_step():
+        received = threading.Event()
+        player = prb.BagPlayer(path)
+        player.play(sink=lambda message: received.set(), start_paused=True)
+        try:
+            samples = []
+            for _ in range(repeat):
+                received.clear()
+                start = time.monotonic()
+                player.process.step()
+                if not received.wait(TIMEOUT):
+                    raise RuntimeError("No message after {} s".format(
+                        TIMEOUT))
+                samples.append(time.monotonic() - start)
+            return samples
+        finally:
+            _stop(player)
+
+    def rosbag_pause():
+        player = prb.BagPlayer(path)
+        player.play(progress=True)
+        try:
+            _wait(lambda: _state(player) == "RUNNING")
+            samples = []
+            for _ in range(repeat):
+                samples.append(player.pause(confirm=True,
+                                            timeout=TIMEOUT).latency)
+                player.resume(confirm=True, timeout=TIMEOUT)
+            return samples
+        finally:
+            _stop(player)
+
+    def rosbag_step():
+        player = prb.BagPlayer(path)
+        player.play(progress=True, start_paused=True)
+        try:
+            _wait(lambda: _state(player) == "PAUSED")
+            return [player.step(confirm=True, timeout=TIMEOUT).latency
+                    for _ in range(repeat)]
+        finally:
+            _stop(player)
+
+    yield _measure("step_latency", "engine", spec, "s", "lower", engine_step)
+    if rosbag:
+        yield _measure("pause_latency", "rosbag", spec, "s", "lower",
+                       rosbag_pause)
+        yield _measure("step_latency", "rosbag", spec, "s", "lower",
+                       rosbag_step)
+
+
+BENCHMARKS = {
+    "index_open": bench_index_open,
+    "sequential_read": bench_sequential_read,
+    "random_read": bench_random_read,
+    "time_to_first_message": bench_time_to_first_message,
+    "control_latency": bench_control_latency,
+}
+PLAYBACK = ("time_to_first_message", "control_latency")
+
+
+def run(specs, directory, repeat=5, benchmarks=None, rosbag=True,
+        progress=None):
+    """
+    Run the benchmarks on every bag file.
+
+    Parameters
+    ----------
+    specs : List[BagSpec]
+        The bag files to generate and measure.
+    directory : str
+        Where to keep the bag files.
+    repeat : int
+        The number of samples per benchmark.
+    benchmarks : Optional[List[str]]
+        The benchmarks to run, from ``BENCHMARKS``. Default is all.
+    rosbag : bool
+        Also measure ``rosbag play``.
+    progress : Optional[Callable[[Result], None]]
+        Called with every result.
+
+    Returns
+    -------
+    List[Result]
+        The results.
+
+    """
+    results = []
+    for spec in specs:
+        path = generate_bag(spec, directory)
+        for name in benchmarks or sorted(BENCHMARKS):
+            arguments = (path, spec, repeat)
+            if name in PLAYBACK:
+                arguments += (rosbag,)
+            for result in BENCHMARKS[name](*arguments):
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Find the benchmarks whose median got worse than in a baseline.
+
+    Parameters
+    ----------
+    results : List[dict]
+        The current results, as written to JSON.
+    baseline : List[dict]
+        The results of an earlier run.
+    tolerance : float
+        The relative change allowed, such as 0.2 for 20%.
+
+    Returns
+    -------
+    List[str]
+        A description of every regression.
+
+    """
+    previous = dict((result["key"], result) for result in baseline
+                    if "median" in result)
+    regressions = []
+    for result in results:
+        old = previous.get(result["key"])
+        if old is None:
+            continue
+        if "median" not in result:
+            regressions.append("{}: failed ({})".format(result["key"],
+                                                        result["error"]))
+            continue
+        change = (result["median"] - old["median"]) / (old["median"] or 1e-12)
+        if result["better"] == "higher":
+            change = -change
+        if change > tolerance:
+            regressions.append("{}: {:.4g} {} -> {:.4g} {} ({:+.0%})".format(
+                result["key"], old["median"], old["unit"], result["median"],
+                result["unit"], change))
+    return regressions
+
+
+def describe(result):
+    summary = result.as_dict()
+    if result.error is not None:
+        return "{:<60} failed: {}".format(result.key, result.error)
+    return "{:<60} median {:.4g} {} (p95 {:.4g})".format(
+        result.key, summary["median"], result.unit, summary["p95"])
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size", type=float, nargs="+", default=[16],
+                        help="Message data per bag file, in MB.")
+    parser.add_argument("--topics", type=int, nargs="+", default=[4])
+    parser.add_argument("--compression", nargs="+", default=["none"],
+                        choices=["none", "bz2", "lz4"])
+    parser.add_argument("--message-size", type=int, nargs="+",
+                        default=[1024], help="In bytes.")
+    parser.add_argument("--duration", type=float, default=60.0,
+                        help="Length of the bag files, in seconds.")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Samples per benchmark.")
+    parser.add_argument("--benchmark", nargs="+", choices=sorted(BENCHMARKS),
+                        help="Benchmarks to run. Default is all.")
+    parser.add_argument("--workdir", default=os.path.join(
+        tempfile.gettempdir(), "pyrosbag-benchmarks"),
+        help="Where to keep the generated bag files.")
+    parser.add_argument("--stub", action="store_true",
+                        help="Use the stand-in rosbag even if ROS is there.")
+    parser.add_argument("--no-rosbag", action="store_true",
+                        help="Skip the rosbag play benchmarks.")
+    parser.add_argument("-o", "--output", help="Write the results as JSON.")
+    parser.add_argument("--baseline", help="Results of an earlier run.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative regression. Default is 0.2.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    if not os.path.isdir(args.workdir):
+        os.makedirs(args.workdir)
+    stub = args.stub or which("rosbag") is None
+    if stub and not args.no_rosbag:
+        install_stub(args.workdir)
+        os.environ.setdefault("FAKE_ROSBAG_DURATION", str(args.duration))
+
+    specs = [BagSpec(size, topics, compression, message_size, args.duration)
+             for size in args.size for topics in args.topics
+             for compression in args.compression
+             for message_size in args.message_size]
+    results = run(specs, args.workdir, args.repeat, args.benchmark,
+                  not args.no_rosbag, lambda result: print(describe(result)))
+    document = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pyrosbag": prb.__version__,
+        "rosbag": "stub" if stub else which("rosbag"),
+        "repeat": args.repeat,
+        "results": [result.as_dict() for result in results],
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(document, output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(document["results"],
+                                  json.load(baseline)["results"],
+                                  args.tolerance)
+        for regression in regressions:
+            print("Regression:", regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,13 +4,79 @@ Note that, in order to access the data within the bag file, the
 ``rosbag_python`` package is extremely convenient. It is available on PyPI.
 
 """
+from .exceptions import (
+    BagFormatError,
+    UnindexedBagError,
+)
 from .pyrosbag import (
     BagError,
     MissingBagError,
     BagNotRunningError,
     Bag,
     BagPlayer,
+    BagRecorder,
+    RecorderStats,
+    ControlAck,
+    ShardResult,
+)
+from .bagfile import (
+    BagIndex,
+    BagReader,
+    BagInfo,
+    Message,
+    TopicInfo,
+    Connection,
+    ConnectionIndex,
+    ChunkInfo,
+)
+from .cache import IndexCache
+from .columns import (
+    ColumnBatch,
+    ExportResult,
+    export_parquet,
+)
+from .decoder import (
+    MessageDecoder,
+    MessageView,
+    deserialize,
+)
+from .writer import BagWriter
+from .batch import (
+    ConversionResult,
+    batch_convert,
+)
+from .repair import (
+    CheckResult,
+    RepairProgress,
+)
+from .playback import (
+    MessageTiming,
+    MetricsSummary,
+    PlaybackMetrics,
+    PlaybackEngine,
+)
+from .progress import (
+    Progress,
+    ProgressReader,
+)
+from .shutdown import (
+    ShutdownPolicy,
+    ShutdownResult,
+)
+from .standby import (
+    StandbyPool,
+    StandbyStats,
+)
+from .group import (
+    BagPlayerGroup,
+    SkewReport,
+)
+from .pool import (
+    PlayResult,
+    PoolResult,
+    BagPlayerPool,
 )
+from .aio import AsyncBagPlayer
 
 __author__ = """Jean Nassar"""
 __email__ = 'jeannassar5@gmail.com'
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Control ``rosbag play`` from an asyncio event loop.
+
+``AsyncBagPlayer`` runs ``rosbag play`` with
+``asyncio.create_subprocess_exec``, so that one event loop can supervise
+many players without a thread per bag. Requires Python 3.5 or later.
+
+"""
+import asyncio
+import logging
+import subprocess as sp
+
+from .exceptions import BagError, BagNotRunningError
+from .pyrosbag import Bag, play_arguments
+from .shutdown import async_shutdown, popen_options, register
+
+
+logger = logging.getLogger("bag_player.aio")
+
+
+class AsyncBagPlayer(Bag):
+    """
+    Play bag files, with awaitable control methods.
+
+    It is used as an asynchronous context manager (``async with``). On exit,
+    a player which is still running is stopped if an exception occurred,
+    without any fixed sleep. The process is started and stopped according to
+    the shutdown policy, like that of a ``BagPlayer``.
+
+    Parameters
+    ----------
+    filenames : str | List[str]
+        The location of the bag files.
+    stop_timeout : Optional[float]
+        The time, in seconds, to wait for the process to terminate before
+        killing it. Default is 5.
+    kwargs
+        The options of ``Bag``, e.g. ``shutdown_policy``.
+
+    Attributes
+    ----------
+    process : asyncio.subprocess.Process
+        The process containing the running bag file.
+    stop_timeout : float
+        The time to wait for the process to terminate before killing it.
+
+    """
+    def __init__(self, filenames, stop_timeout=5.0, **kwargs):
+        super(AsyncBagPlayer, self).__init__(filenames, **kwargs)
+        self.stop_timeout = stop_timeout
+
+    async def play(self, wait=False, stdin=sp.PIPE, stdout=None, stderr=None,
+                   **kwargs):
+        """
+        Start playing the bag file.
+
+        Parameters
+        ----------
+        wait : Optional[Bool]
+            Wait until completion.
+        stdin : Optional[file]
+            The stdin buffer. Default is subprocess.PIPE.
+        stdout : Optional[file]
+            The stdout buffer.
+        stderr : Optional[file]
+            The stderr buffer.
+        kwargs
+            The options of ``BagPlayer.play``, e.g. ``immediate``.
+
+        Raises
+        ------
+        BagError
+            If the bag file is already playing.
+
+        """
+        if self.is_running:
+            raise BagError("The bag file is already playing.")
+        arguments = play_arguments(self.filenames, **kwargs)
+        self.process = register(
+            await asyncio.create_subprocess_exec(
+                *arguments, stdin=stdin, stdout=stdout, stderr=stderr,
+                **popen_options(self.shutdown_policy)),
+            self.shutdown_policy)
+        if wait:
+            await self.wait()
+
+    async def send(self, string):
+        """
+        Write something to process stdin, and wait until it is flushed.
+
+        Parameters
+        ----------
+        string : str | bytes
+            The string to write.
+
+        Raises
+        ------
+        BagNotRunningError
+            If interaction is attempted when the bag file is not running.
+
+        """
+        if not isinstance(string, bytes):
+            string = string.encode("utf-8")
+        try:
+            self.process.stdin.write(string)
+            await self.process.stdin.drain()
+        except (AttributeError, BrokenPipeError, ConnectionResetError):
+            raise BagNotRunningError()
+
+    async def pause(self):
+        """
+        Pause the bag file.
+
+        """
+        await self.send(" ")
+
+    async def resume(self):
+        """
+        Resume the bag file.
+
+        """
+        await self.send(" ")
+
+    async def step(self):
+        """
+        Step through a paused bag file.
+
+        """
+        await self.send("s")
+
+    async def wait(self):
+        """
+        Wait until the process is complete.
+
+        Returns
+        -------
+        int
+            The return code of the process.
+
+        Raises
+        ------
+        BagNotRunningError
+            If the bag file is not running.
+
+        """
+        try:
+            return await self.process.wait()
+        except AttributeError:
+            raise BagNotRunningError("wait for")
+
+    async def stop(self):
+        """
+        Stop a running bag file.
+
+        The process is interrupted, and terminated or killed if it does not
+        exit within the timeouts of the shutdown policy. It is killed if it
+        has not exited ``stop_timeout`` seconds after being terminated.
+
+        Returns
+        -------
+        ShutdownResult
+            The exit status, the last signal sent and the time taken.
+
+        Raises
+        ------
+        BagNotRunningError
+            If the bag file is not running.
+
+        """
+        if self.process is None:
+            raise BagNotRunningError("stop")
+        self.shutdown_result = await async_shutdown(
+            self.process,
+            self.shutdown_policy._replace(terminate_timeout=self.stop_timeout))
+        return self.shutdown_result
+
+    @property
+    def is_running(self):
+        """
+        Check whether the bag file is running.
+
+        Returns
+        -------
+        bool
+            The bag file is running.
+
+        """
+        return self.process is not None and self.process.returncode is None
+
+    def __enter__(self):
+        raise TypeError("Use 'async with' with an AsyncBagPlayer.")
+
+    async def __aenter__(self):
+        """
+        Asynchronous context manager entry point.
+
+        """
+        return self
+
+    # noinspection PyUnusedLocal
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """
+        Asynchronous context manager exit point.
+
+        """
+        if self.is_running:
+            if exc_type is None:
+                logger.warning("Exited while process is still running.")
+                logger.info("Hint: Use AsyncBagPlayer.wait() or "
+                            "AsyncBagPlayer.play(wait=True) to wait until "
+                            "completion.")
+            else:
+                await self.stop()
+
+        if exc_type in (KeyboardInterrupt, asyncio.CancelledError):
+            logger.info("User exit.")
+            return exc_type is KeyboardInterrupt
+        elif exc_type is not None:
+            logger.critical("An error occurred. Exiting.")
+        else:
+            logger.info("Goodbye!")
+
+    def __repr__(self):
+        return "<AsyncBagPlayer({})>".format(self.filenames)
@@ -0,0 +1,1304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Read ROS bag files directly, without going through ``rosbag``.
+
+Only version 2.0 of the bag format is supported. A bag file is a sequence of
+records, each made of a header (a set of ``name=value`` fields) and a data
+section. The bag header record points to the index section at the end of the
+file, which holds every connection record and one chunk info record per
+chunk. Reading the index is therefore enough to describe the bag without
+touching the message data.
+
+"""
+import bz2
+from array import array
+import bisect
+from collections import namedtuple
+import heapq
+import mmap
+import os
+import struct
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .decoder import deserialize
+from .exceptions import BagError, BagFormatError, UnindexedBagError
+
+
+MAGIC = b"#ROSBAG V2.0\n"
+
+OP_MESSAGE_DATA = 0x02
+OP_BAG_HEADER = 0x03
+OP_INDEX_DATA = 0x04
+OP_CHUNK = 0x05
+OP_CHUNK_INFO = 0x06
+OP_CONNECTION = 0x07
+
+UINT32 = struct.Struct("<I")
+UINT64 = struct.Struct("<Q")
+TIME = struct.Struct("<II")
+INDEX_ENTRY = struct.Struct("<III")
+CHUNK_INFO_ENTRY = struct.Struct("<II")
+
+BAG_HEADER_LEN = 4096
+NSEC_PER_SEC = 1000000000
+
+#: The fields of the arrays returned by ``topic_table``.
+TOPIC_TABLE_FIELDS = [("timestamp", "<u8"), ("connection", "<u4"),
+                      ("chunk_pos", "<u8"), ("offset", "<u4"),
+                      ("size", "<u4"), ("file", "<u2")]
+
+
+Connection = namedtuple("Connection", ["id", "topic", "datatype", "md5sum",
+                                       "msg_def", "header"])
+Connection.__doc__ = """
+A connection record, i.e. a topic and the type of its messages.
+
+Attributes
+----------
+id : int
+    The connection ID, unique within the bag file.
+topic : str
+    The topic on which the messages are stored.
+datatype : str
+    The message type, e.g. ``std_msgs/String``.
+md5sum : str
+    The MD5 sum of the message definition.
+msg_def : str
+    The full text of the message definition.
+header : Dict[str, bytes]
+    Every field of the connection header.
+
+"""
+
+ChunkInfo = namedtuple("ChunkInfo", ["pos", "start_time", "end_time",
+                                     "connection_counts"])
+ChunkInfo.__doc__ = """
+A chunk info record from the index section.
+
+Attributes
+----------
+pos : int
+    The offset of the chunk record in the file.
+start_time : int
+    The earliest message time in the chunk, in nanoseconds.
+end_time : int
+    The latest message time in the chunk, in nanoseconds.
+connection_counts : Dict[int, int]
+    The number of messages in the chunk, per connection ID.
+
+"""
+
+ConnectionIndex = namedtuple("ConnectionIndex", ["timestamps",
+                                                 "chunk_positions",
+                                                 "offsets"])
+ConnectionIndex.__doc__ = """
+Every index entry of a connection, as parallel arrays ordered by time.
+
+Attributes
+----------
+timestamps : array.array
+    The time of every message, in nanoseconds.
+chunk_positions : array.array
+    The position of the chunk containing every message.
+offsets : array.array
+    The offset of every message in its uncompressed chunk data.
+
+"""
+
+TopicInfo = namedtuple("TopicInfo", ["datatype", "md5sum", "message_count",
+                                     "connections"])
+TopicInfo.__doc__ = """
+Summary of a topic in a bag file.
+
+Attributes
+----------
+datatype : str
+    The message type.
+md5sum : str
+    The MD5 sum of the message definition.
+message_count : int
+    The number of messages on the topic.
+connections : int
+    The number of connections publishing on the topic.
+
+"""
+
+BagInfo = namedtuple("BagInfo", ["filename", "version", "size", "start_time",
+                                 "end_time", "duration", "message_count",
+                                 "chunk_count", "topics", "compression"])
+BagInfo.__doc__ = """
+Summary of a bag file, equivalent to the output of ``rosbag info``.
+
+Attributes
+----------
+filename : str
+    The location of the bag file.
+version : str
+    The bag format version.
+size : int
+    The size of the file, in bytes.
+start_time : float | None
+    The time of the earliest message, in seconds, or None if it is empty.
+end_time : float | None
+    The time of the latest message, in seconds, or None if it is empty.
+duration : float
+    The time between the first and last messages, in seconds.
+message_count : int
+    The total number of messages.
+chunk_count : int
+    The number of chunks.
+topics : Dict[str, TopicInfo]
+    Summary of every topic.
+compression : Dict[str, int] | None
+    The number of chunks per compression format, if requested.
+
+"""
+
+
+class Message(namedtuple("Message", ["topic", "data", "timestamp",
+                                     "connection"])):
+    """
+    A message read from a bag file.
+
+    Attributes
+    ----------
+    topic : str
+        The topic of the message.
+    data : memoryview
+        The serialized message. For uncompressed chunks, this is a view into
+        the memory-mapped file, so it is only valid while the file is open.
+    timestamp : int
+        The time at which the message was recorded, in nanoseconds.
+    connection : Connection
+        The connection on which the message was recorded.
+
+    """
+    __slots__ = ()
+
+    @property
+    def time(self):
+        """
+        The time at which the message was recorded, in seconds.
+
+        Returns
+        -------
+        float
+            The recording time.
+
+        """
+        return to_sec(self.timestamp)
+
+    @property
+    def msg(self):
+        """
+        The message, decoded lazily from its connection's definition.
+
+        Each access wraps the data in a new view, so keep the view to avoid
+        decoding the same fields twice. Like the data, it is only valid while
+        the file is open.
+
+        Returns
+        -------
+        MessageView
+            The message, whose fields are decoded when accessed.
+
+        Raises
+        ------
+        BagFormatError
+            If the message definition cannot be parsed.
+
+        """
+        return deserialize(self.connection, self.data)
+
+
+def to_nsec(seconds):
+    """
+    Convert a time in seconds to integer nanoseconds.
+
+    Parameters
+    ----------
+    seconds : float
+        The time, in seconds.
+
+    Returns
+    -------
+    int
+        The time, in nanoseconds.
+
+    """
+    return int(round(seconds * NSEC_PER_SEC))
+
+
+def to_sec(nsec):
+    """
+    Convert a time in integer nanoseconds to seconds.
+
+    Parameters
+    ----------
+    nsec : int
+        The time, in nanoseconds.
+
+    Returns
+    -------
+    float
+        The time, in seconds.
+
+    """
+    return nsec / float(NSEC_PER_SEC)
+
+
+def unpack_time(raw, offset=0):
+    """
+    Unpack a ROS time (seconds and nanoseconds) into integer nanoseconds.
+
+    Parameters
+    ----------
+    raw : buffer
+        The buffer containing the time.
+    offset : Optional[int]
+        The position of the time in the buffer.
+
+    Returns
+    -------
+    int
+        The time, in nanoseconds.
+
+    """
+    secs, nsecs = TIME.unpack_from(raw, offset)
+    return secs * NSEC_PER_SEC + nsecs
+
+
+def decode_header(buf):
+    """
+    Decode the fields of a record header.
+
+    Parameters
+    ----------
+    buf : buffer
+        The encoded header, without its length prefix.
+
+    Returns
+    -------
+    Dict[str, bytes]
+        The raw value of every field.
+
+    Raises
+    ------
+    BagFormatError
+        If the header is malformed.
+
+    """
+    fields = {}
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        if pos + 4 > end:
+            raise BagFormatError("Truncated header field.")
+        field_len, = UINT32.unpack_from(buf, pos)
+        pos += 4
+        if pos + field_len > end:
+            raise BagFormatError("Truncated header field.")
+        name, sep, value = bytes(buf[pos:pos + field_len]).partition(b"=")
+        if not sep:
+            raise BagFormatError("Header field without a name.")
+        fields[name.decode("ascii")] = value
+        pos += field_len
+    return fields
+
+
+def read_record(buf, pos, partial=False):
+    """
+    Read the header of the record at a position in a buffer.
+
+    The data section is not read.
+
+    Parameters
+    ----------
+    buf : buffer
+        The buffer containing the record, e.g. the memory-mapped file.
+    pos : int
+        The position of the record in the buffer.
+    partial : Optional[Bool]
+        Allow the data section to extend past the end of the buffer.
+
+    Returns
+    -------
+    header : Dict[str, bytes]
+        The fields of the record header.
+    data_pos : int
+        The position of the data section.
+    data_len : int
+        The length of the data section.
+
+    Raises
+    ------
+    BagFormatError
+        If the record is truncated or malformed.
+
+    """
+    end = len(buf)
+    if pos + 4 > end:
+        raise BagFormatError("Truncated record at {}.".format(pos))
+    header_len, = UINT32.unpack_from(buf, pos)
+    pos += 4
+    if pos + header_len + 4 > end:
+        raise BagFormatError("Truncated record header at {}.".format(pos))
+    header = decode_header(buf[pos:pos + header_len])
+    pos += header_len
+    data_len, = UINT32.unpack_from(buf, pos)
+    pos += 4
+    if not partial and pos + data_len > end:
+        raise BagFormatError("Truncated record data at {}.".format(pos))
+    if "op" not in header:
+        raise BagFormatError("Record without an op code at {}.".format(pos))
+    return header, pos, data_len
+
+
+def record_op(header):
+    """
+    Get the op code of a record.
+
+    Parameters
+    ----------
+    header : Dict[str, bytes]
+        The fields of the record header.
+
+    Returns
+    -------
+    int
+        The op code.
+
+    """
+    return ord(header["op"][:1])
+
+
+def decompress(data, compression):
+    """
+    Decompress the data of a chunk.
+
+    Parameters
+    ----------
+    data : buffer
+        The compressed data.
+    compression : str
+        The compression format: ``none``, ``bz2`` or ``lz4``.
+
+    Returns
+    -------
+    buffer
+        The uncompressed data. Uncompressed chunks are returned as is.
+
+    Raises
+    ------
+    BagError
+        If the compression format is not supported.
+
+    """
+    if compression == "none":
+        return data
+    if compression == "bz2":
+        return bz2.decompress(data)
+    if compression == "lz4":
+        if lz4_frame is None:
+            raise BagError("The lz4 package is needed to read lz4 chunks.")
+        return lz4_frame.decompress(data)
+    raise BagError("Unknown compression: {}".format(compression))
+
+
+def iter_records(buf, pos=0, end=None):
+    """
+    Read the headers of consecutive records.
+
+    Parameters
+    ----------
+    buf : buffer
+        The buffer containing the records, e.g. the memory-mapped file or
+        the data of a chunk.
+    pos : Optional[int]
+        The position of the first record.
+    end : Optional[int]
+        The position at which to stop. Default is the end of the buffer.
+
+    Yields
+    ------
+    pos : int
+        The position of the record.
+    header : Dict[str, bytes]
+        The fields of the record header.
+    data_pos : int
+        The position of the data section.
+    data_len : int
+        The length of the data section.
+
+    Raises
+    ------
+    BagFormatError
+        If a record is truncated or malformed.
+
+    """
+    end = len(buf) if end is None else end
+    while pos < end:
+        header, data_pos, data_len = read_record(buf, pos)
+        yield pos, header, data_pos, data_len
+        pos = data_pos + data_len
+
+
+def merge_messages(iterables):
+    """
+    Merge time-ordered message streams into a single time-ordered stream.
+
+    Parameters
+    ----------
+    iterables : List[Iterable[Message]]
+        The message streams. Each must already be ordered by time.
+
+    Yields
+    ------
+    Message
+        The messages of every stream, ordered by time. Ties are broken by
+        the order of the streams.
+
+    """
+    decorated = [((message.timestamp, i, message) for message in iterable)
+                 for i, iterable in enumerate(iterables)]
+    for _, _, message in heapq.merge(*decorated):
+        yield message
+
+
+def iter_index_data(buf, chunk_info):
+    """
+    Locate the index data records which follow a chunk.
+
+    The chunk data itself is skipped.
+
+    Parameters
+    ----------
+    buf : buffer
+        The whole bag file, e.g. memory-mapped.
+    chunk_info : ChunkInfo
+        The chunk.
+
+    Yields
+    ------
+    conn : int
+        The connection ID.
+    count : int
+        The number of messages on the connection in the chunk.
+    data_pos : int
+        The position of the index entries in the buffer.
+
+    Raises
+    ------
+    BagFormatError
+        If the index data records are missing or malformed.
+
+    """
+    _, data_pos, data_len = read_record(buf, chunk_info.pos)
+    pos = data_pos + data_len
+    for _ in range(len(chunk_info.connection_counts)):
+        header, data_pos, data_len = read_record(buf, pos)
+        pos = data_pos + data_len
+        if record_op(header) != OP_INDEX_DATA:
+            raise BagFormatError(
+                "Missing index data after chunk at {}.".format(chunk_info.pos))
+        count = _uint32(header, "count")
+        if count * INDEX_ENTRY.size > data_len:
+            raise BagFormatError("Truncated index data at {}.".format(pos))
+        yield _uint32(header, "conn"), count, data_pos
+
+
+def _uint32(header, name):
+    return UINT32.unpack(header[name])[0]
+
+
+def _uint64(header, name):
+    return UINT64.unpack(header[name])[0]
+
+
+def _string(value):
+    return value.decode("utf-8")
+
+
+def parse_connection(header, data):
+    """
+    Parse a connection record.
+
+    Parameters
+    ----------
+    header : Dict[str, bytes]
+        The fields of the record header.
+    data : buffer
+        The data section, i.e. the encoded connection header.
+
+    Returns
+    -------
+    Connection
+        The connection.
+
+    """
+    fields = decode_header(data)
+    topic = _string(header["topic"])
+    return Connection(_uint32(header, "conn"), topic,
+                      _string(fields.get("type", b"")),
+                      _string(fields.get("md5sum", b"")),
+                      _string(fields.get("message_definition", b"")),
+                      fields)
+
+
+def parse_chunk_info(header, data):
+    """
+    Parse a chunk info record.
+
+    Parameters
+    ----------
+    header : Dict[str, bytes]
+        The fields of the record header.
+    data : buffer
+        The data section.
+
+    Returns
+    -------
+    ChunkInfo
+        The chunk info.
+
+    """
+    counts = {}
+    for i in range(_uint32(header, "count")):
+        conn, count = CHUNK_INFO_ENTRY.unpack_from(data,
+                                                   i * CHUNK_INFO_ENTRY.size)
+        counts[conn] = count
+    return ChunkInfo(_uint64(header, "chunk_pos"),
+                     unpack_time(header["start_time"]),
+                     unpack_time(header["end_time"]), counts)
+
+
+class BagIndex(object):
+    """
+    The index of a single bag file, read straight from the file.
+
+    Only the bag header and the index section at the end of the file are
+    read, so opening the index costs the same regardless of the size of the
+    message data.
+
+    Parameters
+    ----------
+    filename : str
+        The location of the bag file.
+
+    Attributes
+    ----------
+    filename : str
+        The location of the bag file.
+    size : int
+        The size of the file, in bytes.
+    index_pos : int
+        The offset of the index section.
+    connections : Dict[int, Connection]
+        Every connection, by ID.
+    chunk_infos : List[ChunkInfo]
+        Every chunk info record, in file order.
+    message_index : Dict[int, ConnectionIndex] | None
+        The index entries of every connection, once loaded with
+        ``load_message_index``.
+
+    Raises
+    ------
+    BagFormatError
+        If the file is not a valid bag file.
+    UnindexedBagError
+        If the bag file has no index.
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as bag_file:
+            self.size = os.fstat(bag_file.fileno()).st_size
+            self.index_pos = self._read_bag_header(bag_file)
+            bag_file.seek(self.index_pos)
+            index = bag_file.read(self.size - self.index_pos)
+        self.connections = {}
+        self.chunk_infos = []
+        self.message_index = None
+        self._chunk_order = None
+        self._read_index(index)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_chunk_order"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault("_chunk_order", None)
+
+    def _read_bag_header(self, bag_file):
+        head = bag_file.read(len(MAGIC) + BAG_HEADER_LEN)
+        if not head.startswith(MAGIC):
+            raise BagFormatError(
+                "{} is not a version 2.0 bag file.".format(self.filename))
+        header = read_record(head, len(MAGIC))[0]
+        if record_op(header) != OP_BAG_HEADER:
+            raise BagFormatError(
+                "{} does not start with a bag header.".format(self.filename))
+        index_pos = _uint64(header, "index_pos")
+        if index_pos == 0 or index_pos > self.size:
+            raise UnindexedBagError(self.filename)
+        return index_pos
+
+    def _read_index(self, index):
+        pos = 0
+        while pos < len(index):
+            header, data_pos, data_len = read_record(index, pos)
+            data = index[data_pos:data_pos + data_len]
+            op = record_op(header)
+            if op == OP_CONNECTION:
+                connection = parse_connection(header, data)
+                self.connections[connection.id] = connection
+            elif op == OP_CHUNK_INFO:
+                self.chunk_infos.append(parse_chunk_info(header, data))
+            pos = data_pos + data_len
+
+    def read_chunk_header(self, chunk_info, bag_file=None):
+        """
+        Read the header of a chunk record, without reading its data.
+
+        Parameters
+        ----------
+        chunk_info : ChunkInfo
+            The chunk to read.
+        bag_file : Optional[file]
+            An open handle on the bag file, to avoid reopening it.
+
+        Returns
+        -------
+        compression : str
+            The compression format of the chunk.
+        size : int
+            The uncompressed size of the chunk data.
+        data_pos : int
+            The offset of the chunk data in the file.
+        data_len : int
+            The compressed size of the chunk data.
+
+        """
+        if bag_file is None:
+            with open(self.filename, "rb") as bag_file:
+                return self.read_chunk_header(chunk_info, bag_file)
+        bag_file.seek(chunk_info.pos)
+        head = bag_file.read(4)
+        header_len = UINT32.unpack(head)[0] if len(head) == 4 else 0
+        head += bag_file.read(header_len + 4)
+        try:
+            header, data_pos, data_len = read_record(head, 0, partial=True)
+        except BagFormatError:
+            data_len = None
+        if data_len is None or record_op(header) != OP_CHUNK:
+            raise BagFormatError(
+                "No chunk at {} in {}.".format(chunk_info.pos, self.filename))
+        return (_string(header["compression"]), _uint32(header, "size"),
+                chunk_info.pos + data_pos, data_len)
+
+    def load_message_index(self):
+        """
+        Read the index data records of every chunk.
+
+        Only the index data records which follow each chunk are read, not
+        the chunks themselves. The result is kept in ``message_index``.
+
+        Returns
+        -------
+        Dict[int, ConnectionIndex]
+            The index entries, per connection ID.
+
+        """
+        if self.message_index is not None:
+            return self.message_index
+        entries = dict((conn, []) for conn in self.connections)
+        with open(self.filename, "rb") as bag_file:
+            bag_map = mmap.mmap(bag_file.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(bag_map)
+            try:
+                for chunk in self.chunk_infos:
+                    for conn, count, data_pos in iter_index_data(view, chunk):
+                        data = view[data_pos:data_pos +
+                                    count * INDEX_ENTRY.size]
+                        entries.setdefault(conn, []).extend(
+                            (secs * NSEC_PER_SEC + nsecs, chunk.pos, offset)
+                            for secs, nsecs, offset in
+                            INDEX_ENTRY.iter_unpack(data))
+                        data.release()
+            finally:
+                view.release()
+                bag_map.close()
+
+        message_index = {}
+        for conn, conn_entries in entries.items():
+            conn_entries.sort()
+            message_index[conn] = ConnectionIndex(
+                array("Q", (entry[0] for entry in conn_entries)),
+                array("Q", (entry[1] for entry in conn_entries)),
+                array("I", (entry[2] for entry in conn_entries)))
+        self.message_index = message_index
+        return message_index
+
+    def _time_order(self):
+        order = self._chunk_order
+        if order is None:
+            chunks = sorted(self.chunk_infos,
+                            key=lambda chunk: (chunk.start_time, chunk.pos))
+            starts = array("Q", (chunk.start_time for chunk in chunks))
+            max_ends = array("Q")
+            latest = 0
+            for chunk in chunks:
+                latest = max(latest, chunk.end_time)
+                max_ends.append(latest)
+            order = self._chunk_order = (chunks, starts, max_ends)
+        return order
+
+    def chunks_between(self, start=None, end=None):
+        """
+        Find the chunks which may hold messages within a time range.
+
+        The chunks are located by binary search, so the chunks outside the
+        range are never looked at.
+
+        Parameters
+        ----------
+        start : Optional[int]
+            The earliest time, in nanoseconds.
+        end : Optional[int]
+            The latest time, in nanoseconds.
+
+        Returns
+        -------
+        List[ChunkInfo]
+            The chunks, ordered by start time.
+
+        """
+        chunks, starts, max_ends = self._time_order()
+        first = 0 if start is None else bisect.bisect_left(max_ends, start)
+        last = len(chunks) if end is None else bisect.bisect_right(starts, end)
+        return [chunk for chunk in chunks[first:last]
+                if start is None or chunk.end_time >= start]
+
+    @property
+    def start_time(self):
+        """
+        The time of the earliest message, in nanoseconds.
+
+        Returns
+        -------
+        int | None
+            The start time, or None if the bag is empty.
+
+        """
+        if not self.chunk_infos:
+            return None
+        return min(chunk.start_time for chunk in self.chunk_infos)
+
+    @property
+    def end_time(self):
+        """
+        The time of the latest message, in nanoseconds.
+
+        Returns
+        -------
+        int | None
+            The end time, or None if the bag is empty.
+
+        """
+        if not self.chunk_infos:
+            return None
+        return max(chunk.end_time for chunk in self.chunk_infos)
+
+    def message_counts(self):
+        """
+        Count the messages of every connection.
+
+        Returns
+        -------
+        Dict[int, int]
+            The number of messages, per connection ID.
+
+        """
+        counts = dict.fromkeys(self.connections, 0)
+        for chunk in self.chunk_infos:
+            for conn, count in chunk.connection_counts.items():
+                counts[conn] = counts.get(conn, 0) + count
+        return counts
+
+    def info(self, compression=False):
+        """
+        Summarize the bag file.
+
+        Parameters
+        ----------
+        compression : Optional[Bool]
+            Also count the chunks per compression format. This reads the
+            header of every chunk record, instead of the index alone.
+
+        Returns
+        -------
+        BagInfo
+            The summary of the bag file.
+
+        """
+        counts = self.message_counts()
+        topics = {}
+        for conn, connection in self.connections.items():
+            previous = topics.get(connection.topic)
+            if previous is None:
+                topics[connection.topic] = TopicInfo(
+                    connection.datatype, connection.md5sum, counts[conn], 1)
+            else:
+                topics[connection.topic] = previous._replace(
+                    message_count=previous.message_count + counts[conn],
+                    connections=previous.connections + 1)
+
+        compression_counts = None
+        if compression:
+            compression_counts = {}
+            with open(self.filename, "rb") as bag_file:
+                for chunk in self.chunk_infos:
+                    kind = self.read_chunk_header(chunk, bag_file)[0]
+                    compression_counts[kind] = (
+                        compression_counts.get(kind, 0) + 1)
+
+        start_time = self.start_time
+        end_time = self.end_time
+        if start_time is None:
+            duration = 0.0
+        else:
+            duration = to_sec(end_time - start_time)
+            start_time = to_sec(start_time)
+            end_time = to_sec(end_time)
+        return BagInfo(self.filename, "2.0", self.size, start_time, end_time,
+                       duration, sum(counts.values()), len(self.chunk_infos),
+                       topics, compression_counts)
+
+    def __repr__(self):
+        return "<BagIndex({})>".format(self.filename)
+
+
+class BagReader(object):
+    """
+    Read the messages of a single bag file through a memory map.
+
+    Messages in uncompressed chunks are returned as views into the mapped
+    file, without copying. Compressed chunks are decompressed one at a time,
+    and only when a message in them is needed.
+
+    Parameters
+    ----------
+    index : str | BagIndex
+        The location of the bag file, or its index.
+
+    Attributes
+    ----------
+    index : BagIndex
+        The index of the bag file.
+
+    """
+    def __init__(self, index):
+        if not isinstance(index, BagIndex):
+            index = BagIndex(index)
+        self.index = index
+        self._file = open(index.filename, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+    def close(self):
+        """
+        Close the bag file.
+
+        The memory map is kept alive until every message view which still
+        refers to it has been released.
+
+        """
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    # noinspection PyUnusedLocal
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connection_ids(self, topics=None):
+        """
+        Find the connections recording some topics.
+
+        Parameters
+        ----------
+        topics : Optional[str | List[str]]
+            The topics. Default is every topic.
+
+        Returns
+        -------
+        Set[int]
+            The connection IDs.
+
+        """
+        connections = self.index.connections
+        if topics is None:
+            return set(connections)
+        if not isinstance(topics, (list, tuple, set, frozenset)):
+            topics = [topics]
+        topics = set(topics)
+        return set(conn for conn, connection in connections.items()
+                   if connection.topic in topics)
+
+    def chunk_entries(self, chunk_info, connections=None, start=None,
+                      end=None):
+        """
+        Read the index data records which follow a chunk.
+
+        The chunk data itself is skipped.
+
+        Parameters
+        ----------
+        chunk_info : ChunkInfo
+            The chunk.
+        connections : Optional[Set[int]]
+            The connection IDs to keep. Default is every connection.
+        start : Optional[int]
+            The earliest time to keep, in nanoseconds.
+        end : Optional[int]
+            The latest time to keep, in nanoseconds.
+
+        Returns
+        -------
+        List[Tuple[int, int, int]]
+            The time, offset in the uncompressed chunk data, and connection
+            ID of every message, ordered by time.
+
+        """
+        entries = []
+        for conn, count, data_pos in iter_index_data(self._view, chunk_info):
+            if connections is not None and conn not in connections:
+                continue
+            data = self._view[data_pos:data_pos + count * INDEX_ENTRY.size]
+            for secs, nsecs, offset in INDEX_ENTRY.iter_unpack(data):
+                timestamp = secs * NSEC_PER_SEC + nsecs
+                if start is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp > end:
+                    continue
+                entries.append((timestamp, offset, conn))
+        entries.sort()
+        return entries
+
+    def _chunk_payload(self, pos):
+        header, data_pos, data_len = read_record(self._view, pos)
+        if record_op(header) != OP_CHUNK:
+            raise BagFormatError("No chunk at {}.".format(pos))
+        return (_string(header["compression"]),
+                self._view[data_pos:data_pos + data_len])
+
+    def raw_chunk(self, chunk_info):
+        """
+        Get a chunk record and the index data records which follow it.
+
+        Parameters
+        ----------
+        chunk_info : ChunkInfo
+            The chunk.
+
+        Returns
+        -------
+        compression : str
+            The compression format of the chunk.
+        records : memoryview
+            The records, as a view into the memory-mapped file.
+
+        """
+        compression = self._chunk_payload(chunk_info.pos)[0]
+        end = None
+        for _, count, data_pos in iter_index_data(self._view, chunk_info):
+            end = data_pos + count * INDEX_ENTRY.size
+        if end is None:
+            header, data_pos, data_len = read_record(self._view,
+                                                     chunk_info.pos)
+            end = data_pos + data_len
+        return compression, self._view[chunk_info.pos:end]
+
+    def chunk_data(self, chunk_info):
+        """
+        Get the uncompressed data of a chunk.
+
+        Parameters
+        ----------
+        chunk_info : ChunkInfo
+            The chunk.
+
+        Returns
+        -------
+        memoryview
+            The uncompressed chunk data. For uncompressed chunks, this is a
+            view into the memory-mapped file.
+
+        """
+        compression, data = self._chunk_payload(chunk_info.pos)
+        return memoryview(decompress(data, compression))
+
+    def message_at(self, chunk, offset, timestamp, conn):
+        """
+        Get a message from the uncompressed data of a chunk.
+
+        Parameters
+        ----------
+        chunk : memoryview
+            The uncompressed chunk data, from ``chunk_data``.
+        offset : int
+            The offset of the message data record in the chunk data, as
+            given by ``chunk_entries``.
+        timestamp : int
+            The time of the message, in nanoseconds.
+        conn : int
+            The connection ID of the message.
+
+        Returns
+        -------
+        Message
+            The message. Its data is a view into the chunk data.
+
+        """
+        header_len, = UINT32.unpack_from(chunk, offset)
+        data_pos = offset + 8 + header_len
+        data_len, = UINT32.unpack_from(chunk, data_pos - 4)
+        connection = self.index.connections[conn]
+        return Message(connection.topic, chunk[data_pos:data_pos + data_len],
+                       timestamp, connection)
+
+    def read_messages(self, topics=None, start=None, end=None,
+                      executor=None, prefetch=None):
+        """
+        Read the messages in the bag file, ordered by time.
+
+        Parameters
+        ----------
+        topics : Optional[str | List[str]]
+            The topics to read. Default is every topic.
+        start : Optional[float]
+            The earliest message time, in seconds.
+        end : Optional[float]
+            The latest message time, in seconds.
+        executor : Optional[concurrent.futures.Executor]
+            Decompress the upcoming compressed chunks ahead of the consumer
+            in this executor. Default is to decompress each chunk when its
+            first message is needed.
+        prefetch : Optional[int]
+            The maximum number of chunks decompressed ahead of the consumer.
+            Default is twice the number of workers of the executor.
+
+        Yields
+        ------
+        Message
+            The messages. The order does not depend on the executor.
+
+        """
+        connections = self.connection_ids(topics)
+        start = None if start is None else to_nsec(start)
+        end = None if end is None else to_nsec(end)
+        chunks = [chunk for chunk in self.index.chunks_between(start, end)
+                  if not connections.isdisjoint(chunk.connection_counts)]
+        if executor is not None and prefetch is None:
+            prefetch = 2 * getattr(executor, "_max_workers", 1)
+        for message in self._read_chunks(chunks, connections, start, end,
+                                         executor, prefetch):
+            yield message
+
+    def _read_chunks(self, chunks, connections, start, end, executor=None,
+                     prefetch=None):
+        # Chunks may overlap in time, so their entries are merged lazily:
+        # a chunk is only indexed once no pending message precedes it, and
+        # its data is dropped as soon as its last message has been yielded.
+        # Chunks are consumed in the order of ``chunks``, so with an
+        # executor the next ``prefetch`` compressed chunks are decompressed
+        # in the background.
+        heap = []
+        loaded = {}
+        futures = {}
+        submitted = 0
+        i = 0
+        try:
+            while i < len(chunks) or heap:
+                while executor is not None and submitted < len(chunks) and (
+                        len(futures) < prefetch):
+                    compression, data = self._chunk_payload(
+                        chunks[submitted].pos)
+                    if compression != "none":
+                        futures[submitted] = executor.submit(
+                            decompress, data, compression)
+                    submitted += 1
+                while i < len(chunks) and (not heap or
+                                           chunks[i].start_time <= heap[0][0]):
+                    entries = self.chunk_entries(chunks[i], connections, start,
+                                                 end)
+                    if entries:
+                        loaded[i] = [None, len(entries)]
+                        for timestamp, offset, conn in entries:
+                            heapq.heappush(heap, (timestamp, i, offset, conn))
+                    elif i in futures:
+                        futures.pop(i).cancel()
+                    i += 1
+                if not heap:
+                    continue
+                timestamp, order, offset, conn = heapq.heappop(heap)
+                slot = loaded[order]
+                if slot[0] is None:
+                    if order in futures:
+                        slot[0] = memoryview(futures.pop(order).result())
+                    else:
+                        slot[0] = self.chunk_data(chunks[order])
+                chunk = slot[0]
+                slot[1] -= 1
+                if not slot[1]:
+                    del loaded[order]
+                yield self.message_at(chunk, offset, timestamp, conn)
+        finally:
+            for future in futures.values():
+                future.cancel()
+
+    def seek(self, t, topics=None):
+        """
+        Find the first message at or after a time.
+
+        When the per-connection index entries are loaded (e.g. from an
+        ``IndexCache``), they are binary-searched and only the chunk holding
+        the message is read. Otherwise, the chunks are binary-searched, and
+        only the index data of the chunks from that time onwards is read.
+
+        Parameters
+        ----------
+        t : float
+            The time, in seconds.
+        topics : Optional[str | List[str]]
+            The topics to consider. Default is every topic.
+
+        Returns
+        -------
+        Message | None
+            The first message, or None if there are no messages after the
+            time.
+
+        """
+        message_index = self.index.message_index
+        if message_index is None:
+            return next(iter(self.read_messages(topics, start=t)), None)
+
+        timestamp = to_nsec(t)
+        best = None
+        for conn in self.connection_ids(topics):
+            conn_index = message_index.get(conn)
+            if conn_index is None:
+                continue
+            i = bisect.bisect_left(conn_index.timestamps, timestamp)
+            if i < len(conn_index.timestamps):
+                candidate = (conn_index.timestamps[i],
+                             conn_index.chunk_positions[i],
+                             conn_index.offsets[i], conn)
+                if best is None or candidate < best:
+                    best = candidate
+        if best is None:
+            return None
+        timestamp, chunk_pos, offset, conn = best
+        compression, data = self._chunk_payload(chunk_pos)
+        chunk = memoryview(decompress(data, compression))
+        return self.message_at(chunk, offset, timestamp, conn)
+
+    def topic_table(self, topics=None, sizes=True):
+        """
+        Tabulate every message per topic, from the index alone.
+
+        The message payloads are never deserialized. The timestamps, chunk
+        positions and offsets come from the index data records, so they can
+        be served from an ``IndexCache``. Finding the message sizes needs
+        the chunks themselves: uncompressed chunks are read in place, but
+        compressed chunks have to be decompressed.
+
+        Parameters
+        ----------
+        topics : Optional[str | List[str]]
+            The topics to tabulate. Default is every topic.
+        sizes : Optional[Bool]
+            Fill in the size of every message. Default is True. Otherwise,
+            the sizes are zero.
+
+        Returns
+        -------
+        Dict[str, numpy.ndarray]
+            A structured array per topic, with the fields of
+            ``TOPIC_TABLE_FIELDS``, ordered by time.
+
+        Raises
+        ------
+        BagError
+            If NumPy is not installed.
+
+        """
+        if np is None:
+            raise BagError("NumPy is needed to build topic tables.")
+        message_index = self.index.load_message_index()
+        dtype = np.dtype(TOPIC_TABLE_FIELDS)
+        conns = sorted(self.connection_ids(topics))
+        columns = []
+        for conn in conns:
+            conn_index = message_index.get(conn, ConnectionIndex([], [], []))
+            table = np.zeros(len(conn_index.timestamps), dtype)
+            table["timestamp"] = conn_index.timestamps
+            table["connection"] = conn
+            table["chunk_pos"] = conn_index.chunk_positions
+            table["offset"] = conn_index.offsets
+            columns.append(table)
+        table = np.concatenate(columns) if columns else np.zeros(0, dtype)
+        if sizes and len(table):
+            self._fill_sizes(table)
+
+        parts = {}
+        start = 0
+        for conn, column in zip(conns, columns):
+            end = start + len(column)
+            topic = self.index.connections[conn].topic
+            parts.setdefault(topic, []).append(table[start:end])
+            start = end
+        tables = {}
+        for topic, topic_parts in parts.items():
+            rows = np.concatenate(topic_parts)
+            tables[topic] = rows[np.argsort(rows["timestamp"], kind="stable")]
+        return tables
+
+    def _fill_sizes(self, table):
+        # A message data record starts with the length of its header,
+        # followed by the header and the length of its data. Both lengths
+        # are gathered for every message of a chunk at once.
+        positions, inverse = np.unique(table["chunk_pos"],
+                                       return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.cumsum(np.bincount(inverse))
+        four = np.arange(4)
+        for i, pos in enumerate(positions):
+            rows = order[bounds[i - 1] if i else 0:bounds[i]]
+            compression, data = self._chunk_payload(int(pos))
+            chunk = np.frombuffer(decompress(data, compression), np.uint8)
+            offsets = table["offset"][rows].astype(np.int64)
+            header_lens = chunk[offsets[:, None] + four].copy().view("<u4")
+            data_len_pos = offsets + 4 + header_lens[:, 0]
+            data_lens = chunk[data_len_pos[:, None] + four].copy().view("<u4")
+            table["size"][rows] = data_lens[:, 0]
+
+    def __repr__(self):
+        return "<BagReader({})>".format(self.index.filename)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compress, decompress and reindex many bag files in parallel.
+
+Each file is rewritten to a temporary file next to its destination, which
+is flushed to disk and renamed over the destination only once it is
+complete, so neither an interrupted run nor a power loss leaves a partial
+bag file behind. Files are processed by a pool of
+processes, since compression is CPU-bound.
+
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from time import monotonic
+
+from .bagfile import BagReader
+from .exceptions import BagError
+from .repair import BACKUP_SUFFIX, PARTIAL_SUFFIX, reindex_bag
+from .writer import BagWriter, replace_file
+
+
+logger = logging.getLogger("bag_player.batch")
+
+#: The operations which can be applied to bag files.
+OPERATIONS = ("compress", "decompress", "reindex")
+
+
+class ConversionResult(namedtuple("ConversionResult", [
+        "filename", "output", "operation", "bytes_in", "bytes_out",
+        "elapsed", "error"])):
+    """
+    The outcome of rewriting one bag file.
+
+    Attributes
+    ----------
+    filename : str
+        The bag file read.
+    output : str
+        The bag file written.
+    operation : str
+        One of ``OPERATIONS``.
+    bytes_in : int
+        The size of the bag file read, in bytes.
+    bytes_out : int
+        The size of the bag file written, in bytes, or 0 on failure.
+    elapsed : float
+        The time taken, in seconds.
+    error : str | None
+        A description of the failure, if any.
+
+    """
+    __slots__ = ()
+
+    @property
+    def succeeded(self):
+        """
+        Check whether the bag file was rewritten.
+
+        Returns
+        -------
+        bool
+            The output is complete.
+
+        """
+        return self.error is None
+
+    @property
+    def megabytes_per_sec(self):
+        """
+        The throughput, in megabytes read per second.
+
+        Returns
+        -------
+        float
+            The throughput.
+
+        """
+        return self.bytes_in / 1e6 / self.elapsed if self.elapsed else 0.0
+
+
+def _copy_connections(reader, writer):
+    for conn, connection in sorted(reader.index.connections.items()):
+        writer.add_connection(connection.topic, connection.datatype,
+                              connection.md5sum, connection.msg_def,
+                              connection.header, conn)
+
+
+def recompress_bag(filename, out, compression):
+    """
+    Rewrite a bag file with another chunk compression.
+
+    Chunks which already use the compression are copied as they are. The
+    others are decompressed and compressed again, and their index data is
+    rebuilt from that of the original chunk.
+
+    Parameters
+    ----------
+    filename : str
+        The bag file to read.
+    out : str
+        The bag file to write.
+    compression : str
+        ``none``, ``bz2`` or ``lz4``.
+
+    """
+    with BagReader(filename) as reader:
+        with BagWriter(out, compression) as writer:
+            _copy_connections(reader, writer)
+            for chunk in reader.index.chunk_infos:
+                chunk_compression, records = reader.raw_chunk(chunk)
+                if chunk_compression == compression:
+                    writer.copy_chunk(chunk, records)
+                else:
+                    writer.write_chunk(reader.chunk_data(chunk),
+                                       reader.chunk_entries(chunk))
+
+
+def convert(filename, operation, compression="bz2", output=None):
+    """
+    Rewrite a bag file through a temporary file.
+
+    Parameters
+    ----------
+    filename : str
+        The bag file.
+    operation : str
+        One of ``OPERATIONS``.
+    compression : Optional[str]
+        The compression used by ``compress``. Default is bz2, like
+        ``rosbag compress``.
+    output : Optional[str]
+        The bag file to write. Default is to replace the original.
+
+    Returns
+    -------
+    ConversionResult
+        The outcome. Errors are reported rather than raised.
+
+    """
+    output = output or filename
+    start = monotonic()
+    temp = None
+    bytes_in = 0
+    try:
+        if operation not in OPERATIONS:
+            raise BagError("Unknown operation: {}".format(operation))
+        bytes_in = os.path.getsize(filename)
+        fd, temp = tempfile.mkstemp(
+            prefix=".", suffix=".bag.tmp",
+            dir=os.path.dirname(os.path.abspath(output)))
+        os.close(fd)
+        if operation == "reindex":
+            reindex_bag(filename, temp)
+        else:
+            recompress_bag(filename, temp, compression
+                           if operation == "compress" else "none")
+        shutil.copymode(filename, temp)
+        bytes_out = os.path.getsize(temp)
+        replace_file(temp, output)
+    except Exception as e:
+        if temp is not None and os.path.exists(temp):
+            os.remove(temp)
+        logger.error("Could not %s %s: %s", operation, filename, e)
+        return ConversionResult(filename, output, operation, bytes_in, 0,
+                                monotonic() - start, str(e) or repr(e))
+    result = ConversionResult(filename, output, operation, bytes_in,
+                              bytes_out, monotonic() - start, None)
+    logger.info("%s %s: %.1f MB/s", operation, filename,
+                result.megabytes_per_sec)
+    return result
+
+
+def find_bags(source):
+    """
+    List the bag files to process.
+
+    Parameters
+    ----------
+    source : str | List[str]
+        A directory, in which every ``.bag`` file is taken, a glob pattern,
+        or a list of files.
+
+    Returns
+    -------
+    List[str]
+        The bag files. Those found in a directory or with a pattern are
+        sorted, and leave out the backups and partial files of
+        ``fix_bag``. A list is kept as it is.
+
+    """
+    if not isinstance(source, str):
+        return list(source)
+    if os.path.isdir(source):
+        source = os.path.join(source, "*.bag")
+    return sorted(filename for filename in glob.glob(source)
+                  if not filename.endswith((BACKUP_SUFFIX, PARTIAL_SUFFIX)))
+
+
+def batch_convert(source, operation, compression="bz2", workers=None,
+                  output_dir=None, callback=None):
+    """
+    Compress, decompress or reindex many bag files in parallel.
+
+    Parameters
+    ----------
+    source : str | List[str]
+        A directory, a glob pattern, or a list of bag files.
+    operation : str
+        One of ``OPERATIONS``.
+    compression : Optional[str]
+        The compression used by ``compress``: ``bz2`` or ``lz4``. Default is
+        bz2, like ``rosbag compress``.
+    workers : Optional[int]
+        The number of processes. Default is the number of CPUs. With a
+        single worker, the files are processed in this process.
+    output_dir : Optional[str]
+        The directory in which to write the bag files. Default is to
+        replace the originals.
+    callback : Optional[Callable[[ConversionResult], None]]
+        Called with the outcome of every file, as soon as it is done.
+
+    Returns
+    -------
+    List[ConversionResult]
+        The outcome of every file, in the order of ``find_bags``.
+
+    Raises
+    ------
+    BagError
+        If the operation is unknown, or if several bag files would be
+        written to the same file of output_dir.
+
+    """
+    if operation not in OPERATIONS:
+        raise BagError("Unknown operation: {}".format(operation))
+    filenames = find_bags(source)
+    outputs = [None if output_dir is None else
+               os.path.join(output_dir, os.path.basename(filename))
+               for filename in filenames]
+    if output_dir is not None:
+        seen = {}
+        for filename, output in zip(filenames, outputs):
+            if output in seen:
+                raise BagError("{} and {} would both be written to {}."
+                               .format(seen[output], filename, output))
+            seen[output] = filename
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(filenames)))
+
+    results = [None] * len(filenames)
+    if workers == 1:
+        for i, (filename, output) in enumerate(zip(filenames, outputs)):
+            results[i] = convert(filename, operation, compression, output)
+            if callback is not None:
+                callback(results[i])
+        return results
+
+    with ProcessPoolExecutor(workers) as executor:
+        futures = dict((executor.submit(convert, filename, operation,
+                                        compression, output), i)
+                       for i, (filename, output)
+                       in enumerate(zip(filenames, outputs)))
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if callback is not None:
+                callback(results[futures[future]])
+    return results
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Keep bag file indexes on disk between runs.
+
+An ``IndexCache`` stores the index of every bag file it loads, including the
+per-connection index entries, in a cache directory. An entry is reused as
+long as the size and modification time of its bag file are unchanged, and
+it was written by a compatible version of ``BagIndex``. Once
+the cache grows past its size budget, the least recently used entries are
+evicted. The size of the cache is only measured once, and then kept up to
+date as entries are stored, so that storing an entry does not list the
+whole directory.
+
+"""
+import errno
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+from .bagfile import BagIndex
+
+
+logger = logging.getLogger("bag_player.cache")
+
+DEFAULT_DIRECTORY = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join("~", ".cache")),
+    "pyrosbag")
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+SUFFIX = ".idx"
+#: The format of the cache entries. Bump it whenever ``BagIndex`` changes.
+CACHE_VERSION = 2
+
+
+def file_signature(filename):
+    """
+    Identify the version of a bag file by its size and modification time.
+
+    Parameters
+    ----------
+    filename : str
+        The location of the bag file.
+
+    Returns
+    -------
+    Tuple[int, int]
+        The size, in bytes, and the modification time, in nanoseconds.
+
+    """
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class IndexCache(object):
+    """
+    A persistent cache of bag file indexes.
+
+    Parameters
+    ----------
+    directory : Optional[str]
+        The cache directory. Default is ``~/.cache/pyrosbag``.
+    max_size : Optional[int]
+        The size budget of the cache, in bytes. Default is 256 MiB.
+
+    Attributes
+    ----------
+    directory : str
+        The cache directory.
+    max_size : int
+        The size budget of the cache, in bytes.
+
+    """
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+        if directory is None:
+            directory = DEFAULT_DIRECTORY
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_size = max_size
+        self._size = None
+
+    def _entry(self, filename):
+        key = hashlib.sha1(os.path.abspath(filename).encode("utf-8"))
+        return os.path.join(self.directory, key.hexdigest() + SUFFIX)
+
+    def get(self, filename):
+        """
+        Get the cached index of a bag file.
+
+        Parameters
+        ----------
+        filename : str
+            The location of the bag file.
+
+        Returns
+        -------
+        BagIndex | None
+            The index, or None if it is not cached or is out of date.
+
+        """
+        entry = self._entry(filename)
+        try:
+            with open(entry, "rb") as entry_file:
+                state = pickle.load(entry_file)
+        except (IOError, OSError):
+            return None
+        except Exception as e:
+            logger.warning("Discarding corrupt cache entry %s: %s", entry, e)
+            self._remove(entry)
+            return None
+
+        if not isinstance(state, tuple) or state[0] != CACHE_VERSION:
+            logger.debug("Discarding outdated cache entry %s.", entry)
+            self._remove(entry)
+            return None
+        _, path, signature, index = state
+        if (path != os.path.abspath(filename) or
+                signature != file_signature(filename)):
+            self._remove(entry)
+            return None
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass
+        index.filename = filename
+        return index
+
+    def put(self, index, signature=None):
+        """
+        Store the index of a bag file.
+
+        Parameters
+        ----------
+        index : BagIndex
+            The index to store.
+        signature : Optional[Tuple[int, int]]
+            The ``file_signature`` of the bag file, taken before the index
+            was read, so that a file changed in the meantime is not cached
+            as up to date. Default is to take it now.
+
+        """
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        entry = self._entry(index.filename)
+        if signature is None:
+            signature = file_signature(index.filename)
+        state = (CACHE_VERSION, os.path.abspath(index.filename), signature,
+                 index)
+        if self._size is None:
+            self._size = self.size
+        try:
+            self._size -= os.path.getsize(entry)
+        except OSError:
+            pass
+        handle, temp_name = tempfile.mkstemp(dir=self.directory,
+                                             suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as entry_file:
+                pickle.dump(state, entry_file, pickle.HIGHEST_PROTOCOL)
+                self._size += entry_file.tell()
+            os.rename(temp_name, entry)
+        except Exception:
+            self._remove(temp_name)
+            raise
+        # Entries written by other processes are only noticed on eviction,
+        # so the size kept may fall short of the true one in the meantime.
+        if self._size > self.max_size:
+            self.evict()
+
+    def load(self, filename):
+        """
+        Get the index of a bag file, reading and caching it if needed.
+
+        The per-connection index entries are loaded before caching.
+
+        Parameters
+        ----------
+        filename : str
+            The location of the bag file.
+
+        Returns
+        -------
+        BagIndex
+            The index.
+
+        """
+        index = self.get(filename)
+        if index is None:
+            signature = file_signature(filename)
+            index = BagIndex(filename)
+            index.load_message_index()
+            self.put(index, signature)
+        return index
+
+    def _entries(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    @property
+    def size(self):
+        """
+        The total size of the cache entries.
+
+        Returns
+        -------
+        int
+            The size of the cache, in bytes.
+
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits its
+        size budget.
+
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+        self._size = total
+
+    def clear(self):
+        """
+        Remove every entry.
+
+        """
+        for _, _, path in self._entries():
+            self._remove(path)
+        self._size = 0
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def __repr__(self):
+        return "<IndexCache({})>".format(self.directory)
@@ -0,0 +1,495 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Convert the messages of a bag file into columns, and export them to Parquet.
+
+Every topic becomes a table, with one row per message and one column per
+field. Nested messages are flattened into dotted column names, such as
+``header.stamp``, and every table starts with the ``timestamp`` column, the
+recording time in nanoseconds. Arrays stay in a single column, as lists, and
+arrays of ``uint8`` as bytes.
+
+Messages are streamed, and each table is cut into batches of bounded size,
+so memory use does not depend on the size of the bag file. When exporting,
+each batch is written as a Parquet row group, and topics are exported in
+parallel by a pool of processes, each reading only the chunks which hold its
+topic. Writing Parquet files needs pyarrow.
+
+"""
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import chain
+import logging
+import multiprocessing
+import os
+import tempfile
+from time import monotonic
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from .bagfile import BagIndex, BagReader, merge_messages
+from .decoder import PRIMITIVES, TIMES, MessageView, get_decoder
+from .exceptions import BagError
+
+
+logger = logging.getLogger("bag_player.columns")
+
+#: The default amount of serialized message data per batch, in bytes.
+ROW_GROUP_SIZE = 32 * 1024 * 1024
+
+#: The NumPy type of the columns of every primitive type.
+NUMPY_TYPES = dict((name, "<" + fmt) for name, fmt in PRIMITIVES.items())
+NUMPY_TYPES.update(time="<i8", duration="<i8")
+
+
+class ColumnBatch(namedtuple("ColumnBatch", ["topic", "datatype",
+                                             "columns"])):
+    """
+    Consecutive messages of a topic, as columns.
+
+    Attributes
+    ----------
+    topic : str
+        The topic.
+    datatype : str
+        The message type.
+    columns : OrderedDict[str, numpy.ndarray | list]
+        The values of every column, by name, starting with ``timestamp``.
+        Columns of numbers and times are NumPy arrays, if NumPy is
+        installed.
+
+    """
+    __slots__ = ()
+
+    @property
+    def rows(self):
+        """
+        The number of messages in the batch.
+
+        """
+        return len(self.columns["timestamp"])
+
+
+class ExportResult(namedtuple("ExportResult", ["topic", "output", "rows",
+                                               "row_groups", "elapsed",
+                                               "error"])):
+    """
+    The outcome of exporting one topic.
+
+    Attributes
+    ----------
+    topic : str
+        The topic.
+    output : str
+        The Parquet file. It is not written if there are no messages.
+    rows : int
+        The number of messages written.
+    row_groups : int
+        The number of row groups written.
+    elapsed : float
+        The time taken, in seconds.
+    error : str | None
+        A description of the failure, if any.
+
+    """
+    __slots__ = ()
+
+    @property
+    def succeeded(self):
+        """
+        Check whether the topic was exported.
+
+        Returns
+        -------
+        bool
+            The output is complete.
+
+        """
+        return self.error is None
+
+    @property
+    def rows_per_sec(self):
+        """
+        The throughput, in messages per second.
+
+        Returns
+        -------
+        float
+            The throughput.
+
+        """
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def column_names(decoder):
+    """
+    List the columns of a message type, without the timestamp.
+
+    Parameters
+    ----------
+    decoder : MessageDecoder
+        The decoder of the message type.
+
+    Returns
+    -------
+    List[str]
+        The dotted names of the flattened fields.
+
+    """
+    return [".".join(path) for path, _, _ in _flatten(decoder)]
+
+
+def _flatten(decoder, prefix=()):
+    # Yields the path of every column, with its field and nested decoder.
+    for field, nested in zip(decoder.fields, decoder.nested):
+        path = prefix + (field.name,)
+        if nested is None or field.is_array:
+            yield path, field, nested
+        else:
+            for column in _flatten(nested, path):
+                yield column
+
+
+def _plain(value):
+    # Copies a value out of the message data, so that it outlives it.
+    if isinstance(value, MessageView):
+        return dict((name, _plain(getattr(value, name)))
+                    for name in value._fields)
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    if np is not None and isinstance(value, np.ndarray):
+        return value.tobytes() if value.dtype == np.uint8 else value.copy()
+    return value
+
+
+class _TopicColumns(object):
+    # Accumulates the messages of a topic, until a batch is full.
+    def __init__(self, topic, decoder):
+        self.topic = topic
+        self.decoder = decoder
+        self.columns = list(_flatten(decoder))
+        self.clear()
+
+    def clear(self):
+        self.timestamps = []
+        self.values = [[] for _ in self.columns]
+        self.size = 0
+
+    def append(self, message, view):
+        self.timestamps.append(message.timestamp)
+        for (path, field, _), values in zip(self.columns, self.values):
+            value = view
+            for name in path:
+                value = getattr(value, name)
+            if field.is_array:
+                value = _plain(value)
+            values.append(value)
+        self.size += len(message.data)
+
+    def batch(self):
+        columns = OrderedDict()
+        columns["timestamp"] = self._column(self.timestamps, "uint64")
+        for (path, field, _), values in zip(self.columns, self.values):
+            if not field.is_array:
+                values = self._column(values, field.type)
+            columns[".".join(path)] = values
+        self.clear()
+        return ColumnBatch(self.topic, self.decoder.datatype, columns)
+
+    @staticmethod
+    def _column(values, field_type):
+        if np is None or field_type not in NUMPY_TYPES:
+            return values
+        return np.array(values, NUMPY_TYPES[field_type])
+
+
+def iter_columns(messages, row_group_size=ROW_GROUP_SIZE):
+    """
+    Gather a stream of messages into column batches, per topic.
+
+    Each topic is buffered separately. A batch is emitted as soon as the
+    serialized messages in it reach the row group size, and every partial
+    batch is emitted at the end, or when the message type of its topic
+    changes.
+
+    Parameters
+    ----------
+    messages : Iterable[Message]
+        The messages.
+    row_group_size : Optional[int]
+        The amount of serialized message data per batch, in bytes.
+
+    Yields
+    ------
+    ColumnBatch
+        The batches.
+
+    Raises
+    ------
+    BagFormatError
+        If a message definition cannot be parsed.
+
+    """
+    topics = OrderedDict()
+    for message in messages:
+        decoder = get_decoder(message.connection)
+        columns = topics.get(message.topic)
+        if columns is None or columns.decoder is not decoder:
+            if columns is not None and columns.timestamps:
+                yield columns.batch()
+            columns = topics[message.topic] = _TopicColumns(message.topic,
+                                                            decoder)
+        columns.append(message, decoder.view(message.data))
+        if columns.size >= row_group_size:
+            yield columns.batch()
+    for columns in topics.values():
+        if columns.timestamps:
+            yield columns.batch()
+
+
+def arrow_schema(decoder):
+    """
+    Build the Arrow schema of the table of a message type.
+
+    Parameters
+    ----------
+    decoder : MessageDecoder
+        The decoder of the message type.
+
+    Returns
+    -------
+    pyarrow.Schema
+        The schema, with the columns of ``ColumnBatch``.
+
+    Raises
+    ------
+    BagError
+        If pyarrow is not installed.
+
+    """
+    if pa is None:
+        raise BagError("pyarrow is needed to export Parquet files.")
+    fields = [pa.field("timestamp", pa.uint64())]
+    for path, field, nested in _flatten(decoder):
+        fields.append(pa.field(".".join(path), _arrow_type(field, nested)))
+    return pa.schema(fields)
+
+
+def _arrow_type(field, nested):
+    if field.type in PRIMITIVES:
+        if field.is_array and field.type in ("uint8", "char"):
+            return pa.binary()
+        element = getattr(pa, {"bool": "bool_", "byte": "int8",
+                               "char": "uint8"}.get(field.type, field.type))()
+    elif field.type in TIMES:
+        element = pa.int64()
+    elif field.type == "string":
+        element = pa.string()
+    else:
+        element = pa.struct([
+            pa.field(nested_field.name, _arrow_type(nested_field, decoder))
+            for nested_field, decoder in zip(nested.fields, nested.nested)])
+    if not field.is_array:
+        return element
+    return pa.list_(element, field.array_length or -1)
+
+
+def export_topic(filenames, topic, output, start=None, end=None,
+                 row_group_size=ROW_GROUP_SIZE, compression="snappy"):
+    """
+    Export one topic of bag files to a Parquet file.
+
+    The file is written to a temporary file next to the output, which is
+    renamed once it is complete.
+
+    Parameters
+    ----------
+    filenames : str | List[str]
+        The bag files.
+    topic : str
+        The topic.
+    output : str
+        The Parquet file.
+    start : Optional[float]
+        The earliest message time, in seconds since the epoch.
+    end : Optional[float]
+        The latest message time, in seconds since the epoch.
+    row_group_size : Optional[int]
+        The amount of serialized message data per row group, in bytes.
+    compression : Optional[str]
+        The Parquet compression. Default is snappy.
+
+    Returns
+    -------
+    ExportResult
+        The outcome. Errors are reported rather than raised.
+
+    """
+    start_time = monotonic()
+    temp = writer = None
+    rows = row_groups = 0
+    source = _read_messages(filenames, topic, start, end)
+    try:
+        if pq is None:
+            raise BagError("pyarrow is needed to export Parquet files.")
+        first = next(source, None)
+        if first is not None:
+            schema = arrow_schema(get_decoder(first.connection))
+        messages = chain([first] if first is not None else [], source)
+        for batch in iter_columns(messages, row_group_size):
+            if writer is None:
+                fd, temp = tempfile.mkstemp(
+                    prefix=".", suffix=".parquet.tmp",
+                    dir=os.path.dirname(os.path.abspath(output)))
+                os.close(fd)
+                writer = pq.ParquetWriter(temp, schema,
+                                          compression=compression)
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, field.type) for values, field
+                 in zip(batch.columns.values(), schema)], schema=schema))
+            rows += batch.rows
+            row_groups += 1
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.rename(temp, output)
+    except Exception as e:
+        if writer is not None:
+            writer.close()
+        if temp is not None and os.path.exists(temp):
+            os.remove(temp)
+        logger.error("Could not export %s: %s", topic, e)
+        return ExportResult(topic, output, rows, row_groups,
+                            monotonic() - start_time, str(e) or repr(e))
+    finally:
+        source.close()
+    result = ExportResult(topic, output, rows, row_groups,
+                          monotonic() - start_time, None)
+    logger.info("Exported %s: %.0f messages/s", topic, result.rows_per_sec)
+    return result
+
+
+def _read_messages(filenames, topics, start, end):
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    readers = [BagReader(filename) for filename in filenames]
+    try:
+        for message in merge_messages([reader.read_messages(topics, start, end)
+                                       for reader in readers]):
+            yield message
+    finally:
+        for reader in readers:
+            reader.close()
+
+
+def parquet_filename(topic):
+    """
+    Name the Parquet file of a topic.
+
+    Parameters
+    ----------
+    topic : str
+        The topic, such as "/camera/image_raw".
+
+    Returns
+    -------
+    str
+        The file name, such as "camera__image_raw.parquet".
+
+    """
+    return topic.strip("/").replace("/", "__") + ".parquet"
+
+
+def export_parquet(filenames, directory, topics=None, start=None, end=None,
+                   workers=None, row_group_size=ROW_GROUP_SIZE,
+                   compression="snappy", callback=None):
+    """
+    Export the topics of bag files to Parquet files, in parallel.
+
+    Each topic is written to its own file in the directory, named by
+    ``parquet_filename``. The topics with the most messages are started
+    first.
+
+    Parameters
+    ----------
+    filenames : str | List[str]
+        The bag files.
+    directory : str
+        The directory in which to write the Parquet files.
+    topics : Optional[str | List[str]]
+        The topics to export. Default is every topic.
+    start : Optional[float]
+        The earliest message time, in seconds since the epoch.
+    end : Optional[float]
+        The latest message time, in seconds since the epoch.
+    workers : Optional[int]
+        The number of processes. Default is the number of CPUs. With a
+        single worker, the topics are exported in this process.
+    row_group_size : Optional[int]
+        The amount of serialized message data per row group, in bytes.
+        This bounds the memory used by each worker.
+    compression : Optional[str]
+        The Parquet compression. Default is snappy.
+    callback : Optional[Callable[[ExportResult], None]]
+        Called with the outcome of every topic, as soon as it is done.
+
+    Returns
+    -------
+    List[ExportResult]
+        The outcome of every topic, sorted by topic.
+
+    Raises
+    ------
+    BagError
+        If pyarrow is not installed.
+
+    """
+    if pq is None:
+        raise BagError("pyarrow is needed to export Parquet files.")
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    counts = {}
+    for filename in filenames:
+        for topic, topic_info in BagIndex(filename).info().topics.items():
+            counts[topic] = counts.get(topic, 0) + topic_info.message_count
+    if topics is None:
+        topics = sorted(counts)
+    elif isinstance(topics, str):
+        topics = [topics]
+    else:
+        topics = sorted(topics)
+    order = sorted(range(len(topics)),
+                   key=lambda i: -counts.get(topics[i], 0))
+    outputs = [os.path.join(directory, parquet_filename(topic))
+               for topic in topics]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(topics)))
+
+    args = (start, end, row_group_size, compression)
+    results = [None] * len(topics)
+    if workers == 1:
+        for i in order:
+            results[i] = export_topic(filenames, topics[i], outputs[i], *args)
+            if callback is not None:
+                callback(results[i])
+        return results
+
+    with ProcessPoolExecutor(workers) as executor:
+        futures = dict((executor.submit(export_topic, filenames, topics[i],
+                                        outputs[i], *args), i)
+                       for i in order)
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if callback is not None:
+                callback(results[futures[future]])
+    return results
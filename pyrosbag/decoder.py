@@ -0,0 +1,534 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Deserialize messages lazily, from the definitions stored in bag files.
+
+Every connection record holds the full text of its message definition, so
+messages can be decoded without ROS or generated message classes. A decoder
+is compiled once per message definition, and cached by its MD5 sum. It builds
+a ``MessageView`` class with one property per field. A view wraps the
+serialized message, and only decodes a field when it is first accessed:
+
+* Fixed-size messages made only of numbers, such as ``geometry_msgs/Point``,
+  are decoded with a single ``struct.Struct``.
+* The other fields are found by skipping over the fields before them, without
+  decoding them, and their offsets are remembered.
+* Arrays of numbers, such as images and point clouds, are NumPy views into
+  the serialized message, when NumPy is installed.
+
+Times and durations are decoded as integers, in nanoseconds.
+
+"""
+from collections import namedtuple
+import re
+import struct
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .exceptions import BagFormatError
+
+
+#: The struct format of every primitive type, except strings and times.
+PRIMITIVES = {
+    "bool": "?",
+    "int8": "b",
+    "uint8": "B",
+    "byte": "b",
+    "char": "B",
+    "int16": "h",
+    "uint16": "H",
+    "int32": "i",
+    "uint32": "I",
+    "int64": "q",
+    "uint64": "Q",
+    "float32": "f",
+    "float64": "d",
+}
+TIMES = {
+    "time": struct.Struct("<II"),
+    "duration": struct.Struct("<ii"),
+}
+BUILTINS = set(PRIMITIVES) | set(TIMES) | {"string"}
+
+UINT32 = struct.Struct("<I")
+NSEC_PER_SEC = 1000000000
+SEPARATOR = re.compile(r"^={3,}\s*$", re.MULTILINE)
+SECTION = re.compile(r"\s*MSG:\s*(\S+)")
+DECLARATION = re.compile(r"([\w/]+)(?:\[(\d*)\])?\s+(\w+)\s*(.*)$")
+
+_MISSING = object()
+_decoders = {}
+
+
+Field = namedtuple("Field", ["name", "type", "is_array", "array_length"])
+Field.__doc__ = """
+    A field of a message definition.
+
+    Attributes
+    ----------
+    name : str
+        The name of the field.
+    type : str
+        The type of the field, or of its elements, with its package.
+    is_array : bool
+        The field is an array.
+    array_length : int | None
+        The length of a fixed-length array, or None.
+
+"""
+
+
+def parse_definition(datatype, msg_def):
+    """
+    Parse a full message definition, as stored in a connection record.
+
+    The definition of the message type comes first, followed by the
+    definition of every type it uses, each after a line of ``=`` and a
+    ``MSG: package/Type`` line.
+
+    Parameters
+    ----------
+    datatype : str
+        The message type, such as "sensor_msgs/Image".
+    msg_def : str
+        The message definition.
+
+    Returns
+    -------
+    Dict[str, Tuple[List[Field], Dict[str, object]]]
+        The fields and constants of every type in the definition.
+
+    Raises
+    ------
+    BagFormatError
+        If the definition cannot be parsed.
+
+    """
+    types = {}
+    for i, section in enumerate(SEPARATOR.split(msg_def)):
+        name = datatype
+        if i:
+            match = SECTION.match(section)
+            if match is None:
+                raise BagFormatError(
+                    "Definition of {} has a section without a MSG line."
+                    .format(datatype))
+            name = match.group(1)
+            section = section[match.end():]
+        types[name] = _parse_fields(name, section)
+    return types
+
+
+def _parse_fields(datatype, text):
+    package = datatype.split("/")[0]
+    fields = []
+    constants = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        match = DECLARATION.match(line)
+        if match is None:
+            raise BagFormatError("Cannot parse {!r} in the definition of {}."
+                                 .format(line, datatype))
+        field_type, length, name, rest = match.groups()
+        if rest.startswith("="):
+            value = rest[1:]
+            if field_type != "string":
+                value = value.split("#")[0]
+            constants[name] = _constant(field_type, value.strip())
+        elif rest and not rest.startswith("#"):
+            raise BagFormatError("Cannot parse {!r} in the definition of {}."
+                                 .format(line, datatype))
+        else:
+            fields.append(Field(name, _resolve(field_type, package),
+                                length is not None,
+                                int(length) if length else None))
+    return fields, constants
+
+
+def _resolve(field_type, package):
+    if field_type in BUILTINS or "/" in field_type:
+        return field_type
+    if field_type == "Header":
+        return "std_msgs/Header"
+    return "{}/{}".format(package, field_type)
+
+
+def _constant(field_type, value):
+    if field_type == "string":
+        return value
+    if field_type == "bool":
+        return value.lower() in ("1", "true")
+    if field_type.startswith("float"):
+        return float(value)
+    return int(value)
+
+
+class MessageView(object):
+    """
+    A serialized message, whose fields are decoded when accessed.
+
+    Each message type has its own subclass, built by its ``MessageDecoder``,
+    with a read-only property per field and an attribute per constant. A
+    decoded field is kept, so it is only decoded once per view.
+
+    Parameters
+    ----------
+    data : buffer
+        The buffer holding the serialized message. It must stay valid while
+        the view is used.
+    pos : Optional[int]
+        The position of the message in the buffer.
+
+    Attributes
+    ----------
+    _type : str
+        The message type.
+    _md5sum : str
+        The MD5 sum of the message definition.
+    _fields : Tuple[str]
+        The names of the fields, in order.
+
+    """
+    __slots__ = ("_data", "_pos", "_offsets", "_values")
+    _type = None
+    _md5sum = None
+    _fields = ()
+    _decoder = None
+
+    def __init__(self, data, pos=0):
+        self._data = data
+        self._pos = pos
+        self._offsets = None
+        self._values = [_MISSING] * len(self._fields)
+
+    def _asdict(self):
+        """
+        Decode every field.
+
+        Returns
+        -------
+        Dict[str, object]
+            The value of every field, by name. Nested messages are views.
+
+        """
+        return dict((name, getattr(self, name)) for name in self._fields)
+
+    def __repr__(self):
+        return "{}({})".format(self._type, ", ".join(
+            "{}={!r}".format(name, getattr(self, name))
+            for name in self._fields))
+
+
+def _field_property(index, name):
+    def get(self):
+        value = self._values[index]
+        if value is _MISSING:
+            value = self._decoder.read(self, index)
+        return value
+    get.__name__ = name
+    return property(get)
+
+
+class MessageDecoder(object):
+    """
+    The decoder of a message type, compiled from its definition.
+
+    Parameters
+    ----------
+    datatype : str
+        The message type.
+    types : Dict[str, Tuple[List[Field], Dict[str, object]]]
+        The parsed definition, from ``parse_definition``.
+    md5sum : Optional[str]
+        The MD5 sum of the definition.
+
+    Attributes
+    ----------
+    datatype : str
+        The message type.
+    fields : List[Field]
+        The fields of the message.
+    nested : List[MessageDecoder | None]
+        The decoder of every field which is a message, or array of messages.
+    size : int | None
+        The size of a serialized message, if it is fixed.
+    struct : struct.Struct | None
+        Decodes the whole message at once, if it is made only of numbers.
+    view : type
+        The ``MessageView`` subclass of the message type.
+
+    Raises
+    ------
+    BagFormatError
+        If the definition of a type is missing.
+
+    """
+    def __init__(self, datatype, types, md5sum=None, _compiled=None):
+        compiled = {} if _compiled is None else _compiled
+        compiled[datatype] = self
+        try:
+            self.fields, constants = types[datatype]
+        except KeyError:
+            raise BagFormatError(
+                "The definition of {} is missing.".format(datatype))
+        self.datatype = datatype
+
+        self.nested = []
+        self._readers = []
+        self._skips = []
+        sizes = []
+        for field in self.fields:
+            nested = None
+            if field.type not in BUILTINS:
+                nested = compiled.get(field.type)
+                if nested is None:
+                    nested = MessageDecoder(field.type, types, None, compiled)
+            self.nested.append(nested)
+            size, read, skip = _codec(field, nested)
+            if skip is None:
+                skip = _fixed_skip(size)
+            sizes.append(size)
+            self._readers.append(read)
+            self._skips.append(skip)
+
+        # The offsets of the fields up to the first one of variable size are
+        # the same in every message.
+        self._offsets = [0]
+        for size in sizes:
+            if size is None:
+                break
+            self._offsets.append(self._offsets[-1] + size)
+        self.size = self._offsets[-1] if None not in sizes else None
+
+        self.struct = None
+        if all(not field.is_array and field.type in PRIMITIVES
+               for field in self.fields):
+            self.struct = struct.Struct("<" + "".join(
+                PRIMITIVES[field.type] for field in self.fields))
+
+        attrs = dict(constants)
+        attrs.update((field.name, _field_property(i, field.name))
+                     for i, field in enumerate(self.fields))
+        attrs.update(__slots__=(), _type=datatype, _md5sum=md5sum,
+                     _decoder=self,
+                     _fields=tuple(field.name for field in self.fields))
+        self.view = type(str(datatype.replace("/", "__")), (MessageView,),
+                         attrs)
+
+    def read(self, view, index):
+        """
+        Decode a field of a view, and keep its value.
+
+        Parameters
+        ----------
+        view : MessageView
+            The message.
+        index : int
+            The index of the field.
+
+        Returns
+        -------
+        object
+            The value of the field.
+
+        """
+        if self.struct is not None:
+            view._values[:] = self.struct.unpack_from(view._data, view._pos)
+            return view._values[index]
+        offsets = self._offsets
+        if index >= len(offsets):
+            offsets = view._offsets
+            if offsets is None:
+                offsets = view._offsets = list(self._offsets)
+            while len(offsets) <= index:
+                i = len(offsets) - 1
+                offsets.append(self._skips[i](view._data, view._pos +
+                                              offsets[i]) - view._pos)
+        value = self._readers[index](view._data, view._pos + offsets[index])
+        view._values[index] = value
+        return value
+
+    def skip(self, data, pos):
+        """
+        Find the end of a serialized message.
+
+        Parameters
+        ----------
+        data : buffer
+            The buffer holding the message.
+        pos : int
+            The position of the message in the buffer.
+
+        Returns
+        -------
+        int
+            The position just after the message.
+
+        """
+        if self.size is not None:
+            return pos + self.size
+        end = pos + self._offsets[-1]
+        for skip in self._skips[len(self._offsets) - 1:]:
+            end = skip(data, end)
+        return end
+
+
+def _fixed_skip(size):
+    def skip(data, pos):
+        return pos + size
+    return skip
+
+
+def _codec(field, nested):
+    # Returns the fixed size of the field, or None, a function decoding it,
+    # and a function finding its end.
+    size, read, skip = _element_codec(field.type, nested)
+    if not field.is_array:
+        return size, read, skip
+
+    length = field.array_length
+    if length is None:
+        def bounds(data, pos):
+            return UINT32.unpack_from(data, pos)[0], pos + 4
+    else:
+        def bounds(data, pos):
+            return length, pos
+
+    if field.type in PRIMITIVES:
+        fmt = PRIMITIVES[field.type]
+
+        def read_array(data, pos):
+            count, start = bounds(data, pos)
+            return _primitive_array(data, start, count, fmt)
+    elif size is not None:
+        def read_array(data, pos):
+            count, start = bounds(data, pos)
+            return [read(data, start + i * size) for i in range(count)]
+    else:
+        def read_array(data, pos):
+            count, pos = bounds(data, pos)
+            values = []
+            for _ in range(count):
+                values.append(read(data, pos))
+                pos = skip(data, pos)
+            return values
+
+    if size is not None:
+        if length is not None:
+            return length * size, read_array, None
+
+        def skip_array(data, pos):
+            count, start = bounds(data, pos)
+            return start + count * size
+    else:
+        def skip_array(data, pos):
+            count, pos = bounds(data, pos)
+            for _ in range(count):
+                pos = skip(data, pos)
+            return pos
+    return None, read_array, skip_array
+
+
+def _element_codec(field_type, nested):
+    if field_type in PRIMITIVES:
+        primitive = struct.Struct("<" + PRIMITIVES[field_type])
+
+        def read(data, pos):
+            return primitive.unpack_from(data, pos)[0]
+        return primitive.size, read, None
+
+    if field_type in TIMES:
+        time = TIMES[field_type]
+
+        def read(data, pos):
+            secs, nsecs = time.unpack_from(data, pos)
+            return secs * NSEC_PER_SEC + nsecs
+        return time.size, read, None
+
+    if field_type == "string":
+        def read(data, pos):
+            length, = UINT32.unpack_from(data, pos)
+            # A ROS string may hold any bytes, so invalid UTF-8 is replaced
+            # rather than raised.
+            return bytes(data[pos + 4:pos + 4 + length]).decode(
+                "utf-8", "replace")
+
+        def skip(data, pos):
+            return pos + 4 + UINT32.unpack_from(data, pos)[0]
+        return None, read, skip
+
+    return nested.size, nested.view, nested.skip
+
+
+def _primitive_array(data, start, count, fmt):
+    if np is not None:
+        return np.frombuffer(data, "<" + fmt, count, start)
+    if fmt == "B":
+        return memoryview(data)[start:start + count]
+    return struct.unpack_from("<{}{}".format(count, fmt), data, start)
+
+
+def get_decoder(connection):
+    """
+    Find the decoder of the messages of a connection.
+
+    Decoders are compiled on first use, and cached by message type and MD5
+    sum, so every connection with the same message definition shares a
+    decoder.
+
+    Parameters
+    ----------
+    connection : Connection
+        The connection.
+
+    Returns
+    -------
+    MessageDecoder
+        The decoder.
+
+    Raises
+    ------
+    BagFormatError
+        If the message definition cannot be parsed.
+
+    """
+    key = (connection.datatype, connection.md5sum)
+    if connection.md5sum in ("", "*"):
+        key += (connection.msg_def,)
+    decoder = _decoders.get(key)
+    if decoder is None:
+        decoder = MessageDecoder(
+            connection.datatype,
+            parse_definition(connection.datatype, connection.msg_def),
+            connection.md5sum)
+        decoder = _decoders.setdefault(key, decoder)
+    return decoder
+
+
+def deserialize(connection, data):
+    """
+    Wrap a serialized message in a lazily decoded view.
+
+    Parameters
+    ----------
+    connection : Connection
+        The connection on which the message was recorded.
+    data : buffer
+        The serialized message.
+
+    Returns
+    -------
+    MessageView
+        The message.
+
+    Raises
+    ------
+    BagFormatError
+        If the message definition cannot be parsed.
+
+    """
+    return get_decoder(connection).view(data)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Exceptions raised by ``pyrosbag``.
+
+"""
+
+
+class BagError(Exception):
+    """
+    Catch bag player exceptions.
+
+    """
+
+
+class MissingBagError(BagError):
+    """
+    Bag file was not specified.
+
+    """
+    msg = "No Bag files were specified."
+
+
+class BagNotRunningError(BagError):
+    """
+    Raised when interaction is attempted with a bag file which is not running.
+
+    """
+    def __init__(self, action="talk to"):
+        message = u"Cannot {} process while bag is not running.".format(action)
+        super(BagNotRunningError, self).__init__(message)
+
+
+class BagFormatError(BagError):
+    """
+    Raised when a file is not a valid bag file.
+
+    """
+
+
+class UnindexedBagError(BagFormatError):
+    """
+    Raised when a bag file has no index, e.g. after an interrupted recording.
+
+    """
+    def __init__(self, filename):
+        message = u"{} is not indexed. Reindex it first.".format(filename)
+        super(UnindexedBagError, self).__init__(message)
@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Play several bag files together, on a shared clock.
+
+Bag files recorded by different robots start at different times. A
+``BagPlayerGroup`` aligns them on their timestamps: every player is started
+paused, at the point of its bag files which corresponds to the position of
+the group, and only resumed once all of them are ready. Players whose bag
+files start later are kept paused, and resumed when the group reaches them.
+
+Pausing and resuming write the key to every player before waiting for any of
+them, so that they all change state within a fraction of a millisecond.
+``rosbag play`` cannot change its rate while running, so a new rate restarts
+every player at the current position of the group, paused, before resuming
+them together. Players whose bag files have already ended are not
+restarted.
+
+"""
+from collections import namedtuple
+import logging
+import threading
+from time import monotonic
+
+from .exceptions import BagError, BagNotRunningError
+from .pyrosbag import BagPlayer
+
+
+logger = logging.getLogger("bag_player.group")
+
+
+class SkewReport(namedtuple("SkewReport", ["positions", "skew",
+                                           "resume_window"])):
+    """
+    How far apart the players of a group are.
+
+    Attributes
+    ----------
+    positions : List[float | None]
+        The position of every player, in seconds since the reference time of
+        the group, extrapolated to the same instant. None for the players
+        which are not playing their bag files.
+    skew : float
+        The difference between the furthest and the least advanced players,
+        in seconds.
+    resume_window : float
+        The time it took to resume every player the last time, in seconds.
+
+    """
+    __slots__ = ()
+
+
+class BagPlayerGroup(object):
+    """
+    Play several sets of bag files in step with each other.
+
+    Parameters
+    ----------
+    filenames : List[str | List[str]]
+        The bag files of every player. A list of files is played by a single
+        player.
+    reference : Optional[float]
+        The time, in seconds since the epoch, which corresponds to the start
+        of the group. Default is the earliest start time of the bag files.
+    ready_timeout : Optional[float]
+        How long to wait for the players to start, or to acknowledge a
+        command, in seconds. Default is 30.
+    kwargs
+        Passed on to every ``BagPlayer``, e.g. ``shutdown_policy``.
+
+    Attributes
+    ----------
+    players : List[BagPlayer]
+        The players, in the order of the bag files.
+    starts : List[float]
+        The start time of the bag files of every player, in seconds since the
+        epoch.
+    ends : List[float]
+        The end time of the bag files of every player, in seconds since the
+        epoch.
+    reference : float
+        The time corresponding to the start of the group.
+    rate : float
+        The rate of playback.
+
+    """
+    def __init__(self, filenames, reference=None, ready_timeout=30.0,
+                 **kwargs):
+        if not filenames:
+            raise BagError("No players were specified.")
+        self.players = [BagPlayer(entry, **kwargs) for entry in filenames]
+        self.starts = []
+        self.ends = []
+        for player in self.players:
+            infos = [info for info in player.info()
+                     if info.start_time is not None]
+            if not infos:
+                raise BagError("{} has no messages.".format(player.filenames))
+            self.starts.append(min(info.start_time for info in infos))
+            self.ends.append(max(info.end_time for info in infos))
+        self.reference = min(self.starts) if reference is None else reference
+        self.ready_timeout = ready_timeout
+        self.rate = 1.0
+        self._options = {}
+        self._lock = threading.RLock()
+        self._timers = []
+        self._playing = False
+        self._origin = (None, 0.0)
+        self._resume_window = 0.0
+
+    @property
+    def offsets(self):
+        """
+        The position of the group at which every player starts, in seconds.
+
+        """
+        return [start - self.reference for start in self.starts]
+
+    @property
+    def position(self):
+        """
+        The number of seconds since the reference time, on the group clock.
+
+        """
+        with self._lock:
+            started, position = self._origin
+            if started is not None:
+                position += (monotonic() - started) * self.rate
+            return position
+
+    @property
+    def is_playing(self):
+        """
+        The group is playing, rather than paused.
+
+        """
+        return self._playing
+
+    def play(self, position=0.0, rate=1.0, start_paused=False, **options):
+        """
+        Start every player, paused, and then resume them together.
+
+        Parameters
+        ----------
+        position : Optional[float]
+            The number of seconds after the reference time at which to start.
+            Default is 0.
+        rate : Optional[float]
+            The rate of playback. Default is 1.
+        start_paused : Optional[Bool]
+            Leave the group paused once every player is ready.
+        options
+            The other options of ``BagPlayer.play``, such as immediate or
+            publish_clock. start_time and progress are set by the group.
+
+        Raises
+        ------
+        BagError
+            If a player did not become ready in time. Every player is then
+            stopped.
+
+        """
+        for key in ("start_time", "progress", "publish_rate_multiplier",
+                    "wait"):
+            if key in options:
+                raise BagError("{} is set by the group.".format(key))
+        self._options = options
+        self.rate = float(rate)
+        self._launch(position)
+        if not start_paused:
+            self.resume()
+
+    def _launch(self, position, finished=()):
+        # A player started past the end of its bag files would exit at once,
+        # and never report that it is ready.
+        with self._lock:
+            self._cancel_timers()
+            self._playing = False
+            self._origin = (None, position)
+            launched = []
+            for player, offset, end in zip(self.players, self.offsets,
+                                           self.ends):
+                if player in finished or end - self.reference < position:
+                    continue
+                start_time = position - offset if position > offset else None
+                player.play(start_paused=True, progress=True,
+                            start_time=start_time,
+                            publish_rate_multiplier=self.rate,
+                            **self._options)
+                launched.append(player)
+            try:
+                for player in launched:
+                    self._confirm(player, True)
+            except BagError:
+                self.stop()
+                raise
+
+    def _confirm(self, player, paused):
+        def done(reader):
+            latest = reader.latest
+            return latest is not None and latest.is_paused is paused
+        if not player.progress.wait_for(done, self.ready_timeout):
+            raise BagError("{} did not {} within {} s.".format(
+                player.filenames, "pause" if paused else "resume",
+                self.ready_timeout))
+
+    def _live(self, player):
+        return player.is_running and player.progress is not None
+
+    def resume(self):
+        """
+        Resume every player whose bag files have started, and schedule the
+        others.
+
+        Returns
+        -------
+        float
+            The time it took to resume every player, in seconds.
+
+        Raises
+        ------
+        BagError
+            If a player did not acknowledge in time.
+
+        """
+        with self._lock:
+            if self._playing:
+                return self._resume_window
+            position = self.position
+            now, waiting, resumed = monotonic(), [], []
+            for player, offset in zip(self.players, self.offsets):
+                if not self._live(player):
+                    continue
+                if offset <= position:
+                    player.resume()
+                    resumed.append(player)
+                else:
+                    waiting.append((player, (offset - position) / self.rate))
+            self._resume_window = monotonic() - now
+            self._origin = (now, position)
+            self._playing = True
+            for player, delay in waiting:
+                timer = threading.Timer(delay, self._resume_later, (player,))
+                timer.daemon = True
+                self._timers.append(timer)
+                timer.start()
+        for player in resumed:
+            self._confirm(player, False)
+        return self._resume_window
+
+    def _resume_later(self, player):
+        with self._lock:
+            if self._playing and self._live(player):
+                try:
+                    player.resume()
+                except BagNotRunningError:
+                    pass
+
+    def _cancel_timers(self):
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+
+    def pause(self):
+        """
+        Pause every player.
+
+        Raises
+        ------
+        BagError
+            If a player did not acknowledge in time.
+
+        """
+        with self._lock:
+            if not self._playing:
+                return
+            self._cancel_timers()
+            position = self.position
+            paused = []
+            for player in self.players:
+                if self._live(player) and player.is_paused is False:
+                    player.pause()
+                    paused.append(player)
+            self._origin = (None, position)
+            self._playing = False
+        for player in paused:
+            self._confirm(player, True)
+
+    def set_rate(self, rate):
+        """
+        Change the rate of every player.
+
+        The group is paused, every player is restarted paused at the current
+        position, and the group is resumed if it was playing. The players
+        which have finished are left alone.
+
+        Parameters
+        ----------
+        rate : float
+            The new rate.
+
+        """
+        with self._lock:
+            playing = self._playing
+            self.pause()
+            position = self.position
+            finished = []
+            for player in self.players:
+                if player.is_running:
+                    player.stop()
+                else:
+                    finished.append(player)
+            self.rate = float(rate)
+            self._launch(position, finished)
+            if playing:
+                self.resume()
+
+    def skew(self):
+        """
+        Measure how far apart the players are.
+
+        The latest status of every player is extrapolated to the same
+        instant, at the rate of the group if it is playing.
+
+        Returns
+        -------
+        SkewReport
+            The positions of the players, and the difference between them.
+
+        """
+        now, group = monotonic(), self.position
+        positions = []
+        for player, offset in zip(self.players, self.offsets):
+            latest = player.progress and player.progress.latest
+            if latest is None or not player.is_running or offset > group:
+                positions.append(None)
+                continue
+            position = latest.bag_time - self.reference
+            if not latest.is_paused:
+                position += (now - latest.received) * self.rate
+            positions.append(position)
+        playing = [position for position in positions if position is not None]
+        skew = max(playing) - min(playing) if playing else 0.0
+        return SkewReport(positions, skew, self._resume_window)
+
+    def wait(self):
+        """
+        Block until every player is done.
+
+        Returns
+        -------
+        List[int]
+            The return code of every player.
+
+        """
+        return [player.wait() for player in self.players]
+
+    def stop(self):
+        """
+        Stop every running player.
+
+        Returns
+        -------
+        List[ShutdownResult | None]
+            How every player was stopped, or None if it was not running.
+
+        """
+        with self._lock:
+            self._cancel_timers()
+            self._playing = False
+            results = []
+            for player in self.players:
+                if player.is_running:
+                    results.append(player.stop())
+                else:
+                    results.append(None)
+            return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def __repr__(self):
+        return "<BagPlayerGroup({})>".format(
+            [player.filenames for player in self.players])
@@ -0,0 +1,799 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Play bag files in-process, without running ``rosbag play``.
+
+A ``PlaybackEngine`` reads the messages directly from the bag files and
+hands them to a sink callback at the pace at which they were recorded. It
+behaves like the ``rosbag play`` process it replaces: it can be polled,
+waited for and terminated, and it accepts the same keystrokes on ``stdin``.
+It also offers pause, resume, step and seek as direct calls.
+
+"""
+import bisect
+from collections import deque, namedtuple
+from itertools import accumulate
+import logging
+import math
+import queue
+import threading
+import time
+
+from .bagfile import NSEC_PER_SEC, to_nsec, to_sec
+from .exceptions import BagError
+
+
+logger = logging.getLogger("bag_player.playback")
+
+#: How long before a deadline to stop sleeping and start spinning, in seconds.
+SPIN_THRESHOLD = 0.001
+
+#: The upper bounds of the lag histogram bins, in seconds.
+LAG_BINS = (0.0001, 0.001, 0.01, 0.1, 1.0, float("inf"))
+
+#: The smallest lag told apart from no lag, in seconds. Longer lags are
+#: counted in bins 1 % wide, from which the lag percentiles are estimated.
+LAG_RESOLUTION = 1e-6
+_LOG_GROWTH = math.log1p(0.01)
+_FINE_BINS = int(math.log(100 / LAG_RESOLUTION) / _LOG_GROWTH)
+
+#: The number of recent messages whose timing is kept.
+TIMING_HISTORY = 10000
+
+_END = object()
+
+
+MessageTiming = namedtuple("MessageTiming", "scheduled actual size")
+MessageTiming.__doc__ = """
+When a message was scheduled and emitted.
+
+Attributes
+----------
+scheduled : float
+    The time at which the message was due, in seconds.
+actual : float
+    The time at which it was emitted, in seconds.
+size : int
+    The size of the message, in bytes.
+
+"""
+
+
+MetricsSummary = namedtuple("MetricsSummary", [
+    "messages", "dropped", "late", "elapsed", "messages_per_sec",
+    "megabytes_per_sec", "mean_lag", "max_lag", "median_lag", "p99_lag"])
+MetricsSummary.__doc__ = """
+Summary of the timing accuracy of a playback run.
+
+Attributes
+----------
+messages : int
+    The number of messages emitted.
+dropped : int
+    The number of messages skipped for being too late.
+late : int
+    The number of messages emitted later than the lateness threshold.
+elapsed : float
+    The time since the first message, in seconds.
+messages_per_sec : float
+    The achieved throughput, in messages per second.
+megabytes_per_sec : float
+    The achieved throughput, in megabytes per second. Like the message rate,
+    it counts the messages emitted after the first one.
+mean_lag : float
+    The mean delay between scheduled and actual emission, in seconds.
+max_lag : float
+    The largest delay, in seconds.
+median_lag : float
+    The median delay, in seconds.
+p99_lag : float
+    The 99th percentile of the delay, in seconds.
+
+"""
+
+
+class PlaybackMetrics(object):
+    """
+    Keep running statistics of when messages were scheduled and emitted.
+
+    Times are monotonic clock readings, in seconds. Every statistic is
+    updated in constant time and memory, so that the metrics do not add
+    jitter of their own as a run grows. The median and 99th percentile of
+    the delay are estimated from a histogram of logarithmic bins, to within
+    about 0.5 %, or ``LAG_RESOLUTION`` for the shortest delays. The timing
+    of every message is kept too, up to a fixed number of the latest ones.
+
+    Parameters
+    ----------
+    late_threshold : Optional[float]
+        The delay, in seconds, past which a message counts as late. Default
+        is 1 ms.
+    bins : Optional[Sequence[float]]
+        The increasing upper bounds of the bins reported by ``histogram``,
+        in seconds. Default is ``LAG_BINS``.
+    history : Optional[int]
+        The number of recent messages whose timing is kept. Default is
+        ``TIMING_HISTORY``.
+
+    Attributes
+    ----------
+    messages : int
+        The number of messages emitted.
+    bytes : int
+        The number of bytes emitted.
+    dropped : int
+        The number of messages skipped for being too late.
+    late : int
+        The number of messages emitted later than the threshold.
+    late_threshold : float
+        The delay past which a message counts as late, in seconds.
+    bins : Tuple[float]
+        The upper bounds of the bins reported by ``histogram``.
+
+    """
+    def __init__(self, late_threshold=0.001, bins=LAG_BINS,
+                 history=TIMING_HISTORY):
+        self.late_threshold = late_threshold
+        self.bins = tuple(bins)
+        self._timings = deque(maxlen=history)
+        self._first_size = 0
+        self.messages = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.late = 0
+        self._first = None
+        self._last = None
+        self._lag_sum = 0.0
+        self._min_lag = float("inf")
+        self._max_lag = float("-inf")
+        self._counts = [0] * len(self.bins)
+        self._fine_counts = [0] * (_FINE_BINS + 2)
+        self._lock = threading.Lock()
+
+    def record(self, scheduled, actual, size):
+        """
+        Record an emitted message.
+
+        Parameters
+        ----------
+        scheduled : float
+            The time at which the message was due.
+        actual : float
+            The time at which it was emitted.
+        size : int
+            The size of the message, in bytes.
+
+        """
+        lag = actual - scheduled
+        i = bisect.bisect_left(self.bins, lag)
+        fine = _fine_bin(lag)
+        with self._lock:
+            if self._first is None:
+                self._first = actual
+                self._first_size = size
+            self._last = actual
+            self._timings.append(MessageTiming(scheduled, actual, size))
+            self.messages += 1
+            self.bytes += size
+            self._lag_sum += lag
+            self._min_lag = min(self._min_lag, lag)
+            self._max_lag = max(self._max_lag, lag)
+            if i < len(self._counts):
+                self._counts[i] += 1
+            self._fine_counts[fine] += 1
+            if lag > self.late_threshold:
+                self.late += 1
+
+    def record_drop(self):
+        """
+        Record a message skipped for being too late.
+
+        """
+        with self._lock:
+            self.dropped += 1
+
+    def timings(self):
+        """
+        List when the latest messages were scheduled and emitted.
+
+        Returns
+        -------
+        List[MessageTiming]
+            The timing of every message kept, oldest first.
+
+        """
+        with self._lock:
+            return list(self._timings)
+
+    def histogram(self):
+        """
+        Count the messages per range of delay.
+
+        Returns
+        -------
+        List[Tuple[float, int]]
+            The upper bound and the number of messages of every bin. Delays
+            past the last bound are not counted.
+
+        """
+        with self._lock:
+            return list(zip(self.bins, self._counts))
+
+    def summary(self):
+        """
+        Summarize the run so far.
+
+        Returns
+        -------
+        MetricsSummary
+            The summary.
+
+        """
+        with self._lock:
+            count = self.messages
+            elapsed = self._last - self._first if count else 0.0
+            # The rates are over the intervals between the first and last
+            # messages, so the first message counts towards neither.
+            total_bytes = self.bytes - self._first_size
+            dropped = self.dropped
+            late = self.late
+            lag_sum = self._lag_sum
+            min_lag = self._min_lag
+            max_lag = self._max_lag
+            cumulative = list(accumulate(self._fine_counts))
+        if not count:
+            return MetricsSummary(0, dropped, late, 0.0, 0.0, 0.0, 0.0, 0.0,
+                                  0.0, 0.0)
+
+        def percentile(fraction):
+            rank = min(count - 1, int(count * fraction))
+            lag = _fine_lag(bisect.bisect_right(cumulative, rank))
+            return min(max(lag, min_lag), max_lag)
+
+        rate = (count - 1) / elapsed if elapsed > 0 else 0.0
+        bandwidth = total_bytes / elapsed / 1e6 if elapsed > 0 else 0.0
+        return MetricsSummary(
+            count, dropped, late, elapsed, rate, bandwidth, lag_sum / count,
+            max_lag, percentile(0.5), percentile(0.99))
+
+
+def _fine_bin(lag):
+    if lag < LAG_RESOLUTION:
+        return 0
+    i = int(math.log(lag / LAG_RESOLUTION) / _LOG_GROWTH) + 1
+    return min(i, _FINE_BINS + 1)
+
+
+def _fine_lag(i):
+    # The geometric middle of the bin, which is then clamped to the lags
+    # actually seen: the first and last bins are open-ended.
+    if i == 0:
+        return 0.0
+    if i > _FINE_BINS:
+        return float("inf")
+    return LAG_RESOLUTION * math.exp((i - 0.5) * _LOG_GROWTH)
+
+
+class _Keyboard(object):
+    """
+    Accept the keystrokes of ``rosbag play``: space toggles pause, and ``s``
+    steps while paused.
+
+    """
+    def __init__(self, engine):
+        self._engine = engine
+
+    def write(self, string):
+        if isinstance(string, bytes):
+            string = string.decode("utf-8")
+        for key in string:
+            if key == " ":
+                self._engine.toggle_pause()
+            elif key == "s":
+                self._engine.step()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class PlaybackEngine(object):
+    """
+    Pace the messages of a bag to a sink callback.
+
+    Parameters
+    ----------
+    bag : Bag
+        The bag files to play.
+    sink : Callable[[Message], None]
+        Called with every message, at the time it is due.
+    clock_sink : Optional[Callable[[float], None]]
+        Called with the current bag time, in seconds, when publishing the
+        clock.
+    topics : Optional[str | List[str]]
+        The topics to play. Default is every topic.
+
+    Attributes
+    ----------
+    bag : Bag
+        The bag files to play.
+    sink : Callable[[Message], None]
+        Called with every message.
+    clock_sink : Callable[[float], None] | None
+        Called with the current bag time when publishing the clock.
+    topics : str | List[str] | None
+        The topics to play.
+    stdin : file-like
+        Accepts the keystrokes of ``rosbag play``.
+    returncode : int | None
+        None while playing, 0 after a clean finish or stop, and 1 if the
+        sink or the reader raised an exception.
+    error : Exception | None
+        The exception which ended playback, if any.
+    metrics : PlaybackMetrics
+        The timing of every message emitted so far.
+    steps_played : int
+        The number of messages played by stepping so far.
+
+    """
+    def __init__(self, bag, sink, clock_sink=None, topics=None):
+        self.bag = bag
+        self.sink = sink
+        self.clock_sink = clock_sink
+        self.topics = topics
+        self.stdin = _Keyboard(self)
+        self.returncode = None
+        self.error = None
+        self.metrics = PlaybackMetrics()
+        self.steps_played = 0
+
+        self._condition = threading.Condition()
+        self._queue = None
+        self._thread = None
+        self._stopped = False
+        self._paused = False
+        self._steps = 0
+        self._generation = 0
+        self._origin_wall = 0.0
+        self._origin_bag = 0
+        self._bag_time = None
+        self._next_clock = 0.0
+
+    def play(self, immediate=None, start_paused=None, queue_size=None,
+             publish_clock=None, clock_publish_freq=None, delay=None,
+             publish_rate_multiplier=None, start_time=None, duration=None,
+             loop=None, keep_alive=None, max_lag=None, metrics_callback=None,
+             metrics_interval=1.0):
+        """
+        Start playing in a background thread.
+
+        The parameters mirror those of ``BagPlayer.play``.
+
+        Parameters
+        ----------
+        immediate : Optional[Bool]
+            Play back all messages without waiting.
+        start_paused : Optional[Bool]
+            Start in paused mode.
+        queue_size : Optional[int]
+            The number of messages read ahead of playback. Default is 100.
+        publish_clock : Optional[Bool]
+            Publish the clock time to the clock sink.
+        clock_publish_freq : Optional[float]
+            The frequency, in Hz, at which to publish the clock time. Default
+            is 100.
+        delay : Optional[float]
+            The number of seconds to sleep before the first message.
+        publish_rate_multiplier : Optional[float]
+            The factor by which to multiply the publish rate.
+        start_time : Optional[float]
+            The number of seconds into the bag file at which to start.
+        duration : Optional[float]
+            The number of seconds from the start to play.
+        loop : Optional[Bool]
+            Loop playback.
+        keep_alive : Optional[Bool]
+            Keep alive past end of bag, until stopped.
+        max_lag : Optional[float]
+            Skip the messages which are more than this many seconds late,
+            instead of emitting them. Default is to emit every message.
+        metrics_callback : Optional[Callable[[MetricsSummary], None]]
+            Called with the summary of the metrics periodically, and at the
+            end of playback.
+        metrics_interval : Optional[float]
+            The period of the metrics callback, in seconds. Default is 1.
+
+        Raises
+        ------
+        BagError
+            If the engine is already playing.
+
+        """
+        if self._thread is not None:
+            raise BagError("The playback engine has already been started.")
+        starts = [index.start_time for index in self.bag.indexes
+                  if index.start_time is not None]
+        self._bag_start = min(starts) if starts else 0
+        self._start = self._bag_start + to_nsec(start_time or 0)
+        self._end = None
+        if duration is not None:
+            self._end = self._start + to_nsec(duration)
+        self._immediate = bool(immediate)
+        self._rate = float(publish_rate_multiplier or 1.0)
+        self._clock_period = None
+        if publish_clock and self.clock_sink is not None:
+            self._clock_period = 1.0 / (clock_publish_freq or 100)
+        self._loop = bool(loop)
+        self._keep_alive = bool(keep_alive)
+        self._delay = delay or 0
+        self._paused = bool(start_paused)
+        self._max_lag = max_lag
+        self._metrics_callback = metrics_callback
+        self._metrics_interval = metrics_interval
+        self._next_report = 0.0
+        self._queue = queue.Queue(maxsize=queue_size or 100)
+        self._reset_origin(self._start)
+        self._bag_time = self._start
+
+        self._start_reader(self._start)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    # Control.
+    def pause(self):
+        """
+        Pause playback.
+
+        """
+        with self._condition:
+            if not self._paused:
+                self._origin_bag = self._current_bag_time()
+                self._paused = True
+                self._condition.notify_all()
+
+    def resume(self):
+        """
+        Resume playback.
+
+        """
+        with self._condition:
+            if self._paused:
+                self._reset_origin(self._origin_bag)
+                self._paused = False
+                self._condition.notify_all()
+
+    def toggle_pause(self):
+        """
+        Pause playback if playing, and resume it if paused.
+
+        """
+        with self._condition:
+            paused = self._paused
+        if paused:
+            self.resume()
+        else:
+            self.pause()
+
+    def step(self, count=1):
+        """
+        Play the next messages immediately, while paused.
+
+        Parameters
+        ----------
+        count : Optional[int]
+            The number of messages to play. Default is 1.
+
+        Returns
+        -------
+        int
+            The value ``steps_played`` will have once they are played.
+
+        """
+        with self._condition:
+            if self._paused:
+                self._steps += count
+                self._condition.notify_all()
+            return self.steps_played + self._steps
+
+    def wait_for_steps(self, target, timeout=None):
+        """
+        Wait until a number of steps have been played.
+
+        Parameters
+        ----------
+        target : int
+            The value of ``steps_played`` to wait for, as returned by
+            ``step``.
+        timeout : Optional[float]
+            The maximum time to wait, in seconds.
+
+        Returns
+        -------
+        bool
+            The steps were played. False if the timeout expired, or playback
+            ended or left the paused state first.
+
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self.steps_played < target:
+                if (self._stopped or self.returncode is not None or
+                        not self._paused):
+                    return False
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                self._condition.wait(remaining)
+            return True
+
+    def seek(self, t):
+        """
+        Jump to a point in the bag.
+
+        Messages already read ahead are discarded, and playback continues
+        from the first message at or after the time.
+
+        Parameters
+        ----------
+        t : float
+            The number of seconds into the bag file.
+
+        """
+        target = self._bag_start + to_nsec(t)
+        with self._condition:
+            self._generation += 1
+            self._reset_origin(target)
+            self._bag_time = target
+            self._steps = 0
+            self._start_reader(target)
+            self._condition.notify_all()
+
+    def stop(self):
+        """
+        Stop playback.
+
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    # Process interface.
+    def poll(self):
+        """
+        Check whether playback is over.
+
+        Returns
+        -------
+        int | None
+            The return code, or None while playing.
+
+        """
+        return self.returncode
+
+    def wait(self, timeout=None):
+        """
+        Block until playback is over.
+
+        Parameters
+        ----------
+        timeout : Optional[float]
+            The maximum time to wait, in seconds.
+
+        Returns
+        -------
+        int | None
+            The return code, or None if the timeout expired.
+
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.returncode
+
+    def terminate(self):
+        """
+        Stop playback, like terminating ``rosbag play``.
+
+        """
+        self.stop()
+
+    kill = terminate
+
+    # State.
+    @property
+    def is_paused(self):
+        """
+        Check whether playback is paused.
+
+        Returns
+        -------
+        bool
+            Playback is paused.
+
+        """
+        return self._paused
+
+    @property
+    def bag_time(self):
+        """
+        The current bag time.
+
+        Returns
+        -------
+        float | None
+            The time, in seconds since the epoch, or None before playing.
+
+        """
+        if self._bag_time is None:
+            return None
+        with self._condition:
+            return to_sec(self._current_bag_time())
+
+    # Internals.
+    def _reset_origin(self, bag_time):
+        self._origin_wall = time.monotonic()
+        self._origin_bag = bag_time
+
+    def _current_bag_time(self):
+        if self._paused or self._immediate:
+            return max(self._origin_bag, self._bag_time)
+        elapsed = (time.monotonic() - self._origin_wall) * self._rate
+        return self._origin_bag + int(elapsed * NSEC_PER_SEC)
+
+    def _due(self, timestamp):
+        return (self._origin_wall +
+                (timestamp - self._origin_bag) / float(NSEC_PER_SEC) /
+                self._rate)
+
+    def _start_reader(self, start):
+        reader = threading.Thread(target=self._read,
+                                  args=(self._generation, start))
+        reader.daemon = True
+        reader.start()
+
+    def _read(self, generation, start):
+        end = None if self._end is None else to_sec(self._end)
+        messages = self.bag.read_messages(self.topics, to_sec(start), end)
+        try:
+            for message in messages:
+                if not self._put(generation, message):
+                    return
+            self._put(generation, _END)
+        except Exception as e:
+            self._put(generation, e)
+        finally:
+            messages.close()
+
+    def _put(self, generation, item):
+        while True:
+            if self._stopped or generation != self._generation:
+                return False
+            try:
+                self._queue.put((generation, item), timeout=0.05)
+                return True
+            except queue.Full:
+                pass
+
+    def _get(self):
+        while True:
+            if self._stopped:
+                return None, None
+            try:
+                generation, item = self._queue.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            if generation == self._generation:
+                return generation, item
+
+    def _run(self):
+        try:
+            if self._delay:
+                time.sleep(self._delay)
+                with self._condition:
+                    self._reset_origin(self._origin_bag)
+            self._play_messages()
+        except Exception as e:
+            logger.exception("Playback failed.")
+            self.error = e
+            self.returncode = 1
+        else:
+            self.returncode = 0
+        finally:
+            if self._metrics_callback is not None:
+                self._metrics_callback(self.metrics.summary())
+
+    def _play_messages(self):
+        while True:
+            generation, item = self._get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            if item is _END:
+                if self._loop:
+                    with self._condition:
+                        if generation == self._generation:
+                            self._generation += 1
+                            self._reset_origin(self._start)
+                            self._bag_time = self._start
+                            self._start_reader(self._start)
+                    continue
+                if self._keep_alive and self._wait_for_seek(generation):
+                    continue
+                return
+            scheduled = self._wait_until_due(generation, item.timestamp)
+            if scheduled is None:
+                continue
+            now = time.monotonic()
+            if self._max_lag is not None and now - scheduled > self._max_lag:
+                self.metrics.record_drop()
+                continue
+            self.sink(item)
+            self.metrics.record(scheduled, now, len(item.data))
+            if (self._metrics_callback is not None and
+                    now >= self._next_report):
+                if self._next_report:
+                    self._metrics_callback(self.metrics.summary())
+                self._next_report = now + self._metrics_interval
+
+    def _wait_for_seek(self, generation):
+        with self._condition:
+            while not self._stopped and generation == self._generation:
+                self._condition.wait(self._clock_period)
+                self._publish_clock()
+            return not self._stopped
+
+    def _publish_clock(self):
+        if self._clock_period is None:
+            return
+        now = time.monotonic()
+        if now < self._next_clock:
+            return
+        self._next_clock = now + self._clock_period
+        self.clock_sink(to_sec(self._current_bag_time()))
+
+    def _wait_until_due(self, generation, timestamp):
+        # Sleep on the condition, so that control calls wake the engine up,
+        # until shortly before the message is due, then spin for precision.
+        # Returns when the message was due, or None to discard it.
+        with self._condition:
+            while True:
+                if self._stopped or generation != self._generation:
+                    return None
+                if self._paused:
+                    if self._steps:
+                        self._steps -= 1
+                        self.steps_played += 1
+                        self._bag_time = self._origin_bag = timestamp
+                        self._condition.notify_all()
+                        return time.monotonic()
+                    self._publish_clock()
+                    self._condition.wait(self._clock_period)
+                    continue
+                if self._immediate:
+                    self._bag_time = timestamp
+                    return time.monotonic()
+                self._publish_clock()
+                due = self._due(timestamp)
+                remaining = due - time.monotonic()
+                if remaining <= 0:
+                    self._bag_time = timestamp
+                    return due
+                if self._clock_period is not None:
+                    remaining = min(remaining, self._clock_period)
+                if remaining > SPIN_THRESHOLD:
+                    self._condition.wait(remaining - SPIN_THRESHOLD)
+                else:
+                    self._condition.release()
+                    try:
+                        while time.monotonic() < due:
+                            pass
+                    finally:
+                        self._condition.acquire()
+
+    def __repr__(self):
+        return "<PlaybackEngine({})>".format(self.bag.filenames)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Play many bag files concurrently.
+
+A ``BagPlayerPool`` takes a queue of bag files and plays them with a bounded
+number of simultaneous ``rosbag play`` processes.
+
+"""
+from collections import namedtuple
+import logging
+import multiprocessing
+import queue
+import threading
+from time import monotonic
+
+from .exceptions import BagNotRunningError
+from .pyrosbag import BagPlayer
+
+
+logger = logging.getLogger("bag_player.pool")
+
+
+class PlayResult(namedtuple("PlayResult", ["index", "filenames",
+                                           "returncode", "attempts",
+                                           "started", "elapsed", "error"])):
+    """
+    The outcome of playing one entry of the pool queue.
+
+    Attributes
+    ----------
+    index : int
+        The position of the entry in the queue.
+    filenames : List[str]
+        The bag files which were played together.
+    returncode : int | None
+        The return code of the last attempt, or None if it never ran.
+    attempts : int
+        The number of times the bag was launched.
+    started : float
+        When the entry was taken from the queue, in seconds after the start
+        of the run.
+    elapsed : float
+        The wall-clock time spent on the bag over all attempts, in seconds.
+    error : str | None
+        A description of the failure, if any.
+
+    """
+    __slots__ = ()
+
+    @property
+    def succeeded(self):
+        """
+        Check whether the bag played to completion.
+
+        Returns
+        -------
+        bool
+            The last attempt exited cleanly.
+
+        """
+        return self.error is None and self.returncode == 0
+
+
+class PoolResult(namedtuple("PoolResult", ["results", "elapsed"])):
+    """
+    The outcome of a pool run.
+
+    Attributes
+    ----------
+    results : List[PlayResult]
+        The result of every entry, in submission order.
+    elapsed : float
+        The aggregate wall-clock time of the run, in seconds.
+
+    """
+    __slots__ = ()
+
+    @property
+    def failures(self):
+        """
+        The entries which did not play to completion.
+
+        Returns
+        -------
+        List[PlayResult]
+            The failed results.
+
+        """
+        return [result for result in self.results if not result.succeeded]
+
+    @property
+    def succeeded(self):
+        """
+        Check whether every entry played to completion.
+
+        Returns
+        -------
+        bool
+            No entry failed.
+
+        """
+        return not self.failures
+
+
+class BagPlayerPool(object):
+    """
+    Play a queue of bag files over a managed pool of players.
+
+    Parameters
+    ----------
+    max_workers : Optional[int]
+        The maximum number of players running at once. It defaults to the
+        number of cores, and is capped at it unless cap_to_cpus is False.
+    retries : Optional[int]
+        The number of times to relaunch a failed bag. Default is 0.
+    cap_to_cpus : Optional[bool]
+        Cap max_workers at the number of cores. Players paced by the clock,
+        rather than by the CPU, need not be. Default is True.
+    player_class : Optional[type]
+        The player to use. Default is ``BagPlayer``.
+    player_options
+        Passed on to every player, e.g. ``shutdown_policy``.
+
+    Attributes
+    ----------
+    max_workers : int
+        The maximum number of players running at once.
+    retries : int
+        The number of times to relaunch a failed bag.
+    player_class : type
+        The player to use.
+    player_options : dict
+        Passed on to every player.
+
+    """
+    def __init__(self, max_workers=None, retries=0, cap_to_cpus=True,
+                 player_class=BagPlayer, **player_options):
+        cores = multiprocessing.cpu_count()
+        if max_workers is None:
+            max_workers = cores
+        elif cap_to_cpus:
+            max_workers = min(max_workers, cores)
+        self.max_workers = max(1, max_workers)
+        self.retries = retries
+        self.player_class = player_class
+        self.player_options = player_options
+        self._players = set()
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    def play(self, bags, callback=None, options=None, **kwargs):
+        """
+        Play every entry of the queue, and block until all are complete.
+
+        Parameters
+        ----------
+        bags : Iterable[str | List[str]]
+            The bag files to play. Each entry is passed to its own player, so
+            a list of files is played together.
+        callback : Optional[Callable[[PlayResult], None]]
+            Called from a worker thread whenever an entry is done. Its
+            exceptions are logged, and do not stop the other entries.
+        options : Optional[Sequence[dict]]
+            The options of every entry, which override kwargs, e.g. to play
+            a different time window of each.
+        kwargs
+            Options passed to every ``BagPlayer.play`` call. ``wait`` is
+            ignored.
+
+        Returns
+        -------
+        PoolResult
+            The per-bag results and the aggregate timing.
+
+        Raises
+        ------
+        KeyboardInterrupt
+            If interrupted, once every running player has been stopped.
+
+        """
+        self._cancelled.clear()
+        jobs = queue.Queue()
+        for i, filenames in enumerate(bags):
+            jobs.put((i, filenames, kwargs if options is None
+                      else dict(kwargs, **options[i])))
+        results = [None] * jobs.qsize()
+
+        def work():
+            while True:
+                try:
+                    i, filenames, play_options = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                result = self._play_one(i, filenames, play_options, start)
+                results[i] = result
+                if callback is not None:
+                    try:
+                        callback(result)
+                    except Exception:
+                        logger.exception("The callback failed on %s.",
+                                         result.filenames)
+
+        start = monotonic()
+        workers = [threading.Thread(target=work)
+                   for _ in range(min(self.max_workers, len(results)))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except BaseException:
+            self.stop()
+            raise
+        return PoolResult(results, monotonic() - start)
+
+    def stop(self):
+        """
+        Stop every running player, and cancel the entries still queued.
+
+        """
+        self._cancelled.set()
+        with self._lock:
+            players = list(self._players)
+        for player in players:
+            try:
+                player.stop()
+            except BagNotRunningError:
+                pass
+
+    def _play_one(self, index, filenames, kwargs, origin):
+        attempts = 0
+        returncode = None
+        error = None
+        start = monotonic()
+        while attempts <= self.retries:
+            if self._cancelled.is_set():
+                error = "Cancelled."
+                break
+            attempts += 1
+            try:
+                player = self.player_class(filenames, **self.player_options)
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+                break
+            with self._lock:
+                self._players.add(player)
+            try:
+                player.play(**dict(kwargs, wait=False))
+                if self._cancelled.is_set():
+                    player.stop()
+                returncode = player.wait()
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+                try:
+                    player.stop()
+                except BagNotRunningError:
+                    pass
+            else:
+                error = None if returncode == 0 else (
+                    "Exited with code {}.".format(returncode))
+            finally:
+                with self._lock:
+                    self._players.discard(player)
+            if error is None:
+                break
+            logger.warning("Attempt %d on %s failed: %s",
+                           attempts, filenames, error)
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        return PlayResult(index, list(filenames), returncode, attempts,
+                          start - origin, monotonic() - start, error)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Follow the progress of ``rosbag play`` from its status output.
+
+``rosbag play`` rewrites a status line on stdout every time the bag time
+advances::
+
+     [RUNNING]  Bag Time: 1483228800.123456   Duration: 0.123456 / 60.000000
+
+A ``ProgressReader`` drains that output on a background thread, so that the
+pipe never fills up, and keeps only the latest status. Reading it is a single
+attribute lookup.
+
+"""
+from collections import namedtuple
+import logging
+import os
+import re
+import threading
+from time import monotonic
+
+
+logger = logging.getLogger("bag_player.progress")
+
+READ_SIZE = 65536
+STATUS = re.compile(br"\[\s*(RUNNING|PAUSED|DELAYED)\s*\]\s*Bag Time:\s*"
+                    br"([-\d.]+)\s*Duration:\s*([-\d.]+)\s*/\s*([-\d.]+)")
+
+
+class Progress(namedtuple("Progress", "state bag_time elapsed duration "
+                                      "received")):
+    """
+    The status of ``rosbag play``.
+
+    Attributes
+    ----------
+    state : str
+        One of "RUNNING", "PAUSED" or "DELAYED".
+    bag_time : float
+        The current bag time, in seconds.
+    elapsed : float
+        The number of seconds played since the start of the bag.
+    duration : float
+        The length of the bag, in seconds.
+    received : float
+        The monotonic time at which the status was read.
+
+    """
+    __slots__ = ()
+
+    @property
+    def is_paused(self):
+        """
+        ``rosbag play`` is paused.
+
+        """
+        return self.state == "PAUSED"
+
+    @property
+    def fraction(self):
+        """
+        The fraction of the bag which has been played.
+
+        """
+        return self.elapsed / self.duration if self.duration else 1.0
+
+
+class ProgressReader(object):
+    """
+    Drain the output of ``rosbag play`` and track its status.
+
+    The output is read in large blocks. Statuses which arrive within the
+    same block are coalesced, and only the last one is kept, so a slow
+    consumer sees the latest status rather than a backlog.
+
+    Parameters
+    ----------
+    stream : file
+        The stdout of the process.
+    callback : Optional[Callable[[Progress], None]]
+        Called on the reader thread with every new status.
+
+    Attributes
+    ----------
+    latest : Progress | None
+        The latest status, or None if none has been read yet.
+    updates : int
+        The number of times a new status was read. Statuses which arrive
+        together count once.
+    advances : int
+        The number of statuses whose bag time differs from that of the
+        status before, e.g. one per step while paused. Every status line
+        counts, even when several arrive together.
+    finished : bool
+        The stream has been closed.
+
+    """
+    def __init__(self, stream, callback=None):
+        self.stream = stream
+        self.callback = callback
+        self.latest = None
+        self.updates = 0
+        self.advances = 0
+        self.finished = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def bag_time(self):
+        """
+        The current bag time, in seconds, or None before the first status.
+
+        """
+        latest = self.latest
+        return None if latest is None else latest.bag_time
+
+    def events(self, timeout=None):
+        """
+        Iterate over the statuses as they arrive.
+
+        The iteration ends when the stream is closed. Several iterators can
+        follow the same reader.
+
+        Parameters
+        ----------
+        timeout : Optional[float]
+            Stop iterating if no status arrives for this many seconds.
+
+        Yields
+        ------
+        Progress
+            The latest status.
+
+        """
+        seen = 0
+        while True:
+            with self._condition:
+                if timeout is not None:
+                    deadline = monotonic() + timeout
+                while self.updates == seen and not self.finished:
+                    remaining = None
+                    if timeout is not None:
+                        remaining = deadline - monotonic()
+                        if remaining <= 0:
+                            break
+                    self._condition.wait(remaining)
+                if self.updates == seen:
+                    return
+                seen = self.updates
+                latest = self.latest
+            yield latest
+
+    __iter__ = events
+
+    def wait_for(self, predicate, timeout=None):
+        """
+        Wait until a condition on the reader holds.
+
+        The condition is checked whenever a status is read.
+
+        Parameters
+        ----------
+        predicate : Callable[[ProgressReader], bool]
+            The condition.
+        timeout : Optional[float]
+            The maximum time to wait, in seconds.
+
+        Returns
+        -------
+        bool
+            The condition holds. False if the timeout expired, or the stream
+            was closed, first.
+
+        """
+        with self._condition:
+            if timeout is not None:
+                deadline = monotonic() + timeout
+            while not predicate(self):
+                if self.finished:
+                    return False
+                remaining = None
+                if timeout is not None:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        return False
+                self._condition.wait(remaining)
+            return True
+
+    def join(self, timeout=None):
+        """
+        Wait until the stream is closed.
+
+        """
+        self._thread.join(timeout)
+
+    def _run(self):
+        fd = self.stream.fileno()
+        tail = b""
+        try:
+            while True:
+                block = os.read(fd, READ_SIZE)
+                if not block:
+                    break
+                data = tail + block
+                cut = max(data.rfind(b"\r"), data.rfind(b"\n"))
+                if cut < 0:
+                    tail = data[-READ_SIZE:]
+                    continue
+                tail = data[cut + 1:]
+                statuses = STATUS.findall(data[:cut + 1])
+                if statuses:
+                    self._update(statuses)
+        except (OSError, ValueError) as e:
+            logger.debug("Stopped reading progress: %s", e)
+        finally:
+            with self._condition:
+                self.finished = True
+                self._condition.notify_all()
+
+    def _update(self, statuses):
+        previous = self.latest
+        bag_time = None if previous is None else previous.bag_time
+        advances = 0
+        for status in statuses:
+            status_time = float(status[1])
+            if status_time != bag_time:
+                advances += bag_time is not None
+                bag_time = status_time
+        state, _, elapsed, duration = statuses[-1]
+        progress = Progress(state.decode("ascii"), bag_time, float(elapsed),
+                            float(duration), monotonic())
+        with self._condition:
+            self.latest = progress
+            self.updates += 1
+            self.advances += advances
+            self._condition.notify_all()
+        if self.callback is not None:
+            try:
+                self.callback(progress)
+            except Exception:
+                logger.exception("Progress callback failed.")
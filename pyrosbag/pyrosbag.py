@@ -8,49 +8,287 @@ This module implements the base class, and the various functions.
 Currently implemented are:
 
     * ``rosbag play``
+    * ``rosbag info``, read directly from the bag files
+    * Reading messages directly from the bag files
+    * Playing bag files in-process, to a callback
+    * Following the progress of ``rosbag play``
+    * ``rosbag record``
+    * ``rosbag filter``, copying raw chunks and records
+    * Merging bag files in time order
+    * ``rosbag compress``, ``decompress`` and ``reindex``, in parallel
+    * ``rosbag check``, and recovery of truncated bag files
+    * Graceful shutdown, escalating from SIGINT to SIGKILL
+    * Playing time windows of a bag file in parallel
 
 """
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
 import logging
+import multiprocessing
+import os
+import re
 import subprocess as sp
-import time
-try:
-    from types import StringTypes
-except ImportError:
-    StringTypes = str
+import threading
+from time import monotonic
 
-
-try:
-    input = raw_input
-except NameError:
-    pass
+from .batch import batch_convert
+from .bagfile import BagIndex, BagReader, merge_messages, np, to_nsec
+from .columns import ROW_GROUP_SIZE, export_parquet, iter_columns
+from .exceptions import BagError, MissingBagError, BagNotRunningError
+from .playback import PlaybackEngine
+from .progress import ProgressReader
+from .repair import check_bag, fix_bag
+from .shutdown import ShutdownPolicy, popen_options, register, shutdown
+from .standby import StandbyPool
+from .writer import BagWriter
 
 
 logger = logging.getLogger("bag_player")
 
+#: How long after a toggle of pause the statuses of ``rosbag play`` which
+#: still show the previous state are put down to the key being in flight,
+#: in seconds.
+TOGGLE_SETTLE_TIME = 0.5
+
+
+def play_arguments(filenames, quiet=None, immediate=None, start_paused=None,
+                   queue_size=None, publish_clock=None,
+                   clock_publish_freq=None, delay=None,
+                   publish_rate_multiplier=None, start_time=None,
+                   duration=None, loop=None, keep_alive=None):
+    """
+    Build the command line of ``rosbag play``.
+
+    The options are those of ``BagPlayer.play``.
+
+    Parameters
+    ----------
+    filenames : List[str]
+        The location of the bag files.
+
+    Returns
+    -------
+    List[str]
+        The command and its arguments.
+
+    """
+    arguments = ["rosbag", "play"]
+    arguments.extend(filenames)
+
+    if quiet:
+        arguments.append("-q")
+    if immediate:
+        arguments.append("-i")
+    if start_paused:
+        arguments.append("--pause")
+    if queue_size is not None:
+        arguments.append("--queue={}".format(queue_size))
+    if publish_clock:
+        arguments.append("--clock")
+    if clock_publish_freq is not None:
+        arguments.append("--hz={}".format(clock_publish_freq))
+    if delay is not None:
+        arguments.append("--delay={}".format(delay))
+    if publish_rate_multiplier is not None:
+        arguments.append("--rate={}".format(publish_rate_multiplier))
+    if start_time is not None:
+        arguments.append("--start={}".format(start_time))
+    if duration is not None:
+        arguments.append("--duration={}".format(duration))
+    if loop:
+        arguments.append("-l")
+    if keep_alive:
+        arguments.append("-k")
+    return arguments
+
+
+def record_arguments(output, topics=None, all_topics=None, regex=None,
+                     exclude=None, prefix=None, quiet=None, split_size=None,
+                     split_duration=None, max_splits=None, duration=None,
+                     limit=None, buffer_size=None, chunk_size=None,
+                     compression=None, node=None, tcp_nodelay=None,
+                     udp=None):
+    """
+    Build the command line of ``rosbag record``.
+
+    The options are those of ``BagRecorder.record``.
+
+    Parameters
+    ----------
+    output : str
+        The name, or prefix, of the bag file.
+
+    Returns
+    -------
+    List[str]
+        The command and its arguments.
+
+    Raises
+    ------
+    BagError
+        If the options are inconsistent.
+
+    """
+    if not (topics or all_topics or node):
+        raise BagError("Give topics, all_topics or node to record.")
+    if duration is not None and split_duration is not None:
+        raise BagError("rosbag record cannot limit the duration when "
+                       "splitting by duration.")
+    if split_size is not None and split_duration is not None:
+        raise BagError("Split by size or by duration, not both.")
+    if compression not in (None, "none", "bz2", "lz4"):
+        raise BagError("Unknown compression: {}".format(compression))
+    if isinstance(topics, str):
+        topics = [topics]
+
+    arguments = ["rosbag", "record"]
+    arguments.extend(["-o" if prefix else "-O", output])
+
+    if all_topics:
+        arguments.append("-a")
+    if regex:
+        arguments.append("-e")
+    if exclude is not None:
+        arguments.extend(["-x", exclude])
+    if quiet:
+        arguments.append("-q")
+    if split_size is not None:
+        arguments.extend(["--split", "--size={}".format(split_size)])
+    if split_duration is not None:
+        arguments.extend(["--split", "--duration={}".format(split_duration)])
+    if max_splits is not None:
+        arguments.append("--max-splits={}".format(max_splits))
+    if duration is not None:
+        arguments.append("--duration={}".format(duration))
+    if limit is not None:
+        arguments.append("--limit={}".format(limit))
+    if buffer_size is not None:
+        arguments.append("--buffsize={}".format(buffer_size))
+    if chunk_size is not None:
+        arguments.append("--chunksize={}".format(chunk_size))
+    if compression in ("bz2", "lz4"):
+        arguments.append("--{}".format(compression))
+    if node is not None:
+        arguments.append("--node={}".format(node))
+    if tcp_nodelay:
+        arguments.append("--tcpnodelay")
+    if udp:
+        arguments.append("--udp")
+    if topics:
+        arguments.extend(topics)
+    return arguments
+
 
-class BagError(Exception):
+def time_windows(duration, shards, overlap=0.0):
     """
-    Catch bag player exceptions.
+    Split a bag file into consecutive time windows.
+
+    Every window but the first also covers the ``overlap`` seconds before
+    it, to warm up whatever consumes the messages.
+
+    Parameters
+    ----------
+    duration : float
+        The length of the bag file, in seconds.
+    shards : int
+        The number of windows.
+    overlap : Optional[float]
+        The number of seconds of warm-up before each window. Default is 0.
+
+    Returns
+    -------
+    List[Tuple[float, float, float]]
+        The start time, duration and warm-up of every window, in seconds
+        from the start of the bag file. The start time includes the warm-up.
+
+    Raises
+    ------
+    BagError
+        If the number of windows or the overlap is invalid.
 
     """
+    if shards < 1:
+        raise BagError("At least one window is needed.")
+    if overlap < 0:
+        raise BagError("The overlap cannot be negative.")
+    length = float(duration) / shards
+    windows = []
+    for i in range(shards):
+        start = i * length
+        begin = max(0.0, start - overlap)
+        end = duration if i == shards - 1 else start + length
+        windows.append((begin, end - begin, start - begin))
+    return windows
+
 
+RecorderStats = namedtuple("RecorderStats", "bytes_written current_file "
+                                            "files buffer_exceeded elapsed "
+                                            "bytes_per_sec")
 
-class MissingBagError(BagError):
+
+class ControlAck(namedtuple("ControlAck", "command steps latency bag_time")):
     """
-    Bag file was not specified.
+    The acknowledgement of a pause, resume or step command.
+
+    Attributes
+    ----------
+    command : str
+        One of "pause", "resume" or "step".
+    steps : int
+        The number of messages stepped through.
+    latency : float
+        The number of seconds between sending the command and seeing it take
+        effect.
+    bag_time : float | None
+        The bag time, in seconds, once it took effect.
 
     """
-    msg = "No Bag files were specified."
+    __slots__ = ()
 
 
-class BagNotRunningError(BagError):
+class ShardResult(namedtuple("ShardResult", "index start_time duration "
+                                            "warmup returncode started "
+                                            "elapsed error")):
     """
-    Raised when interaction is attempted with a bag file which is not running.
+    The outcome of playing one time window of a bag file.
+
+    Attributes
+    ----------
+    index : int
+        The position of the window in the bag file.
+    start_time : float
+        The start of the window, including the warm-up, in seconds from the
+        start of the bag file.
+    duration : float
+        The length of the window, including the warm-up, in seconds.
+    warmup : float
+        The number of seconds at the start of the window which belong to the
+        previous one, and are only played to warm up.
+    returncode : int | None
+        The return code of the player, or None if it never ran.
+    started : float
+        When the player was started, in seconds after the windows were
+        submitted.
+    elapsed : float
+        The wall-clock time spent playing the window, in seconds.
+    error : str | None
+        A description of the failure, if any.
 
     """
-    def __init__(self, action="talk to"):
-        message = u"Cannot {} process while bag is not running.".format(action)
-        super(BagNotRunningError, self).__init__(message)
+    __slots__ = ()
+
+    @property
+    def succeeded(self):
+        """
+        Check whether the window played to completion.
+
+        Returns
+        -------
+        bool
+            The player exited cleanly.
+
+        """
+        return self.error is None and self.returncode == 0
 
 
 class Bag(object):
@@ -59,33 +297,591 @@ class Bag(object):
 
     Parameters
     ----------
-    filenames : StringTypes | List[StringTypes]
+    filenames : str | List[str]
         The location of the bag files.
+    cache : Optional[IndexCache]
+        A persistent cache from which to load the bag file indexes.
+    shutdown_policy : Optional[ShutdownPolicy]
+        How to stop the process. Default is ``ShutdownPolicy()``.
 
     Attributes
     ----------
-    filenames : List[StringTypes]
+    filenames : List[str]
         The location of the bag files.
     process : subprocess.Popen
         The process containing the running bag file.
+    cache : IndexCache | None
+        The persistent index cache, if any.
+    shutdown_policy : ShutdownPolicy
+        How to stop the process.
+    shutdown_result : ShutdownResult | None
+        How the process was last stopped.
 
     """
-    def __init__(self, filenames):
+    def __init__(self, filenames, cache=None, shutdown_policy=None):
         if filenames in ("", u"", []):
             raise MissingBagError
-        if isinstance(filenames, StringTypes):
+        if isinstance(filenames, str):
             filenames = [filenames]
         self.filenames = filenames
         self.process = None
+        self.cache = cache
+        if shutdown_policy is None:
+            shutdown_policy = ShutdownPolicy()
+        self.shutdown_policy = shutdown_policy
+        self.shutdown_result = None
+        self._indexes = None
+
+    @property
+    def indexes(self):
+        """
+        The index of every bag file, read directly from the files.
+
+        The indexes are read on first access, without running ``rosbag``,
+        or loaded from the cache if one is used.
+
+        Returns
+        -------
+        List[BagIndex]
+            The index of every bag file, in order.
+
+        Raises
+        ------
+        BagFormatError
+            If a file is not a valid bag file.
+
+        """
+        if self._indexes is None:
+            if self.cache is None:
+                load = BagIndex
+            else:
+                load = self.cache.load
+            self._indexes = [load(filename) for filename in self.filenames]
+        return self._indexes
+
+    def info(self, compression=False):
+        """
+        Summarize the bag files, like ``rosbag info``.
+
+        Parameters
+        ----------
+        compression : Optional[Bool]
+            Also count the chunks per compression format. This reads the
+            header of every chunk, instead of the index alone.
+
+        Returns
+        -------
+        List[BagInfo]
+            The summary of every bag file, in order.
+
+        Raises
+        ------
+        BagFormatError
+            If a file is not a valid bag file.
+
+        """
+        return [index.info(compression) for index in self.indexes]
+
+    def read_messages(self, topics=None, start=None, end=None, workers=0,
+                      prefetch=None):
+        """
+        Read the messages in the bag files, without running ``rosbag``.
+
+        The files are memory-mapped, and messages in uncompressed chunks are
+        returned as views into the mapped files, without copying. Compressed
+        chunks are decompressed one at a time, or ahead of the consumer by a
+        pool of threads. Messages from several files are interleaved by time.
+        Each message is only deserialized if its ``msg`` attribute is used,
+        and then only the fields which are accessed.
+
+        Parameters
+        ----------
+        topics : Optional[str | List[str]]
+            The topics to read. Default is every topic.
+        start : Optional[float]
+            The earliest message time, in seconds since the epoch.
+        end : Optional[float]
+            The latest message time, in seconds since the epoch.
+        workers : Optional[int]
+            The number of threads decompressing chunks ahead of the consumer.
+            Default is 0, i.e. each chunk is decompressed when needed.
+        prefetch : Optional[int]
+            The maximum number of chunks per file decompressed ahead of the
+            consumer, which caps the memory used. Default is twice the number
+            of workers.
+
+        Yields
+        ------
+        Message
+            The messages, ordered by time. The order does not depend on the
+            number of workers.
+
+        Raises
+        ------
+        BagFormatError
+            If a file is not a valid bag file.
+
+        """
+        readers = [BagReader(index) for index in self.indexes]
+        executor = ThreadPoolExecutor(workers) if workers else None
+        streams = [reader.read_messages(topics, start, end, executor, prefetch)
+                   for reader in readers]
+        try:
+            if len(streams) == 1:
+                messages = streams[0]
+            else:
+                messages = merge_messages(streams)
+            for message in messages:
+                yield message
+        finally:
+            for stream in streams:
+                stream.close()
+            if executor is not None:
+                executor.shutdown()
+            for reader in readers:
+                reader.close()
+
+    def seek(self, t, topics=None):
+        """
+        Find the first message at or after a time, without running
+        ``rosbag``.
+
+        The chunk index is binary-searched, so the chunks before the time are
+        never read. With an index cache, the per-connection index is
+        binary-searched instead, and only the chunk holding the message is
+        read.
+
+        Parameters
+        ----------
+        t : float
+            The time, in seconds since the epoch.
+        topics : Optional[str | List[str]]
+            The topics to consider. Default is every topic.
+
+        Returns
+        -------
+        Message | None
+            The first message, or None if there are no messages after the
+            time.
+
+        Raises
+        ------
+        BagFormatError
+            If a file is not a valid bag file.
+
+        """
+        best = None
+        for index in self.indexes:
+            with BagReader(index) as reader:
+                message = reader.seek(t, topics)
+            if message is not None and (best is None or
+                                        message.timestamp < best.timestamp):
+                best = message
+        return best
+
+    def topic_table(self, topics=None, sizes=True):
+        """
+        Tabulate every message per topic, for vectorized analysis.
+
+        The tables are built from the index records, without deserializing
+        any message. See ``BagReader.topic_table``.
+
+        Parameters
+        ----------
+        topics : Optional[str | List[str]]
+            The topics to tabulate. Default is every topic.
+        sizes : Optional[Bool]
+            Fill in the size of every message. This reads the chunks, and
+            decompresses the compressed ones. Default is True.
+
+        Returns
+        -------
+        Dict[str, numpy.ndarray]
+            A structured array per topic, with the fields of
+            ``TOPIC_TABLE_FIELDS``, ordered by time. The ``file`` field is
+            the position of the bag file in ``filenames``.
+
+        Raises
+        ------
+        BagError
+            If NumPy is not installed.
+        BagFormatError
+            If a file is not a valid bag file.
+
+        """
+        parts = {}
+        for i, index in enumerate(self.indexes):
+            with BagReader(index) as reader:
+                tables = reader.topic_table(topics, sizes)
+            for topic, table in tables.items():
+                table["file"] = i
+                parts.setdefault(topic, []).append(table)
+        tables = {}
+        for topic, topic_parts in parts.items():
+            table = np.concatenate(topic_parts)
+            tables[topic] = table[np.argsort(table["timestamp"],
+                                             kind="stable")]
+        return tables
+
+    def to_columns(self, topics=None, start=None, end=None,
+                   row_group_size=ROW_GROUP_SIZE):
+        """
+        Stream the messages as column batches, one table per topic.
+
+        Nested fields are flattened into dotted column names. Each topic is
+        buffered until its batch holds ``row_group_size`` bytes of messages,
+        so memory use is bounded however large the bag files are. See
+        ``columns.iter_columns``.
+
+        Parameters
+        ----------
+        topics : Optional[str | List[str]]
+            The topics to read. Default is every topic.
+        start : Optional[float]
+            The earliest message time, in seconds since the epoch.
+        end : Optional[float]
+            The latest message time, in seconds since the epoch.
+        row_group_size : Optional[int]
+            The amount of serialized message data per batch, in bytes.
+            Default is 32 MiB.
+
+        Yields
+        ------
+        ColumnBatch
+            The batches, as soon as they are full.
+
+        Raises
+        ------
+        BagFormatError
+            If a file is not a valid bag file, or a message definition
+            cannot be parsed.
+
+        """
+        messages = self.read_messages(topics, start, end)
+        try:
+            for batch in iter_columns(messages, row_group_size):
+                yield batch
+        finally:
+            messages.close()
+
+    def to_parquet(self, directory, topics=None, start=None, end=None,
+                   workers=None, row_group_size=ROW_GROUP_SIZE,
+                   compression="snappy", callback=None):
+        """
+        Export every topic to its own Parquet file.
+
+        Topics are exported in parallel by a pool of processes, each
+        streaming its topic into row groups of bounded size. See
+        ``columns.export_parquet``.
+
+        Parameters
+        ----------
+        directory : str
+            The directory in which to write the Parquet files.
+        topics : Optional[str | List[str]]
+            The topics to export. Default is every topic.
+        start : Optional[float]
+            The earliest message time, in seconds since the epoch.
+        end : Optional[float]
+            The latest message time, in seconds since the epoch.
+        workers : Optional[int]
+            The number of processes. Default is the number of CPUs.
+        row_group_size : Optional[int]
+            The amount of serialized message data per row group, in bytes.
+            Default is 32 MiB.
+        compression : Optional[str]
+            The Parquet compression. Default is snappy.
+        callback : Optional[Callable[[ExportResult], None]]
+            Called with the outcome of every topic, as soon as it is done.
+
+        Returns
+        -------
+        List[ExportResult]
+            The outcome of every topic, sorted by topic.
+
+        Raises
+        ------
+        BagError
+            If pyarrow is not installed.
+
+        """
+        return export_parquet(self.filenames, directory, topics, start, end,
+                              workers, row_group_size, compression, callback)
+
+    def merge(self, out=None, topics=None, start=None, end=None,
+              workers=None, prefetch=None, compression="none",
+              chunk_threshold=768 * 1024):
+        """
+        Merge the bag files into a single time-ordered stream or bag file.
+
+        Each file is read as its own time-ordered stream, and the streams are
+        merged through a heap, so the cost grows with the number of messages
+        times the logarithm of the number of files. The compressed chunks of
+        every file are decompressed ahead of the merge by a shared pool of
+        threads.
+
+        Parameters
+        ----------
+        out : Optional[str]
+            The location of the merged bag file. Default is to return the
+            merged messages instead.
+        topics : Optional[str | List[str]]
+            The topics to keep. Default is every topic.
+        start : Optional[float]
+            The earliest message time, in seconds since the epoch.
+        end : Optional[float]
+            The latest message time, in seconds since the epoch.
+        workers : Optional[int]
+            The number of threads decompressing chunks. Default is one per
+            file, up to the number of CPUs.
+        prefetch : Optional[int]
+            The maximum number of chunks per file decompressed ahead of the
+            merge. Default is twice the number of workers.
+        compression : Optional[str]
+            The chunk compression of the merged bag file: ``none``, ``bz2``
+            or ``lz4``. Default is none.
+        chunk_threshold : Optional[int]
+            The size of the chunks of the merged bag file, in bytes.
+
+        Returns
+        -------
+        Iterator[Message] | int
+            The merged messages, ordered by time, or the number of messages
+            written if ``out`` is given.
+
+        Raises
+        ------
+        BagFormatError
+            If a file is not a valid bag file.
+
+        """
+        if workers is None:
+            workers = min(len(self.filenames), multiprocessing.cpu_count())
+        messages = self.read_messages(topics, start, end, workers, prefetch)
+        if out is None:
+            return messages
+        count = 0
+        with BagWriter(out, compression, chunk_threshold) as writer:
+            for message in messages:
+                writer.write_message(message)
+                count += 1
+        return count
+
+    def filter(self, out, topics=None, start=None, end=None, predicate=None,
+               compression=None, chunk_threshold=768 * 1024):
+        """
+        Copy some of the messages into a new bag file, like
+        ``rosbag filter``.
+
+        Without a predicate, nothing is deserialized. Chunks whose messages
+        are all selected are copied as they are, still compressed, and the
+        message records of the other chunks are copied as raw bytes. With a
+        predicate, it is evaluated on every message within the topics and
+        time range, in time order.
+
+        Parameters
+        ----------
+        out : str
+            The location of the new bag file.
+        topics : Optional[str | List[str]]
+            The topics to keep. Default is every topic.
+        start : Optional[float]
+            The earliest message time, in seconds since the epoch.
+        end : Optional[float]
+            The latest message time, in seconds since the epoch.
+        predicate : Optional[Callable[[Message], Bool]]
+            Keep only the messages for which this returns true.
+        compression : Optional[str]
+            The compression of the chunks written: ``none``, ``bz2`` or
+            ``lz4``. By default, chunks copied whole keep their compression
+            and the others are not compressed. Chunks compressed differently
+            are rewritten.
+        chunk_threshold : Optional[int]
+            The size of the chunks written, in bytes.
+
+        Returns
+        -------
+        int
+            The number of messages written.
+
+        Raises
+        ------
+        BagFormatError
+            If a file is not a valid bag file.
+
+        """
+        count = 0
+        with BagWriter(out, compression or "none", chunk_threshold) as writer:
+            if predicate is not None:
+                for message in self.read_messages(topics, start, end):
+                    if predicate(message):
+                        writer.write_message(message)
+                        count += 1
+                return count
+
+            start = None if start is None else to_nsec(start)
+            end = None if end is None else to_nsec(end)
+            for index in self.indexes:
+                with BagReader(index) as reader:
+                    count += self._copy_chunks(reader, writer, topics, start,
+                                               end, compression)
+        return count
+
+    @staticmethod
+    def _copy_chunks(reader, writer, topics, start, end, compression):
+        selected = reader.connection_ids(topics)
+        connections = {}
+        for conn in sorted(selected):
+            connection = reader.index.connections[conn]
+            connections[conn] = writer.add_connection(
+                connection.topic, connection.datatype, connection.md5sum,
+                connection.msg_def, connection.header, conn)
+        count = 0
+        for chunk in reader.index.chunk_infos:
+            if ((start is not None and chunk.end_time < start) or
+                    (end is not None and chunk.start_time > end) or
+                    selected.isdisjoint(chunk.connection_counts)):
+                continue
+            whole = ((start is None or chunk.start_time >= start) and
+                     (end is None or chunk.end_time <= end) and
+                     all(conn in selected and connections[conn].id == conn
+                         for conn in chunk.connection_counts))
+            if whole:
+                chunk_compression, records = reader.raw_chunk(chunk)
+                if compression in (None, chunk_compression):
+                    writer.copy_chunk(chunk, records)
+                    count += sum(chunk.connection_counts.values())
+                    continue
+            entries = reader.chunk_entries(chunk, selected, start, end)
+            if not entries:
+                continue
+            data = reader.chunk_data(chunk)
+            for timestamp, offset, conn in entries:
+                message = reader.message_at(data, offset, timestamp, conn)
+                writer.write(message.topic, message.data, timestamp,
+                             connections[conn])
+            count += len(entries)
+        return count
+
+    def compress(self, compression="bz2", workers=1, callback=None):
+        """
+        Compress the bag files in place, like ``rosbag compress``.
+
+        Parameters
+        ----------
+        compression : Optional[str]
+            ``bz2`` or ``lz4``. Default is bz2.
+        workers : Optional[int]
+            The number of processes. Default is 1.
+        callback : Optional[Callable[[ConversionResult], None]]
+            Called with the outcome of every file, as soon as it is done.
+
+        Returns
+        -------
+        List[ConversionResult]
+            The outcome of every file, in order.
+
+        """
+        return self._convert("compress", compression, workers, callback)
+
+    def decompress(self, workers=1, callback=None):
+        """
+        Decompress the bag files in place, like ``rosbag decompress``.
+
+        Parameters
+        ----------
+        workers : Optional[int]
+            The number of processes. Default is 1.
+        callback : Optional[Callable[[ConversionResult], None]]
+            Called with the outcome of every file, as soon as it is done.
+
+        Returns
+        -------
+        List[ConversionResult]
+            The outcome of every file, in order.
+
+        """
+        return self._convert("decompress", None, workers, callback)
+
+    def reindex(self, workers=1, callback=None):
+        """
+        Rebuild the index of the bag files in place, like ``rosbag
+        reindex``.
+
+        Parameters
+        ----------
+        workers : Optional[int]
+            The number of processes. Default is 1.
+        callback : Optional[Callable[[ConversionResult], None]]
+            Called with the outcome of every file, as soon as it is done.
+
+        Returns
+        -------
+        List[ConversionResult]
+            The outcome of every file, in order.
+
+        """
+        return self._convert("reindex", None, workers, callback)
+
+    def check(self, thorough=False):
+        """
+        Check the consistency of the bag files, like ``rosbag check``.
+
+        Parameters
+        ----------
+        thorough : Optional[Bool]
+            Also decompress every chunk, and check that its messages are
+            where the index says. By default, only the index is read.
+
+        Returns
+        -------
+        List[CheckResult]
+            The problems found in every file, in order.
+
+        """
+        return [check_bag(filename, thorough) for filename in self.filenames]
+
+    def fix(self, progress=None, backup=True):
+        """
+        Recover bag files which were never closed, e.g. after a crash.
+
+        Every complete record is recovered with one sequential pass over the
+        file, and the index is rebuilt. If the recovery is interrupted, it
+        resumes where it stopped the next time.
+
+        Parameters
+        ----------
+        progress : Optional[Callable[[RepairProgress], None]]
+            Called periodically with the progress of the scan.
+        backup : Optional[Bool]
+            Keep the originals as ``<name>.orig.bag``. Default is True.
+
+        Returns
+        -------
+        List[RepairProgress]
+            The number of chunks and messages recovered from every file, in
+            order.
+
+        """
+        results = [fix_bag(filename, progress, backup)
+                   for filename in self.filenames]
+        self._indexes = None
+        return results
+
+    def _convert(self, operation, compression, workers, callback):
+        results = batch_convert(self.filenames, operation, compression,
+                                workers, callback=callback)
+        self._indexes = None
+        return results
 
     def send(self, string):
         """
-        Write something to process stdin.
+        Write something to process stdin, and flush it.
 
         Parameters
         ----------
-        string : str
-            The string to write.
+        string : str | bytes
+            The string to write. Text is encoded as UTF-8.
 
         Raises
         ------
@@ -93,31 +889,46 @@ class Bag(object):
             If interaction is attempted when the bag file is not running.
 
         """
+        if not isinstance(string, bytes):
+            string = string.encode("utf-8")
         try:
             self.process.stdin.write(string)
-        except AttributeError:
+            self.process.stdin.flush()
+        except (AttributeError, IOError, OSError, ValueError):
             raise BagNotRunningError()
 
     def stop(self):
         """
         Stop a running bag file.
 
+        The process is interrupted, and terminated or killed if it does not
+        exit within the timeouts of the shutdown policy.
+
+        Returns
+        -------
+        ShutdownResult
+            The exit status, the last signal sent and the time taken.
+
         Raises
         ------
         BagNotRunningError
             If the bag file is not running.
 
         """
-        try:
-            self.process.terminate()
-            self.process.kill()
-        except AttributeError:
+        if self.process is None:
             raise BagNotRunningError("stop")
+        self.shutdown_result = shutdown(self.process, self.shutdown_policy)
+        return self.shutdown_result
 
     def wait(self):
         """
         Block until process is complete.
 
+        Returns
+        -------
+        int
+            The return code of the process.
+
         Raises
         ------
         BagNotRunningError
@@ -125,7 +936,7 @@ class Bag(object):
 
         """
         try:
-            self.process.wait()
+            return self.process.wait()
         except AttributeError:
             raise BagNotRunningError("wait for")
 
@@ -158,7 +969,6 @@ class Bag(object):
         Context manager exit point.
 
         """
-        time.sleep(1)  # For pretty output.
         if self.is_running:
             if exc_type is None:
                 logger.warning("Exited while process is still running.")
@@ -183,15 +993,36 @@ class BagPlayer(Bag):
     """
     Play Bag files.
 
+    Attributes
+    ----------
+    progress : ProgressReader | None
+        Follows the status output of ``rosbag play``, if requested.
+
     """
+    progress = None
+    standby = None
+    _paused = None
+    _toggled = None
+    _step_target = 0
+
     def play(self, wait=False, stdin=sp.PIPE, stdout=None, stderr=None,
              quiet=None, immediate=None, start_paused=None, queue_size=None,
              publish_clock=None, clock_publish_freq=None, delay=None,
              publish_rate_multiplier=None, start_time=None, duration=None,
-             loop=None, keep_alive=None):
+             loop=None, keep_alive=None, sink=None, clock_sink=None,
+             max_lag=None, metrics_callback=None, metrics_interval=1.0,
+             progress=False, progress_callback=None):
         """
         Play the bag file.
 
+        By default, ``rosbag play`` is run in a subprocess. If players were
+        warmed up with matching options, a paused one is resumed instead of
+        starting a new one. If a sink is given, the bag files are instead
+        played in-process by a ``PlaybackEngine``, which replaces the
+        process. Pausing, stepping and waiting work the same way, and the
+        engine also allows direct control through ``process.pause()``,
+        ``process.resume()``, ``process.step()`` and ``process.seek()``.
+
         Parameters
         ----------
         wait : Optional[Bool]
@@ -228,58 +1059,700 @@ class BagPlayer(Bag):
             Loop playback.
         keep_alive : Optional[Bool]
             Keep alive past end of bag (e.g. for publishing latched topics).
+        sink : Optional[Callable[[Message], None]]
+            Play in-process, and call this with every message when it is
+            due. The stdin, stdout, stderr and quiet options are ignored.
+        clock_sink : Optional[Callable[[float], None]]
+            When playing in-process, call this with the bag time, in seconds,
+            to publish the clock.
+        max_lag : Optional[float]
+            When playing in-process, skip the messages which are more than
+            this many seconds late.
+        metrics_callback : Optional[Callable[[MetricsSummary], None]]
+            When playing in-process, call this periodically with a summary
+            of the timing accuracy.
+        metrics_interval : Optional[float]
+            The period of the metrics callback, in seconds. Default is 1.
+        progress : Optional[Bool]
+            Read the status output of ``rosbag play`` on a background thread,
+            to follow its progress through ``bag_time`` and
+            ``progress_events()``. The stdout option is ignored, and quiet
+            must not be set.
+        progress_callback : Optional[Callable[[Progress], None]]
+            Call this with every status read. Implies progress.
+
+        Raises
+        ------
+        BagError
+            If the progress is followed with quiet set, since ``rosbag play``
+            then prints no status.
 
         """
-        arguments = ["rosbag", "play"]
-        arguments.extend(self.filenames)
-
-        if quiet:
-            arguments.append("-q")
-        if immediate:
-            arguments.append("-i")
-        if start_paused:
-            arguments.append("--pause")
-        if queue_size is not None:
-            arguments.append("--queue={}".format(queue_size))
-        if publish_clock:
-            arguments.append("--clock")
-        if clock_publish_freq is not None:
-            arguments.append("--hz={}".format(clock_publish_freq))
-        if delay is not None:
-            arguments.append("--delay={}".format(delay))
-        if publish_rate_multiplier is not None:
-            arguments.append("--rate={}".format(publish_rate_multiplier))
-        if start_time is not None:
-            arguments.append("--start={}".format(start_time))
-        if duration is not None:
-            arguments.append("--duration={}".format(duration))
-        if loop:
-            arguments.append("-l")
-        if keep_alive:
-            arguments.append("-k")
-
-        self.process = sp.Popen(arguments,
-                                stdin=stdin, stdout=stdout, stderr=stderr)
+        self.progress = None
+        self._paused = bool(start_paused)
+        self._toggled = None
+        self._step_target = 0
+        if sink is not None:
+            self.process = PlaybackEngine(self, sink, clock_sink)
+            self.process.play(
+                immediate=immediate, start_paused=start_paused,
+                queue_size=queue_size, publish_clock=publish_clock,
+                clock_publish_freq=clock_publish_freq, delay=delay,
+                publish_rate_multiplier=publish_rate_multiplier,
+                start_time=start_time, duration=duration, loop=loop,
+                keep_alive=keep_alive, max_lag=max_lag,
+                metrics_callback=metrics_callback,
+                metrics_interval=metrics_interval)
+            if wait:
+                self.wait()
+            return
+
+        progress = progress or progress_callback is not None
+        if progress and quiet:
+            raise BagError("Cannot follow the progress of a quiet player.")
+        options = dict(
+            quiet=quiet, immediate=immediate, start_paused=start_paused,
+            queue_size=queue_size, publish_clock=publish_clock,
+            clock_publish_freq=clock_publish_freq, delay=delay,
+            publish_rate_multiplier=publish_rate_multiplier,
+            start_time=start_time, duration=duration, loop=loop,
+            keep_alive=keep_alive)
+        if (self.standby is not None and stdin is sp.PIPE and
+                stdout is None and stderr is None and
+                self._standby_arguments(options) == self.standby.arguments):
+            player = self.standby.acquire()
+            if player is not None:
+                self.process = player.process
+                self.progress = player.progress
+                self.progress.callback = progress_callback
+                if not start_paused:
+                    player.resume()
+                if wait:
+                    self.wait()
+                return
+            logger.warning("No standby player was ready. Starting one.")
+
+        arguments = play_arguments(self.filenames, **options)
+        if progress:
+            stdout = sp.PIPE
+        self.process = register(
+            sp.Popen(arguments, stdin=stdin, stdout=stdout, stderr=stderr,
+                     **popen_options(self.shutdown_policy)),
+            self.shutdown_policy)
+        if progress:
+            self.progress = ProgressReader(self.process.stdout,
+                                           progress_callback)
         if wait:
             self.wait()
 
-    def pause(self):
+    def warm_up(self, size=1, ready_timeout=30.0, **options):
+        """
+        Keep paused ``rosbag play`` processes ready for ``play``.
+
+        The players are started with ``--pause``, and are ready once they
+        report being paused, with the bag files open and the topics
+        advertised. A later call to ``play`` with the same options resumes
+        one of them, which only takes a write to its stdin, and a new one is
+        started in its place. The standby players always pipe their output
+        to follow their progress, so quiet is ignored.
+
+        Parameters
+        ----------
+        size : Optional[int]
+            The number of players to keep ready. Default is 1.
+        ready_timeout : Optional[float]
+            How long ``play`` waits for a player which is still starting,
+            before starting one itself. Default is 30 seconds.
+        options
+            The ``rosbag play`` options of ``play``, such as immediate or
+            publish_rate_multiplier. ``play`` only uses the standby players
+            when it is given the same options, apart from start_paused and
+            quiet, and no stdin, stdout or stderr.
+
+        Returns
+        -------
+        StandbyPool
+            The pool of players.
+
+        """
+        self.cool_down()
+        self.standby = StandbyPool(self._standby_arguments(options), size,
+                                   ready_timeout, self.shutdown_policy)
+        return self.standby
+
+    def cool_down(self):
+        """
+        Stop the players kept ready by ``warm_up``.
+
+        The player which is currently playing, if any, is not affected.
+
+        """
+        if self.standby is not None:
+            self.standby.close()
+            self.standby = None
+
+    def play_shards(self, shards=None, overlap=0.0, workers=None,
+                    callback=None, **options):
+        """
+        Play time windows of the bag files in parallel.
+
+        The bag files are split into consecutive windows with the start_time
+        and duration options, and every window is played by its own
+        ``rosbag play``, in immediate mode by default. The order of the
+        messages across windows is lost, so this only suits consumers which
+        do not depend on it, such as stateless detectors. With an overlap,
+        each window starts early to warm up stateful consumers, and the
+        messages of the warm-up are played twice. ``rosbag play`` includes
+        the end of its duration, so a message right on the boundary between
+        two windows may also be played twice.
+
+        Parameters
+        ----------
+        shards : Optional[int]
+            The number of windows. Default is the number of workers.
+        overlap : Optional[float]
+            The number of seconds of warm-up before each window. Default is
+            0.
+        workers : Optional[int]
+            The number of players running at once. Default is the number of
+            cores.
+        callback : Optional[Callable[[ShardResult], None]]
+            Called from a worker thread whenever a window is done.
+        options
+            The other options of ``play``. immediate defaults to True, and
+            start_time, duration, wait and start_paused are set per window.
+
+        Returns
+        -------
+        List[ShardResult]
+            The result of every window, in order.
+
+        Raises
+        ------
+        BagError
+            If an option is set per window, the bag files have no messages,
+            or the windows are invalid.
+
+        """
+        for key in ("start_time", "duration", "wait", "start_paused"):
+            if key in options:
+                raise BagError("{} is set per window.".format(key))
+        options.setdefault("immediate", True)
+        starts, ends = [], []
+        for info in self.info():
+            if info.start_time is not None:
+                starts.append(info.start_time)
+                ends.append(info.end_time)
+        if not starts:
+            raise BagError("The bag files have no messages.")
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if shards is None:
+            shards = workers
+        windows = time_windows(max(ends) - min(starts), shards, overlap)
+
+        # Imported here, since the pool module imports this one.
+        from .pool import BagPlayerPool
+        # The shards are paced by the clock, so more of them may be played
+        # at once than there are cores.
+        pool = BagPlayerPool(workers, cap_to_cpus=False, cache=self.cache,
+                             shutdown_policy=self.shutdown_policy)
+        last = len(windows) - 1
+        per_window = [dict(start_time=start_time,
+                           duration=None if i == last else duration)
+                      for i, (start_time, duration, _) in enumerate(windows)]
+
+        def shard(result):
+            start_time, duration, warmup = windows[result.index]
+            return ShardResult(result.index, start_time, duration, warmup,
+                               result.returncode, result.started,
+                               result.elapsed, result.error)
+
+        def report(result):
+            if callback is not None:
+                callback(shard(result))
+
+        results = pool.play([self.filenames] * len(windows), report,
+                            per_window, **options)
+        return [shard(result) for result in results.results]
+
+    def _standby_arguments(self, options):
+        options = dict(options, quiet=None, start_paused=True)
+        return play_arguments(self.filenames, **options)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Context manager exit point. The standby players are stopped.
+
+        """
+        try:
+            return super(BagPlayer, self).__exit__(exc_type, exc_value,
+                                                   traceback)
+        finally:
+            self.cool_down()
+
+    @property
+    def bag_time(self):
+        """
+        The current bag time.
+
+        This is available when playing in-process, or when following the
+        progress of ``rosbag play``, and is cheap to read.
+
+        Returns
+        -------
+        float | None
+            The bag time, in seconds, or None if it is not known.
+
+        """
+        if self.progress is not None:
+            return self.progress.bag_time
+        return getattr(self.process, "bag_time", None)
+
+    def progress_events(self, timeout=None):
+        """
+        Iterate over the status of ``rosbag play`` as it changes.
+
+        Statuses which arrive faster than they are consumed are coalesced,
+        and the iteration ends when the process closes its output.
+
+        Parameters
+        ----------
+        timeout : Optional[float]
+            Stop iterating if no status arrives for this many seconds.
+
+        Yields
+        ------
+        Progress
+            The latest status.
+
+        Raises
+        ------
+        BagError
+            If the progress is not being followed.
+
+        """
+        if self.progress is None:
+            raise BagError("Play with progress=True to follow the progress.")
+        return self.progress.events(timeout)
+
+    @property
+    def metrics(self):
+        """
+        The timing accuracy of the current run.
+
+        Only in-process playback measures when every message is emitted.
+
+        Returns
+        -------
+        PlaybackMetrics | None
+            The metrics, or None if ``rosbag play`` is running instead.
+
+        """
+        return getattr(self.process, "metrics", None)
+
+    @property
+    def is_paused(self):
+        """
+        Check whether the bag file is paused.
+
+        When the progress is followed, the state is read from the status
+        output of ``rosbag play``, unless a toggle sent by ``pause`` or
+        ``resume`` has not shown in it yet. Otherwise, since ``rosbag play``
+        only has a key which toggles pause, the state is tracked from the
+        start_paused option and the commands sent since.
+
+        Returns
+        -------
+        bool | None
+            The bag file is paused, or None if it is not known.
+
+        """
+        if isinstance(self.process, PlaybackEngine):
+            return self.process.is_paused
+        latest = None if self.progress is None else self.progress.latest
+        if latest is None:
+            return self._paused
+        if (self._toggled is not None and
+                latest.is_paused is not self._paused and
+                latest.received < self._toggled + TOGGLE_SETTLE_TIME):
+            return self._paused
+        self._paused = latest.is_paused
+        return self._paused
+
+    def pause(self, confirm=False, timeout=5.0):
         """
         Pause the bag file.
 
+        Nothing is sent if it is known to be paused already.
+
+        Parameters
+        ----------
+        confirm : Optional[Bool]
+            Wait until ``rosbag play`` reports being paused. This needs its
+            progress to be followed.
+        timeout : Optional[float]
+            How long to wait for the confirmation, in seconds. Default is 5.
+
+        Returns
+        -------
+        ControlAck | None
+            The acknowledgement, if confirm is set.
+
+        Raises
+        ------
+        BagError
+            If the pause could not be confirmed.
+
         """
-        self.send(" ")
+        return self._set_paused(True, confirm, timeout)
 
-    def resume(self):
+    def resume(self, confirm=False, timeout=5.0):
         """
         Resume the bag file.
 
+        Nothing is sent if it is known to be playing already.
+
+        Parameters
+        ----------
+        confirm : Optional[Bool]
+            Wait until ``rosbag play`` reports playing. This needs its
+            progress to be followed.
+        timeout : Optional[float]
+            How long to wait for the confirmation, in seconds. Default is 5.
+
+        Returns
+        -------
+        ControlAck | None
+            The acknowledgement, if confirm is set.
+
+        Raises
+        ------
+        BagError
+            If the resume could not be confirmed.
+
         """
-        self.send(" ")
+        return self._set_paused(False, confirm, timeout)
+
+    def _set_paused(self, paused, confirm, timeout):
+        command = "pause" if paused else "resume"
+        started = monotonic()
+        if isinstance(self.process, PlaybackEngine):
+            getattr(self.process, command)()
+            self._paused = paused
+            if confirm:
+                return ControlAck(command, 0, monotonic() - started,
+                                  self.process.bag_time)
+            return None
+
+        if confirm and self.progress is None:
+            raise BagError("Play with progress=True to confirm commands.")
+        sent = self.is_paused is not paused
+        if sent:
+            self.send(" ")
+            self._paused = paused
+            self._toggled = monotonic()
+        if not confirm:
+            return None
 
-    def step(self):
+        def done(reader):
+            latest = reader.latest
+            return (latest is not None and latest.is_paused is paused and
+                    (not sent or latest.received >= started))
+
+        if not self.progress.wait_for(done, timeout):
+            raise BagError("Could not confirm the {} within {} s."
+                           .format(command, timeout))
+        latest = self.progress.latest
+        latency = latest.received - started if sent else 0.0
+        return ControlAck(command, 0, latency, latest.bag_time)
+
+    def step(self, count=1, confirm=False, timeout=5.0):
         """
         Step through a paused bag file.
 
+        The keys for all the steps are sent in a single write.
+
+        Parameters
+        ----------
+        count : Optional[int]
+            The number of messages to play. Default is 1.
+        confirm : Optional[Bool]
+            Wait until the messages have been played. ``rosbag play`` only
+            reports the bag time, so each step is seen as a change in bag
+            time: messages with the same timestamp as the one before cannot
+            be confirmed. This needs the progress to be followed.
+        timeout : Optional[float]
+            How long to wait for the confirmation, in seconds. Default is 5.
+
+        Returns
+        -------
+        ControlAck | None
+            The acknowledgement, if confirm is set.
+
+        Raises
+        ------
+        BagError
+            If the steps could not be confirmed, or the bag file is known to
+            be playing when confirm is set.
+
         """
-        self.send("s")
+        started = monotonic()
+        if isinstance(self.process, PlaybackEngine):
+            target = self.process.step(count)
+            if not confirm:
+                return None
+            if not self.process.wait_for_steps(target, timeout):
+                raise BagError("Could not confirm {} steps within {} s."
+                               .format(count, timeout))
+            return ControlAck("step", count, monotonic() - started,
+                              self.process.bag_time)
+
+        if confirm:
+            if self.progress is None:
+                raise BagError("Play with progress=True to confirm commands.")
+            if self.is_paused is False:
+                raise BagError("Pause the bag file before stepping.")
+            target = max(self.progress.advances, self._step_target) + count
+            self._step_target = target
+        self.send("s" * count)
+        if not confirm:
+            return None
+
+        if not self.progress.wait_for(
+                lambda reader: reader.advances >= target, timeout):
+            raise BagError("Could not confirm {} steps within {} s."
+                           .format(count, timeout))
+        latest = self.progress.latest
+        return ControlAck("step", count, latest.received - started,
+                          latest.bag_time)
+
+
+class BagRecorder(Bag):
+    """
+    Record bag files.
+
+    The file name given is the output of ``rosbag record``. While recording,
+    ``stats()`` reports how much has been written by watching the output
+    files, and how often the record buffer overflowed by watching the
+    warnings of ``rosbag record``.
+
+    Parameters
+    ----------
+    filenames : str
+        The name of the bag file to write, or its prefix.
+    stop_timeout : Optional[float]
+        The time, in seconds, to let ``rosbag record`` close its files after
+        an interrupt before terminating it. Default is 10.
+
+    """
+    BUFFER_EXCEEDED = re.compile(br"buffer exceeded")
+
+    def __init__(self, filenames, stop_timeout=10.0, **kwargs):
+        super(BagRecorder, self).__init__(filenames, **kwargs)
+        self.stop_timeout = stop_timeout
+        self.buffer_exceeded = 0
+        self._prefix = False
+        self._sizes = {}
+        self._existing = set()
+        self._started = None
+        self._stopped = None
+        self._stderr_thread = None
+
+    def record(self, topics=None, wait=False, stdin=sp.PIPE, stdout=None,
+               stderr=None, all_topics=None, regex=None, exclude=None,
+               prefix=None, quiet=None, split_size=None, split_duration=None,
+               max_splits=None, duration=None, limit=None, buffer_size=None,
+               chunk_size=None, compression=None, node=None,
+               tcp_nodelay=None, udp=None):
+        """
+        Start recording.
+
+        Parameters
+        ----------
+        topics : Optional[str | List[str]]
+            The topics to record, or regular expressions if regex is set.
+        wait : Optional[Bool]
+            Wait until completion.
+        stdin : Optional[file]
+            The stdin buffer. Default is subprocess.PIPE.
+        stdout : Optional[file]
+            The stdout buffer.
+        stderr : Optional[file]
+            The stderr buffer. By default, the warnings are read to count
+            buffer overflows, and logged.
+        all_topics : Optional[Bool]
+            Record all topics.
+        regex : Optional[Bool]
+            Match topics using regular expressions.
+        exclude : Optional[str]
+            Exclude topics matching this regular expression.
+        prefix : Optional[Bool]
+            Use the file name as a prefix, to which the date is appended.
+        quiet : Optional[Bool]
+            Suppress console output.
+        split_size : Optional[int]
+            Split the bag file when it reaches this size, in MB.
+        split_duration : Optional[str | float]
+            Split the bag file after this duration, e.g. "30s" or "5m".
+        max_splits : Optional[int]
+            Keep at most this many split files, deleting the oldest.
+        duration : Optional[str | float]
+            Stop recording after this duration.
+        limit : Optional[int]
+            Only record this many messages on each topic.
+        buffer_size : Optional[int]
+            The size of the internal buffer, in MB. Default is 256. Zero is
+            infinite.
+        chunk_size : Optional[int]
+            The size of the chunks, in KB. Default is 768.
+        compression : Optional[str]
+            "bz2" or "lz4". Default is no compression.
+        node : Optional[str]
+            Record all topics subscribed to by this node.
+        tcp_nodelay : Optional[Bool]
+            Use the TCP_NODELAY transport hint.
+        udp : Optional[Bool]
+            Use the UDP transport hint.
+
+        Raises
+        ------
+        BagError
+            If the recorder is already running, or the options are
+            inconsistent.
+
+        """
+        if self.is_running:
+            raise BagError("The recorder is already running.")
+        arguments = record_arguments(
+            self.filenames[0], topics=topics, all_topics=all_topics,
+            regex=regex, exclude=exclude, prefix=prefix, quiet=quiet,
+            split_size=split_size, split_duration=split_duration,
+            max_splits=max_splits, duration=duration, limit=limit,
+            buffer_size=buffer_size, chunk_size=chunk_size,
+            compression=compression, node=node, tcp_nodelay=tcp_nodelay,
+            udp=udp)
+
+        self._prefix = bool(prefix)
+        self._sizes = {}
+        self._existing = set(self._output_files())
+        self.buffer_exceeded = 0
+        self._started = monotonic()
+        self._stopped = None
+        monitor = stderr is None
+        self.process = register(
+            sp.Popen(arguments, stdin=stdin, stdout=stdout,
+                     stderr=sp.PIPE if monitor else stderr,
+                     **popen_options(self.shutdown_policy)),
+            self.shutdown_policy)
+        if monitor:
+            self._stderr_thread = threading.Thread(target=self._read_stderr,
+                                                   args=(self.process.stderr,))
+            self._stderr_thread.daemon = True
+            self._stderr_thread.start()
+        if wait:
+            self.wait()
+
+    def stop(self):
+        """
+        Stop recording.
+
+        ``rosbag record`` is interrupted so that it closes the bag file
+        properly, and only terminated if it does not exit in time.
+
+        Returns
+        -------
+        ShutdownResult
+            The exit status, the last signal sent and the time taken.
+
+        Raises
+        ------
+        BagNotRunningError
+            If the recorder is not running.
+
+        """
+        if self.process is None:
+            raise BagNotRunningError("stop")
+        self.shutdown_result = shutdown(
+            self.process,
+            self.shutdown_policy._replace(interrupt_timeout=self.stop_timeout))
+        if self._stopped is None:
+            self._stopped = monotonic()
+        if self.shutdown_result.escalated:
+            logger.warning("rosbag record did not stop. It was terminated.")
+        return self.shutdown_result
+
+    def stats(self):
+        """
+        Report the progress of the recording.
+
+        The sizes of the output files are read from the file system, so this
+        is cheap enough to be polled.
+
+        Returns
+        -------
+        RecorderStats
+            The number of bytes written so far, including split files which
+            have since been deleted, the file currently being written, the
+            files written, the number of buffer overflows reported by
+            ``rosbag record``, the elapsed time and the average write rate.
+            The elapsed time stops counting once the recording has ended.
+
+        """
+        current = None
+        paths = [] if self._started is None else self._output_files()
+        for path in paths:
+            if path in self._existing:
+                continue
+            name = path
+            if path.endswith(".active"):
+                name = path[:-len(".active")]
+                current = name
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            self._sizes[name] = max(size, self._sizes.get(name, 0))
+        files = sorted(self._sizes, key=self._split_number)
+        written = sum(self._sizes.values())
+        elapsed = 0.0
+        if self._started is not None:
+            if self._stopped is None and self.process.poll() is not None:
+                self._stopped = monotonic()
+            elapsed = (self._stopped or monotonic()) - self._started
+        return RecorderStats(written, current, files, self.buffer_exceeded,
+                             elapsed, written / elapsed if elapsed else 0.0)
+
+    def _output_files(self):
+        output = self.filenames[0]
+        if output.endswith(".bag"):
+            output = output[:-len(".bag")]
+        directory, stem = os.path.split(output)
+        pattern = re.compile(
+            re.escape(stem) +
+            (r"_\d{4}(-\d\d){5}" if self._prefix else "") +
+            r"(_\d+)?\.bag(\.active)?$")
+        try:
+            names = os.listdir(directory or os.curdir)
+        except OSError:
+            return []
+        return [os.path.join(directory, name) for name in names
+                if pattern.match(name)]
+
+    @staticmethod
+    def _split_number(name):
+        match = re.search(r"_(\d+)\.bag$", name)
+        return (int(match.group(1)) if match else -1, name)
+
+    def _read_stderr(self, stream):
+        for line in iter(stream.readline, b""):
+            text = line.decode("utf-8", "replace").rstrip()
+            if self.BUFFER_EXCEEDED.search(line):
+                self.buffer_exceeded += 1
+                logger.warning(text)
+            else:
+                logger.debug(text)
+        stream.close()
+
+    def __repr__(self):
+        return "<BagRecorder({})>".format(self.filenames)
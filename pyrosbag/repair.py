@@ -0,0 +1,496 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Check bag files, and recover those which were never closed.
+
+When ``rosbag record`` is killed, or the machine loses power, the bag file
+has no index, and its last record may be cut short. ``reindex_bag`` recovers
+every complete record with a single sequential pass over the file, reading
+it in large blocks, and rebuilds the index. It reports its progress, and can
+save checkpoints from which an interrupted run resumes.
+
+"""
+from collections import namedtuple
+import logging
+import os
+import pickle
+from time import monotonic
+
+from .bagfile import (
+    BAG_HEADER_LEN, MAGIC, OP_BAG_HEADER, OP_CHUNK, OP_CONNECTION,
+    OP_MESSAGE_DATA, UINT32, BagIndex, BagReader, decode_header, decompress,
+    iter_records, parse_connection, read_record, record_op, unpack_time)
+from .exceptions import BagError, BagFormatError, UnindexedBagError
+from .writer import BagWriter, replace_file, sync_file
+
+
+logger = logging.getLogger("bag_player.repair")
+
+#: The size of the blocks read when scanning a file.
+READ_SIZE = 16 * 1024 * 1024
+
+#: The suffixes of the backup and the partial file ``fix_bag`` writes next to
+#: a bag file.
+BACKUP_SUFFIX = ".orig.bag"
+PARTIAL_SUFFIX = ".fixing.bag"
+
+
+class CheckResult(namedtuple("CheckResult", ["filename", "problems",
+                                             "chunk_count",
+                                             "message_count"])):
+    """
+    The outcome of checking a bag file.
+
+    Attributes
+    ----------
+    filename : str
+        The bag file.
+    problems : List[str]
+        A description of every problem found.
+    chunk_count : int
+        The number of chunks in the index.
+    message_count : int
+        The number of messages in the index.
+
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        """
+        Check whether the bag file is consistent.
+
+        Returns
+        -------
+        bool
+            No problem was found.
+
+        """
+        return not self.problems
+
+
+class RepairProgress(namedtuple("RepairProgress", ["filename", "bytes_read",
+                                                   "total_bytes", "chunks",
+                                                   "messages", "elapsed"])):
+    """
+    The progress of a scan.
+
+    Attributes
+    ----------
+    filename : str
+        The bag file being scanned.
+    bytes_read : int
+        The position reached in the file.
+    total_bytes : int
+        The size of the file.
+    chunks : int
+        The number of chunks recovered so far.
+    messages : int
+        The number of messages recovered so far.
+    elapsed : float
+        The time spent, in seconds, since the scan started or resumed.
+
+    """
+    __slots__ = ()
+
+    @property
+    def fraction(self):
+        """
+        The fraction of the file which has been scanned.
+
+        """
+        return self.bytes_read / float(self.total_bytes or 1)
+
+    @property
+    def megabytes_per_sec(self):
+        """
+        The scan throughput, in megabytes per second.
+
+        """
+        return self.bytes_read / 1e6 / self.elapsed if self.elapsed else 0.0
+
+
+class RecordScanner(object):
+    """
+    Read consecutive records from a file, in large blocks.
+
+    The scan stops at the end of the file, or at the first record which is
+    cut short, in which case ``truncated`` is set.
+
+    Parameters
+    ----------
+    stream : file
+        The file, opened in binary mode.
+    pos : Optional[int]
+        The position of the first record. Default is just after the magic
+        string.
+    read_size : Optional[int]
+        The size of the blocks read.
+
+    Attributes
+    ----------
+    pos : int
+        The position of the next record.
+    truncated : bool
+        The last record is incomplete.
+
+    """
+    def __init__(self, stream, pos=len(MAGIC), read_size=READ_SIZE):
+        self.stream = stream
+        self.pos = pos
+        self.read_size = read_size
+        self.truncated = False
+        self._buffer = bytearray()
+        self._start = pos
+        self._eof = False
+        stream.seek(pos)
+
+    def _fill(self, size):
+        # Make sure ``size`` bytes from ``self.pos`` are buffered.
+        offset = self.pos - self._start
+        if offset:
+            del self._buffer[:offset]
+            self._start = self.pos
+        while len(self._buffer) < size and not self._eof:
+            block = self.stream.read(max(self.read_size,
+                                         size - len(self._buffer)))
+            if not block:
+                self._eof = True
+            self._buffer += block
+        return len(self._buffer) >= size
+
+    def __iter__(self):
+        """
+        Iterate over the records.
+
+        Yields
+        ------
+        pos : int
+            The position of the record.
+        header : Dict[str, bytes]
+            The fields of the record header.
+        data : bytes
+            The data section.
+
+        Raises
+        ------
+        BagFormatError
+            If a complete record is malformed.
+
+        """
+        while True:
+            if not self._fill(4):
+                self.truncated = bool(self._buffer)
+                return
+            header_len, = UINT32.unpack_from(self._buffer, 0)
+            if not self._fill(header_len + 8):
+                self.truncated = True
+                return
+            data_len, = UINT32.unpack_from(self._buffer, 4 + header_len)
+            size = header_len + 8 + data_len
+            if not self._fill(size):
+                self.truncated = True
+                return
+            header = decode_header(bytes(self._buffer[4:4 + header_len]))
+            if "op" not in header:
+                raise BagFormatError(
+                    "Record without an op code at {}.".format(self.pos))
+            data = bytes(self._buffer[header_len + 8:size])
+            pos = self.pos
+            self.pos += size
+            yield pos, header, data
+
+
+def check_bag(filename, thorough=False):
+    """
+    Check the consistency of a bag file.
+
+    The bag header and the index are checked against each other, and every
+    chunk in the index is located, with its index data. Only the index is
+    read, unless a thorough check is requested.
+
+    Parameters
+    ----------
+    filename : str
+        The bag file.
+    thorough : Optional[Bool]
+        Also decompress every chunk, and check that its messages are where
+        the index says.
+
+    Returns
+    -------
+    CheckResult
+        The problems found.
+
+    """
+    try:
+        index = BagIndex(filename)
+    except (BagFormatError, UnindexedBagError, IOError, OSError) as e:
+        return CheckResult(filename, [str(e)], 0, 0)
+
+    problems = []
+    with open(filename, "rb") as bag_file:
+        head = bag_file.read(len(MAGIC) + BAG_HEADER_LEN)
+    header = read_record(head, len(MAGIC))[0]
+    for name, actual in (("conn_count", len(index.connections)),
+                         ("chunk_count", len(index.chunk_infos))):
+        expected = UINT32.unpack(header[name])[0] if name in header else None
+        if expected != actual:
+            problems.append("The bag header has {} {}, but the index has {}."
+                            .format(name, expected, actual))
+
+    with BagReader(index) as reader:
+        for chunk in index.chunk_infos:
+            problems.extend(_check_chunk(reader, chunk, thorough))
+    return CheckResult(filename, problems, len(index.chunk_infos),
+                       sum(index.message_counts().values()))
+
+
+def _check_chunk(reader, chunk, thorough):
+    where = "Chunk at {}".format(chunk.pos)
+    if chunk.start_time > chunk.end_time:
+        return ["{} ends before it starts.".format(where)]
+    try:
+        size = reader.index.read_chunk_header(chunk)[1]
+        entries = reader.chunk_entries(chunk)
+    except BagFormatError as e:
+        return ["{}: {}".format(where, e)]
+    indexed = {}
+    for _, _, conn in entries:
+        indexed[conn] = indexed.get(conn, 0) + 1
+
+    problems = []
+    if indexed != chunk.connection_counts:
+        problems.append("{} has index data for {}, but its chunk info says {}."
+                        .format(where, indexed, chunk.connection_counts))
+    unknown = set(indexed) - set(reader.index.connections)
+    if unknown:
+        problems.append("{} uses unknown connections {}.".format(
+            where, sorted(unknown)))
+    if any(not chunk.start_time <= timestamp <= chunk.end_time
+           for timestamp, _, _ in entries):
+        problems.append("{} has messages outside its time range.".format(
+            where))
+    if any(offset >= size for _, offset, _ in entries):
+        problems.append("{} has messages past its end.".format(where))
+    if problems or not thorough:
+        return problems
+
+    try:
+        data = reader.chunk_data(chunk)
+    except Exception as e:
+        return ["{} cannot be decompressed: {}".format(where, e)]
+    if len(data) != size:
+        return ["{} is {} bytes long instead of {}.".format(where, len(data),
+                                                            size)]
+    for timestamp, offset, conn in entries:
+        try:
+            header = read_record(data, offset)[0]
+        except BagFormatError as e:
+            return ["{}: {}".format(where, e)]
+        if (record_op(header) != OP_MESSAGE_DATA or
+                UINT32.unpack(header["conn"])[0] != conn or
+                unpack_time(header["time"]) != timestamp):
+            return ["{} has no message at offset {} matching its index."
+                    .format(where, offset)]
+    return []
+
+
+def reindex_bag(filename, out, progress=None, progress_interval=1.0,
+                checkpoint=None, checkpoint_interval=10.0,
+                read_size=READ_SIZE):
+    """
+    Rewrite a bag file with a new index, recovering every complete record.
+
+    The file is read once, sequentially, in large blocks. Chunks are copied
+    as they are, and only decompressed to locate their messages. Messages
+    written outside of any chunk, as when recording stopped in the middle
+    of a chunk, are recovered into new chunks. The original index, if any,
+    is ignored, and a record cut short at the end of the file is dropped.
+
+    Parameters
+    ----------
+    filename : str
+        The bag file to read.
+    out : str
+        The bag file to write.
+    progress : Optional[Callable[[RepairProgress], None]]
+        Called periodically, and at the end, with the progress of the scan.
+    progress_interval : Optional[float]
+        The period of the progress callback, in seconds. Default is 1.
+    checkpoint : Optional[str]
+        A file in which the state of the scan is saved periodically. If it
+        exists, and matches the input and output files, the scan resumes
+        from it. It is removed once the output is complete.
+    checkpoint_interval : Optional[float]
+        The period of the checkpoints, in seconds. Default is 10.
+    read_size : Optional[int]
+        The size of the blocks read. Default is 16 MiB.
+
+    Returns
+    -------
+    RepairProgress
+        The final progress, with the number of chunks and messages
+        recovered.
+
+    Raises
+    ------
+    BagFormatError
+        If the file is not a bag file, or a complete record is malformed.
+
+    """
+    stat = os.stat(filename)
+    identity = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    resumed = _load_checkpoint(checkpoint, identity, out)
+    with open(filename, "rb") as bag_file:
+        if bag_file.read(len(MAGIC)) != MAGIC:
+            raise BagFormatError(
+                "{} is not a version 2.0 bag file.".format(filename))
+        if resumed is None:
+            pos, chunks, messages, state = len(MAGIC), 0, 0, None
+        else:
+            pos, chunks, messages, state = resumed
+            logger.info("Resuming %s at %d bytes.", filename, pos)
+        scanner = RecordScanner(bag_file, pos, read_size)
+        start = last_progress = last_checkpoint = monotonic()
+
+        def report():
+            return RepairProgress(filename, scanner.pos, stat.st_size,
+                                  chunks, messages, monotonic() - start)
+
+        with BagWriter(out, state=state) as writer:
+            for pos, header, data in scanner:
+                op = record_op(header)
+                if op == OP_CHUNK:
+                    compression = header["compression"].decode("ascii")
+                    try:
+                        chunk = memoryview(decompress(data, compression))
+                    except Exception as e:
+                        logger.warning("Skipping chunk at %d in %s: %s", pos,
+                                       filename, e)
+                        continue
+                    entries = _scan_chunk(chunk, writer)
+                    writer.write_chunk(chunk, entries, compression, data)
+                    chunks += 1
+                    messages += len(entries)
+                elif op == OP_CONNECTION:
+                    _add_connection(writer, parse_connection(header, data))
+                elif op == OP_MESSAGE_DATA:
+                    conn = UINT32.unpack(header["conn"])[0]
+                    connection = writer.connections.get(conn)
+                    if connection is not None:
+                        writer.write(connection.topic, data,
+                                     unpack_time(header["time"]), connection)
+                        messages += 1
+                elif op == OP_BAG_HEADER and pos != len(MAGIC):
+                    raise BagFormatError(
+                        "Unexpected bag header at {}.".format(pos))
+
+                now = monotonic()
+                if checkpoint is not None and (
+                        now - last_checkpoint >= checkpoint_interval):
+                    last_checkpoint = now
+                    _save_checkpoint(checkpoint, identity, (
+                        scanner.pos, chunks, messages, writer.checkpoint()))
+                if progress is not None and (
+                        now - last_progress >= progress_interval):
+                    last_progress = now
+                    progress(report())
+            if scanner.truncated:
+                logger.warning("%s is truncated at %d bytes.", filename,
+                               scanner.pos)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        sync_file(out)
+        os.remove(checkpoint)
+    final = report()
+    if progress is not None:
+        progress(final)
+    return final
+
+
+def _scan_chunk(chunk, writer):
+    entries = []
+    for pos, header, data_pos, data_len in iter_records(chunk):
+        op = record_op(header)
+        if op == OP_MESSAGE_DATA:
+            entries.append((unpack_time(header["time"]), pos,
+                            UINT32.unpack(header["conn"])[0]))
+        elif op == OP_CONNECTION:
+            _add_connection(writer, parse_connection(
+                header, chunk[data_pos:data_pos + data_len]))
+    return entries
+
+
+def _add_connection(writer, connection):
+    if connection.id not in writer.connections:
+        writer.add_connection(connection.topic, connection.datatype,
+                              connection.md5sum, connection.msg_def,
+                              connection.header, connection.id)
+
+
+def _save_checkpoint(path, identity, state):
+    temp = path + ".tmp"
+    with open(temp, "wb") as checkpoint_file:
+        pickle.dump((identity, state), checkpoint_file,
+                    pickle.HIGHEST_PROTOCOL)
+    replace_file(temp, path)
+
+
+def _load_checkpoint(path, identity, out):
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as checkpoint_file:
+            saved, state = pickle.load(checkpoint_file)
+    except Exception as e:
+        logger.warning("Ignoring checkpoint %s: %s", path, e)
+        return None
+    if saved != identity or not os.path.exists(out) or (
+            os.path.getsize(out) < state[3].position):
+        logger.warning("Ignoring checkpoint %s for another file.", path)
+        return None
+    return state
+
+
+def fix_bag(filename, progress=None, backup=True, **kwargs):
+    """
+    Recover a bag file in place.
+
+    The recovered file is written next to the original, with a checkpoint
+    so that an interrupted recovery resumes where it stopped, and then
+    replaces the original. Both are flushed to disk before being renamed,
+    so that a power loss cannot leave a truncated file behind.
+
+    Parameters
+    ----------
+    filename : str
+        The bag file.
+    progress : Optional[Callable[[RepairProgress], None]]
+        Called periodically with the progress of the scan.
+    backup : Optional[Bool]
+        Keep the original as ``<name>.orig.bag``, like ``rosbag reindex``.
+    kwargs
+        Further options of ``reindex_bag``.
+
+    Returns
+    -------
+    RepairProgress
+        The final progress.
+
+    Raises
+    ------
+    BagError
+        If the backup already exists.
+
+    """
+    stem = filename[:-len(".bag")] if filename.endswith(".bag") else filename
+    partial = stem + PARTIAL_SUFFIX
+    backup_name = stem + BACKUP_SUFFIX
+    if backup and os.path.exists(backup_name):
+        raise BagError("{} already exists.".format(backup_name))
+    result = reindex_bag(filename, partial, progress,
+                         checkpoint=partial + ".resume", **kwargs)
+    if backup:
+        replace_file(filename, backup_name)
+    replace_file(partial, filename)
+    return result
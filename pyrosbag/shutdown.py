@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Start and stop ``rosbag`` processes without fixed sleeps.
+
+A process is first interrupted, as with Ctrl-C, so that ``rosbag`` can flush
+and close its files. If it has not exited after a bounded wait, it is
+terminated, and then killed. Every wait returns as soon as the process
+exits: on Linux, a pidfd is watched with ``select``, and elsewhere the
+process is polled at a short, growing interval.
+
+Processes stay in the caller's process group by default, so that whatever
+stops the caller's group, such as a CI runner cancelling a job, stops the
+players too. ``rosbag`` is a wrapper which runs the player or recorder as its
+child and ignores SIGINT, so every signal is sent to the whole process tree,
+found from ``/proc``, and a process only counts as stopped once its
+descendants have exited as well. A policy may instead start each process in
+a new session, in which case signals are sent to its whole process group,
+and anything left in the group once the process has exited is killed.
+Either way, the processes which are still running when the interpreter exits
+are stopped, so that no player outlives its owner.
+
+"""
+import asyncio
+import atexit
+from collections import namedtuple
+import glob
+import logging
+import os
+import select
+import signal
+import time
+import weakref
+
+
+logger = logging.getLogger("bag_player.shutdown")
+
+SIGKILL = getattr(signal, "SIGKILL", signal.SIGTERM)
+
+_live = weakref.WeakKeyDictionary()
+
+
+class ShutdownPolicy(namedtuple("ShutdownPolicy", "interrupt_timeout "
+                                                  "terminate_timeout "
+                                                  "process_group")):
+    """
+    How to stop a process.
+
+    Attributes
+    ----------
+    interrupt_timeout : float
+        How long to wait after interrupting the process before terminating
+        it, in seconds. Default is 2.
+    terminate_timeout : float
+        How long to wait after terminating the process before killing it, in
+        seconds. Default is 2.
+    process_group : bool
+        Start the process in a new session, and signal its whole process
+        group instead of its process tree. The process then outlives its
+        caller's process group if that is killed. Default is False.
+
+    """
+    __slots__ = ()
+
+    def __new__(cls, interrupt_timeout=2.0, terminate_timeout=2.0,
+                process_group=False):
+        return super(ShutdownPolicy, cls).__new__(
+            cls, interrupt_timeout, terminate_timeout, process_group)
+
+
+class ShutdownResult(namedtuple("ShutdownResult", "returncode signal "
+                                                  "elapsed")):
+    """
+    How a process was stopped.
+
+    Attributes
+    ----------
+    returncode : int | None
+        The exit status of the process. A negative number is the signal
+        which killed it.
+    signal : int | None
+        The last signal sent, or None if the process had already exited.
+    elapsed : float
+        The number of seconds it took to stop the process.
+
+    """
+    __slots__ = ()
+
+    @property
+    def escalated(self):
+        """
+        The process had to be terminated or killed.
+
+        """
+        return self.signal not in (None, signal.SIGINT)
+
+
+def popen_options(policy=None):
+    """
+    The arguments of ``subprocess.Popen`` which a shutdown policy needs.
+
+    Parameters
+    ----------
+    policy : Optional[ShutdownPolicy]
+        How the process will be stopped. Default is ``ShutdownPolicy()``.
+
+    Returns
+    -------
+    dict
+        The keyword arguments.
+
+    """
+    policy = ShutdownPolicy() if policy is None else policy
+    if not policy.process_group or os.name != "posix":
+        return {}
+    return {"start_new_session": True}
+
+
+def register(process, policy=None):
+    """
+    Stop a process when the interpreter exits.
+
+    Parameters
+    ----------
+    process : subprocess.Popen | asyncio.subprocess.Process
+        The process, started with ``popen_options(policy)``.
+    policy : Optional[ShutdownPolicy]
+        How to stop it. Default is ``ShutdownPolicy()``.
+
+    Returns
+    -------
+    subprocess.Popen | asyncio.subprocess.Process
+        The process.
+
+    """
+    _live[process] = ShutdownPolicy() if policy is None else policy
+    return process
+
+
+def shutdown(process, policy=None):
+    """
+    Stop a process, escalating from SIGINT to SIGTERM and SIGKILL.
+
+    A ``PlaybackEngine`` is stopped directly, since it has no process.
+
+    Parameters
+    ----------
+    process : subprocess.Popen | PlaybackEngine
+        The process.
+    policy : Optional[ShutdownPolicy]
+        The timeouts. Default is ``ShutdownPolicy()``.
+
+    Returns
+    -------
+    ShutdownResult
+        The exit status, the last signal sent and the time taken.
+
+    """
+    policy = ShutdownPolicy() if policy is None else policy
+    start = time.monotonic()
+    if not hasattr(process, "pid"):
+        process.terminate()
+        return ShutdownResult(process.wait(), None, time.monotonic() - start)
+
+    sent = _escalate(process, policy)
+    returncode = process.wait()
+    _live.pop(process, None)
+    return ShutdownResult(returncode, sent, time.monotonic() - start)
+
+
+async def async_shutdown(process, policy=None):
+    """
+    Stop an asyncio subprocess, escalating from SIGINT to SIGTERM and SIGKILL.
+
+    Parameters
+    ----------
+    process : asyncio.subprocess.Process
+        The process.
+    policy : Optional[ShutdownPolicy]
+        The timeouts. Default is ``ShutdownPolicy()``.
+
+    Returns
+    -------
+    ShutdownResult
+        The exit status, the last signal sent and the time taken.
+
+    """
+    policy = ShutdownPolicy() if policy is None else policy
+    start = time.monotonic()
+    group = policy.process_group and _leads_group(process)
+    tree = {}
+    sent = None
+    for signum, timeout in _stages(policy):
+        if not group:
+            tree = _tree(process, tree)
+        if process.returncode is not None and not tree:
+            break
+        _warn_escalation(process, sent, signum)
+        _signal(process, signum, group, tree)
+        sent = signum
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            continue
+        delay = 0.0005
+        while _living(tree) and (deadline is None or
+                                 time.monotonic() < deadline):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.01)
+        if not _living(tree):
+            break
+    if group:
+        _signal(process, SIGKILL, group)
+    _kill(_living(tree), SIGKILL)
+    returncode = await process.wait()
+    _live.pop(process, None)
+    return ShutdownResult(returncode, sent, time.monotonic() - start)
+
+
+def wait_exit(process, timeout=None):
+    """
+    Wait for a process to exit, without reaping it.
+
+    Parameters
+    ----------
+    process : subprocess.Popen
+        The process.
+    timeout : Optional[float]
+        The maximum time to wait, in seconds.
+
+    Returns
+    -------
+    bool
+        The process has exited.
+
+    """
+    if process.returncode is not None:
+        return True
+    fd = _pidfd(process)
+    if fd is not None:
+        try:
+            readable, _, _ = select.select([fd], [], [], timeout)
+        finally:
+            os.close(fd)
+        return bool(readable)
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.0005
+    while not _exited(process):
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            return False
+        time.sleep(delay if remaining is None else min(delay, remaining))
+        delay = min(delay * 2, 0.01)
+    return True
+
+
+def _pidfd(process):
+    pidfd_open = getattr(os, "pidfd_open", None)
+    if pidfd_open is None:
+        return None
+    try:
+        return pidfd_open(process.pid)
+    except OSError:
+        return None
+
+
+def _exited(process):
+    if process.returncode is not None:
+        return True
+    waitid = getattr(os, "waitid", None)
+    if waitid is not None:
+        try:
+            return waitid(os.P_PID, process.pid,
+                          os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None
+        except OSError:
+            pass
+    # An asyncio process is reaped by its event loop, not polled.
+    poll = getattr(process, "poll", None)
+    return poll is None or poll() is not None
+
+
+def _stages(policy):
+    return ((signal.SIGINT, policy.interrupt_timeout),
+            (signal.SIGTERM, policy.terminate_timeout),
+            (SIGKILL, None))
+
+
+def _escalate(process, policy):
+    group = policy.process_group and _leads_group(process)
+    tree = {}
+    sent = None
+    for signum, timeout in _stages(policy):
+        if not group:
+            tree = _tree(process, tree)
+        if wait_exit(process, 0) and not tree:
+            break
+        _warn_escalation(process, sent, signum)
+        _signal(process, signum, group, tree)
+        sent = signum
+        if _wait_tree(process, tree, timeout):
+            break
+    if group:
+        _signal(process, SIGKILL, group)
+    _kill(_living(tree), SIGKILL)
+    return sent
+
+
+def _wait_tree(process, tree, timeout):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    if not wait_exit(process, timeout):
+        return False
+    delay = 0.0005
+    while _living(tree):
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            return False
+        time.sleep(delay if remaining is None else min(delay, remaining))
+        delay = min(delay * 2, 0.01)
+    return True
+
+
+def _tree(process, known):
+    """
+    Find the living descendants of a process, by pid and start time.
+
+    Descendants found earlier are kept while they live, since they are
+    reparented once the process exits. ``/proc/<pid>/task/*/children`` is
+    not always available, so the parent of every process is read instead.
+
+    """
+    known = _living(known)
+    children = {}
+    for path in glob.glob("/proc/[0-9]*/stat"):
+        fields = _stat(path)
+        if fields is not None:
+            pid = int(path.split("/")[2])
+            children.setdefault(int(fields[1]), []).append((pid, fields[19]))
+    tree = dict(known)
+    parents = [process.pid] + list(known)
+    while parents:
+        for pid, started in children.get(parents.pop(), ()):
+            if pid not in tree:
+                tree[pid] = started
+                parents.append(pid)
+    return tree
+
+
+def _living(tree):
+    return {pid: started for pid, started in tree.items()
+            if _start_time(pid) == started}
+
+
+def _start_time(pid):
+    fields = _stat("/proc/{}/stat".format(pid))
+    return None if fields is None else fields[19]
+
+
+def _stat(path):
+    # The fields after the command name, which may contain spaces. Processes
+    # which have exited are left out.
+    try:
+        with open(path) as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+    except (IOError, IndexError):
+        return None
+    if len(fields) < 20 or fields[0] in ("Z", "X"):
+        return None
+    return fields
+
+
+def _warn_escalation(process, sent, signum):
+    if sent is not None:
+        logger.warning("Process %s did not stop after signal %s. "
+                       "Sending signal %s.", process.pid, sent, signum)
+
+
+def _leads_group(process):
+    try:
+        return os.getpgid(process.pid) == process.pid
+    except (AttributeError, OSError):
+        return False
+
+
+def _signal(process, signum, group, tree=()):
+    try:
+        if group:
+            os.killpg(process.pid, signum)
+        elif process.returncode is None:
+            process.send_signal(signum)
+    except ProcessLookupError:
+        pass
+    _kill(tree, signum)
+
+
+def _kill(pids, signum):
+    for pid in pids:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+@atexit.register
+def _stop_live():
+    for process, policy in list(_live.items()):
+        if process.returncode is None:
+            logger.info("Stopping process %s at exit.", process.pid)
+            if asyncio.iscoroutinefunction(process.wait):
+                # The event loop may be closed, so the process is only
+                # signalled, and left for it to reap.
+                _escalate(process, policy)
+            else:
+                shutdown(process, policy)
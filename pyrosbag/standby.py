@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Keep ``rosbag play`` processes warm, so that playback starts immediately.
+
+Starting ``rosbag play`` takes a while: the interpreter starts, the node
+registers, the bag files are opened and the topics are advertised. A
+``StandbyPool`` starts players ahead of time with ``--pause``, and considers
+them ready once they report being paused. Taking a ready player and sending
+it a single key is then all it takes to start playing. Every player taken
+from the pool is replaced straight away. A player which dies on standby is
+replaced too, after a delay which doubles with every death in a row, until
+too many have died in a row.
+
+"""
+from collections import namedtuple
+import logging
+import subprocess as sp
+import threading
+from time import monotonic
+
+from .progress import ProgressReader
+from .shutdown import popen_options, register, shutdown
+
+
+logger = logging.getLogger("bag_player.standby")
+
+#: The key which toggles pause in ``rosbag play``.
+PAUSE_KEY = b" "
+
+#: How long to wait before replacing a player which died, in seconds. The
+#: delay doubles with every further death in a row.
+RESPAWN_DELAY = 0.1
+
+
+class StandbyStats(namedtuple("StandbyStats", ["spawned", "ready", "hits",
+                                               "misses", "died"])):
+    """
+    The activity of a standby pool.
+
+    Attributes
+    ----------
+    spawned : int
+        The number of players started.
+    ready : int
+        The number of players currently paused and ready.
+    hits : int
+        The number of players handed out.
+    misses : int
+        The number of times no player was ready in time.
+    died : int
+        The number of players which exited while on standby.
+
+    """
+    __slots__ = ()
+
+
+class StandbyPlayer(object):
+    """
+    A paused ``rosbag play`` process, kept ready.
+
+    Parameters
+    ----------
+    arguments : List[str]
+        The command line, including ``--pause``.
+    on_ready : Optional[Callable[[StandbyPlayer], None]]
+        Called once the player is ready.
+    shutdown_policy : Optional[ShutdownPolicy]
+        How to stop the process.
+
+    Attributes
+    ----------
+    process : subprocess.Popen
+        The process. Its stdout is drained by ``progress``.
+    progress : ProgressReader
+        Follows the status output of the process.
+    spawned : float
+        The monotonic time at which the process was started.
+    ready_at : float | None
+        The monotonic time at which it first reported being paused.
+
+    """
+    def __init__(self, arguments, on_ready=None, shutdown_policy=None):
+        self._on_ready = on_ready
+        self.shutdown_policy = shutdown_policy
+        self._ready = threading.Event()
+        self.ready_at = None
+        self.spawned = monotonic()
+        self.process = register(
+            sp.Popen(arguments, stdin=sp.PIPE, stdout=sp.PIPE,
+                     **popen_options(shutdown_policy)),
+            shutdown_policy)
+        self.progress = ProgressReader(self.process.stdout, self._status)
+
+    def _status(self, progress):
+        if progress.is_paused and not self._ready.is_set():
+            self.ready_at = monotonic()
+            self._ready.set()
+            if self._on_ready is not None:
+                self._on_ready(self)
+
+    @property
+    def is_ready(self):
+        """
+        Check whether the player is paused, and still running.
+
+        Returns
+        -------
+        bool
+            The player can be resumed.
+
+        """
+        return self._ready.is_set() and self.process.poll() is None
+
+    def resume(self):
+        """
+        Start playing.
+
+        """
+        self.process.stdin.write(PAUSE_KEY)
+        self.process.stdin.flush()
+
+    def close(self):
+        """
+        Stop the process, and wait for it to exit.
+
+        Returns
+        -------
+        ShutdownResult
+            The exit status, the last signal sent and the time taken.
+
+        """
+        result = shutdown(self.process, self.shutdown_policy)
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except (IOError, OSError):
+                pass
+        return result
+
+
+class StandbyPool(object):
+    """
+    A pool of paused ``rosbag play`` processes, all with the same options.
+
+    Parameters
+    ----------
+    arguments : List[str]
+        The command line of the players, including ``--pause``.
+    size : Optional[int]
+        The number of players kept ready. Default is 1.
+    ready_timeout : Optional[float]
+        How long ``acquire`` waits for a player which is still starting.
+        Default is 30 seconds.
+    shutdown_policy : Optional[ShutdownPolicy]
+        How to stop the players.
+    max_respawns : Optional[int]
+        The number of players in a row which may die and be replaced. The
+        count starts over whenever a player is handed out. Default is 3.
+
+    Attributes
+    ----------
+    arguments : List[str]
+        The command line of the players.
+    size : int
+        The number of players kept ready.
+    max_respawns : int
+        The number of players in a row which may die and be replaced.
+
+    """
+    def __init__(self, arguments, size=1, ready_timeout=30.0,
+                 shutdown_policy=None, max_respawns=3):
+        self.arguments = list(arguments)
+        self.size = size
+        self.ready_timeout = ready_timeout
+        self.shutdown_policy = shutdown_policy
+        self.max_respawns = max_respawns
+        self._players = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._spawned = self._hits = self._misses = self._died = 0
+        self._deaths_in_a_row = 0
+        self._timers = []
+        for _ in range(size):
+            self._spawn()
+
+    def _spawn(self, timer=None):
+        if self._closed:
+            return
+        player = StandbyPlayer(self.arguments, self._notify,
+                               self.shutdown_policy)
+        with self._condition:
+            # The timer is only dropped once its player is in the pool, so
+            # that acquire always sees one of them.
+            if timer in self._timers:
+                self._timers.remove(timer)
+            if self._closed:
+                closed = True
+            else:
+                closed = False
+                self._players.append(player)
+                self._spawned += 1
+        if closed:
+            player.close()
+        logger.debug("Started a standby player: %s", self.arguments)
+
+    def _notify(self, player):
+        logger.debug("Standby player ready after %.3f s.",
+                     player.ready_at - player.spawned)
+        with self._condition:
+            self._condition.notify_all()
+
+    def _respawn(self):
+        # Called with the condition held.
+        if self._deaths_in_a_row >= self.max_respawns:
+            logger.warning("%d standby players died in a row. They are no "
+                           "longer replaced.", self._deaths_in_a_row + 1)
+            return
+        delay = RESPAWN_DELAY * 2 ** self._deaths_in_a_row
+        self._deaths_in_a_row += 1
+        timer = threading.Timer(delay, lambda: self._spawn(timer))
+        timer.daemon = True
+        self._timers.append(timer)
+        timer.start()
+
+    def acquire(self, timeout=None):
+        """
+        Take a paused player, and start another one in its place.
+
+        Players which died while on standby are discarded, and replaced
+        after a delay. If every player is still starting, the first one to
+        become ready is taken.
+
+        Parameters
+        ----------
+        timeout : Optional[float]
+            How long to wait for a player to become ready. Default is the
+            ``ready_timeout`` of the pool.
+
+        Returns
+        -------
+        StandbyPlayer | None
+            The player, or None if none became ready in time.
+
+        """
+        timeout = self.ready_timeout if timeout is None else timeout
+        deadline = monotonic() + timeout
+        taken = None
+        with self._condition:
+            while not self._closed:
+                for player in list(self._players):
+                    if player.process.poll() is not None:
+                        logger.warning("A standby player exited with %s.",
+                                       player.process.returncode)
+                        self._players.remove(player)
+                        self._died += 1
+                        self._respawn()
+                    elif taken is None and player.is_ready:
+                        taken = player
+                if taken is not None or not (self._players or self._timers):
+                    break
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(min(remaining, 0.1))
+            if taken is None:
+                self._misses += 1
+                return None
+            self._players.remove(taken)
+            self._hits += 1
+            self._deaths_in_a_row = 0
+        self._spawn()
+        return taken
+
+    def stats(self):
+        """
+        Summarize the activity of the pool.
+
+        Returns
+        -------
+        StandbyStats
+            The counts.
+
+        """
+        with self._condition:
+            return StandbyStats(self._spawned,
+                                sum(player.is_ready
+                                    for player in self._players),
+                                self._hits, self._misses, self._died)
+
+    def close(self):
+        """
+        Stop every player on standby.
+
+        """
+        with self._condition:
+            self._closed = True
+            players, self._players = self._players, []
+            for timer in self._timers:
+                timer.cancel()
+            self._timers = []
+            self._condition.notify_all()
+        for player in players:
+            player.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return "<StandbyPool({}, size={})>".format(self.arguments, self.size)
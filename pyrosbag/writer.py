@@ -0,0 +1,594 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Write ROS bag files directly, without going through ``rosbag``.
+
+The files written are version 2.0 bag files, laid out like those of
+``rosbag record``: messages are grouped into chunks, each followed by the
+index data records of its connections, and the index section (connection
+and chunk info records) is appended when the file is closed.
+
+"""
+import bz2
+from collections import namedtuple
+import os
+
+from .bagfile import (
+    BAG_HEADER_LEN, CHUNK_INFO_ENTRY, INDEX_ENTRY, MAGIC, NSEC_PER_SEC,
+    OP_BAG_HEADER, OP_CHUNK, OP_CHUNK_INFO, OP_CONNECTION, OP_INDEX_DATA,
+    OP_MESSAGE_DATA, TIME, UINT32, UINT64, ChunkInfo, Connection, lz4_frame)
+from .exceptions import BagError
+
+
+#: The compression formats which can be written.
+COMPRESSIONS = ("none", "bz2", "lz4")
+
+
+def _op(code):
+    return "op", bytes(bytearray([code]))
+
+
+def encode_header(fields):
+    """
+    Encode the fields of a record header.
+
+    Parameters
+    ----------
+    fields : List[Tuple[str, bytes]]
+        The name and value of every field, in order.
+
+    Returns
+    -------
+    bytes
+        The encoded header, without its length.
+
+    """
+    encoded = []
+    for name, value in fields:
+        field = name.encode("ascii") + b"=" + value
+        encoded.append(UINT32.pack(len(field)))
+        encoded.append(field)
+    return b"".join(encoded)
+
+
+def encode_record(fields, data):
+    """
+    Encode a record.
+
+    Parameters
+    ----------
+    fields : List[Tuple[str, bytes]]
+        The fields of the record header.
+    data : bytes
+        The data section.
+
+    Returns
+    -------
+    bytes
+        The encoded record.
+
+    """
+    header = encode_header(fields)
+    return b"".join((UINT32.pack(len(header)), header,
+                     UINT32.pack(len(data)), data))
+
+
+def pack_time(nsec):
+    """
+    Pack a time in integer nanoseconds into a ROS time.
+
+    Parameters
+    ----------
+    nsec : int
+        The time, in nanoseconds.
+
+    Returns
+    -------
+    bytes
+        The seconds and nanoseconds.
+
+    """
+    return TIME.pack(*divmod(nsec, NSEC_PER_SEC))
+
+
+def sync_file(filename):
+    """
+    Flush a file to disk.
+
+    Parameters
+    ----------
+    filename : str
+        The file.
+
+    """
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def replace_file(source, destination):
+    """
+    Rename a file over another, durably.
+
+    The file is flushed to disk before it is renamed, and its directory
+    after, so that a power loss leaves either the old or the complete new
+    file in place.
+
+    Parameters
+    ----------
+    source : str
+        The new file.
+    destination : str
+        The file to replace.
+
+    """
+    sync_file(source)
+    os.replace(source, destination)
+    _sync_directory(destination)
+
+
+def _sync_directory(filename):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    except OSError:
+        # Directories cannot be opened on Windows, where renames are
+        # journaled anyway.
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def compress(data, compression):
+    """
+    Compress chunk data.
+
+    Parameters
+    ----------
+    data : bytes
+        The uncompressed data.
+    compression : str
+        The compression format: ``none``, ``bz2`` or ``lz4``.
+
+    Returns
+    -------
+    bytes
+        The compressed data.
+
+    """
+    if compression == "bz2":
+        return bz2.compress(data)
+    if compression == "lz4":
+        return lz4_frame.compress(data)
+    return data
+
+
+WriterState = namedtuple("WriterState", ["position", "connections",
+                                         "chunk_infos", "written"])
+WriterState.__doc__ = """
+The state of a ``BagWriter``, from which writing can be resumed.
+
+Attributes
+----------
+position : int
+    The size of the file at the checkpoint.
+connections : Dict[int, Connection]
+    Every connection declared, by ID.
+chunk_infos : List[ChunkInfo]
+    Every chunk written.
+written : Set[int]
+    The connections whose record has been written in a chunk.
+
+"""
+
+
+class BagWriter(object):
+    """
+    Write a bag file.
+
+    Messages are appended to the current chunk in memory. Once its
+    uncompressed size reaches the chunk threshold, the chunk is compressed
+    and written, together with its index data, in a single write. The index
+    section is written when the writer is closed, so the file is only a
+    valid, indexed bag file after ``close()``.
+
+    Parameters
+    ----------
+    filename : str
+        The location of the bag file to write.
+    compression : Optional[str]
+        The chunk compression: ``none``, ``bz2`` or ``lz4``. Default is none.
+    chunk_threshold : Optional[int]
+        The uncompressed size, in bytes, above which a chunk is written.
+        Default is 768 KiB, like ``rosbag record``.
+    buffer_size : Optional[int]
+        The size of the file buffer, in bytes. Default is 1 MiB.
+    state : Optional[WriterState]
+        Resume writing an unfinished file from this checkpoint, instead of
+        starting a new file.
+
+    Attributes
+    ----------
+    filename : str
+        The location of the bag file.
+    compression : str
+        The chunk compression.
+    chunk_threshold : int
+        The chunk threshold, in bytes.
+    connections : Dict[int, Connection]
+        Every connection written, by ID.
+    chunk_infos : List[ChunkInfo]
+        Every chunk written, in file order.
+
+    Raises
+    ------
+    BagError
+        If the compression format is unknown or unavailable.
+
+    """
+    def __init__(self, filename, compression="none",
+                 chunk_threshold=768 * 1024, buffer_size=1024 * 1024,
+                 state=None):
+        if compression not in COMPRESSIONS:
+            raise BagError("Unknown compression: {}".format(compression))
+        if compression == "lz4" and lz4_frame is None:
+            raise BagError("The lz4 package is needed to write lz4 chunks.")
+        self.filename = filename
+        self.compression = compression
+        self.chunk_threshold = chunk_threshold
+        self.connections = {}
+        self.chunk_infos = []
+        self._topics = {}
+        self._keys = {}
+        self._foreign = {}
+        self._message_heads = {}
+        self._written = set()
+        self._reset_chunk()
+        if state is None:
+            self._file = open(filename, "wb", buffer_size)
+            self._file.write(MAGIC)
+            self._write_bag_header(0)
+            return
+
+        self._file = open(filename, "r+b", buffer_size)
+        self._file.truncate(state.position)
+        self._file.seek(state.position)
+        for conn, connection in sorted(state.connections.items()):
+            self.add_connection(connection.topic, connection.datatype,
+                                connection.md5sum, connection.msg_def,
+                                connection.header, conn)
+        self.chunk_infos = list(state.chunk_infos)
+        self._written = set(state.written)
+
+    def checkpoint(self):
+        """
+        Write the pending messages, and save the state of the writer.
+
+        If writing is interrupted, a new writer can resume from the state,
+        and the file is then as if it had never been interrupted. The file
+        is flushed to disk first, so that the state remains valid after a
+        power loss.
+
+        Returns
+        -------
+        WriterState
+            The state of the writer.
+
+        """
+        self._write_chunk()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return WriterState(self._file.tell(), dict(self.connections),
+                           list(self.chunk_infos), set(self._written))
+
+    def add_connection(self, topic, datatype, md5sum, msg_def, header=None,
+                       conn=None):
+        """
+        Declare a connection, i.e. a topic and the type of its messages.
+
+        The messages written on the topic afterwards use this connection,
+        unless another one is given.
+
+        Parameters
+        ----------
+        topic : str
+            The topic.
+        datatype : str
+            The message type, e.g. ``std_msgs/String``.
+        md5sum : str
+            The MD5 sum of the message definition.
+        msg_def : str
+            The full text of the message definition.
+        header : Optional[Dict[str, bytes]]
+            Further fields of the connection header, e.g. ``callerid`` or
+            ``latching``.
+        conn : Optional[int]
+            The ID to give the connection, if it is not taken yet.
+
+        Returns
+        -------
+        Connection
+            The new connection, or an identical existing one.
+
+        """
+        fields = dict((name, bytes(value))
+                      for name, value in (header or {}).items())
+        fields.update(topic=topic.encode("utf-8"),
+                      type=datatype.encode("utf-8"),
+                      md5sum=md5sum.encode("utf-8"),
+                      message_definition=msg_def.encode("utf-8"))
+        key = (topic, tuple(sorted(fields.items())))
+        connection = self._keys.get(key)
+        if connection is None:
+            if conn is None or conn in self.connections:
+                conn = max(self.connections) + 1 if self.connections else 0
+            connection = Connection(conn, topic, datatype, md5sum, msg_def,
+                                    fields)
+            self.connections[connection.id] = connection
+            self._keys[key] = connection
+            self._message_heads[connection.id] = self._message_head(
+                connection.id)
+        self._topics[topic] = connection
+        return connection
+
+    def write(self, topic, data, timestamp, connection=None):
+        """
+        Write a message.
+
+        Parameters
+        ----------
+        topic : str
+            The topic of the message.
+        data : bytes | memoryview
+            The serialized message.
+        timestamp : int
+            The time of the message, in nanoseconds.
+        connection : Optional[Connection]
+            The connection of the message, e.g. from a ``BagReader``.
+            Default is the last connection declared on the topic.
+
+        Raises
+        ------
+        BagError
+            If no connection is known for the topic, or the writer is closed.
+
+        """
+        if self._file is None:
+            raise BagError("The bag file is closed.")
+        if connection is None:
+            connection = self._topics.get(topic)
+            if connection is None:
+                raise BagError("No connection declared on {}.".format(topic))
+        elif self.connections.get(connection.id) is not connection:
+            foreign = self._foreign.get(id(connection))
+            if foreign is None or foreign[0] is not connection:
+                foreign = self._foreign[id(connection)] = (
+                    connection, self.add_connection(
+                        topic, connection.datatype, connection.md5sum,
+                        connection.msg_def, connection.header))
+            connection = foreign[1]
+        conn = connection.id
+
+        chunk = self._chunk
+        if conn not in self._written:
+            self._written.add(conn)
+            chunk += self._connection_record(connection)
+        entries = self._chunk_entries.get(conn)
+        if entries is None:
+            entries = self._chunk_entries[conn] = []
+        secs, nsecs = divmod(timestamp, NSEC_PER_SEC)
+        entries.append(INDEX_ENTRY.pack(secs, nsecs, len(chunk)))
+        chunk += self._message_heads[conn]
+        chunk += TIME.pack(secs, nsecs)
+        chunk += UINT32.pack(len(data))
+        chunk += data
+        if self._chunk_start is None or timestamp < self._chunk_start:
+            self._chunk_start = timestamp
+        if self._chunk_end is None or timestamp > self._chunk_end:
+            self._chunk_end = timestamp
+        if len(chunk) >= self.chunk_threshold:
+            self._write_chunk()
+
+    def write_chunk(self, data, entries, compression=None, compressed=None):
+        """
+        Write a whole chunk of records at once.
+
+        Parameters
+        ----------
+        data : bytes | memoryview
+            The uncompressed chunk data, i.e. message records and the
+            connection records they use.
+        entries : List[Tuple[int, int, int]]
+            The time, in nanoseconds, offset in the data, and connection ID
+            of every message, e.g. from ``BagReader.chunk_entries``.
+        compression : Optional[str]
+            The compression of the chunk. Default is that of the writer.
+        compressed : Optional[bytes | memoryview]
+            The data, already compressed in that format.
+
+        Raises
+        ------
+        BagError
+            If the writer is closed, or a connection is unknown.
+
+        """
+        if self._file is None:
+            raise BagError("The bag file is closed.")
+        if not entries:
+            return
+        compression = compression or self.compression
+        if compression not in COMPRESSIONS:
+            raise BagError("Unknown compression: {}".format(compression))
+        index = {}
+        for timestamp, offset, conn in entries:
+            index.setdefault(conn, []).append(INDEX_ENTRY.pack(
+                timestamp // NSEC_PER_SEC, timestamp % NSEC_PER_SEC, offset))
+        for conn in index:
+            if conn not in self.connections:
+                raise BagError("Unknown connection {}.".format(conn))
+        if compressed is None:
+            compressed = compress(bytes(data), compression)
+        self._write_chunk()
+        timestamps = [entry[0] for entry in entries]
+        self._write_records(len(data), compressed, compression, index,
+                            min(timestamps), max(timestamps))
+
+    def copy_chunk(self, chunk_info, records):
+        """
+        Copy a chunk from another bag file as it is.
+
+        The chunk is neither decompressed nor parsed, so its connections
+        must have the same IDs in this bag file.
+
+        Parameters
+        ----------
+        chunk_info : ChunkInfo
+            The chunk info of the chunk in the other bag file.
+        records : bytes | memoryview
+            The chunk record and the index data records which follow it,
+            e.g. from ``BagReader.raw_chunk``.
+
+        Raises
+        ------
+        BagError
+            If the writer is closed, or a connection is unknown.
+
+        """
+        if self._file is None:
+            raise BagError("The bag file is closed.")
+        for conn in chunk_info.connection_counts:
+            if conn not in self.connections:
+                raise BagError("Unknown connection {}.".format(conn))
+        self._write_chunk()
+        self.chunk_infos.append(chunk_info._replace(pos=self._file.tell()))
+        self._file.write(records)
+
+    def write_message(self, message):
+        """
+        Write a message read from a bag file.
+
+        Parameters
+        ----------
+        message : Message
+            The message, with its connection.
+
+        """
+        self.write(message.topic, message.data, message.timestamp,
+                   message.connection)
+
+    def close(self):
+        """
+        Write the last chunk and the index section, and close the file.
+
+        """
+        if self._file is None:
+            return
+        try:
+            self._write_chunk()
+            index_pos = self._file.tell()
+            records = [self._connection_record(self.connections[conn])
+                       for conn in sorted(self.connections)]
+            records.extend(self._chunk_info_record(chunk_info)
+                           for chunk_info in self.chunk_infos)
+            self._file.write(b"".join(records))
+            self._file.seek(len(MAGIC))
+            self._write_bag_header(index_pos)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        """
+        Context manager entry point.
+
+        """
+        return self
+
+    # noinspection PyUnusedLocal
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Context manager exit point.
+
+        """
+        self.close()
+
+    def _reset_chunk(self):
+        self._chunk = bytearray()
+        self._chunk_entries = {}
+        self._chunk_start = None
+        self._chunk_end = None
+
+    def _write_chunk(self):
+        if not self._chunk_entries:
+            return
+        data = bytes(self._chunk)
+        self._write_records(len(data), compress(data, self.compression),
+                            self.compression, self._chunk_entries,
+                            self._chunk_start, self._chunk_end)
+        self._reset_chunk()
+
+    def _write_records(self, size, compressed, compression, index, start,
+                       end):
+        pos = self._file.tell()
+        header = encode_header([_op(OP_CHUNK),
+                                ("compression", compression.encode("ascii")),
+                                ("size", UINT32.pack(size))])
+        pieces = [UINT32.pack(len(header)), header,
+                  UINT32.pack(len(compressed)), compressed]
+        counts = {}
+        for conn in sorted(index):
+            entries = index[conn]
+            counts[conn] = len(entries)
+            pieces.append(encode_record(
+                [_op(OP_INDEX_DATA),
+                 ("ver", UINT32.pack(1)),
+                 ("conn", UINT32.pack(conn)),
+                 ("count", UINT32.pack(len(entries)))],
+                b"".join(entries)))
+        self._file.writelines(pieces)
+        self.chunk_infos.append(ChunkInfo(pos, start, end, counts))
+
+    def _write_bag_header(self, index_pos):
+        header = encode_header(
+            [_op(OP_BAG_HEADER),
+             ("index_pos", UINT64.pack(index_pos)),
+             ("conn_count", UINT32.pack(len(self.connections))),
+             ("chunk_count", UINT32.pack(len(self.chunk_infos)))])
+        padding = BAG_HEADER_LEN - 8 - len(header)
+        self._file.write(b"".join((UINT32.pack(len(header)), header,
+                                   UINT32.pack(padding), b" " * padding)))
+
+    @staticmethod
+    def _message_head(conn):
+        header = encode_header([_op(OP_MESSAGE_DATA),
+                                ("conn", UINT32.pack(conn)),
+                                ("time", b"\0" * TIME.size)])
+        head = UINT32.pack(len(header)) + header
+        return head[:-TIME.size]
+
+    @staticmethod
+    def _connection_record(connection):
+        return encode_record(
+            [_op(OP_CONNECTION),
+             ("conn", UINT32.pack(connection.id)),
+             ("topic", connection.topic.encode("utf-8"))],
+            encode_header(sorted(connection.header.items())))
+
+    @staticmethod
+    def _chunk_info_record(chunk_info):
+        counts = sorted(chunk_info.connection_counts.items())
+        return encode_record(
+            [_op(OP_CHUNK_INFO),
+             ("ver", UINT32.pack(1)),
+             ("chunk_pos", UINT64.pack(chunk_info.pos)),
+             ("start_time", pack_time(chunk_info.start_time)),
+             ("end_time", pack_time(chunk_info.end_time)),
+             ("count", UINT32.pack(len(counts)))],
+            b"".join(CHUNK_INFO_ENTRY.pack(conn, count)
+                     for conn, count in counts))
+
+    def __repr__(self):
+        return "<BagWriter({})>".format(self.filename)
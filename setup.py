@@ -32,6 +32,7 @@ setup(
                  'pyrosbag'},
     include_package_data=True,
     install_requires=requirements,
+    python_requires='>=3.5',
     license="MIT license",
     zip_safe=False,
     keywords=['pyrosbag', 'ros', 'bag'],
@@ -41,10 +42,8 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',
-        "Programming Language :: Python :: 2",
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3 :: Only',
         'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3.6',
     ],
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the tests.
+
+Bag files are written by hand, independently of the package.
+
+"""
+import bz2
+import struct
+import time
+
+
+STRING_TYPE = ("std_msgs/String", "992ce8a1687cec8c8bd883ec73ca41d1",
+               "string data\n")
+
+
+def _field(name, value):
+    field = name.encode("ascii") + b"=" + value
+    return struct.pack("<I", len(field)) + field
+
+
+def _header(fields):
+    return b"".join(_field(name, value) for name, value in fields)
+
+
+def _record(fields, data):
+    header = _header(fields)
+    return (struct.pack("<I", len(header)) + header +
+            struct.pack("<I", len(data)) + data)
+
+
+def _time(nsec):
+    return struct.pack("<II", nsec // 1000000000, nsec % 1000000000)
+
+
+def _compress(data, compression):
+    if compression == "bz2":
+        return bz2.compress(data)
+    if compression == "lz4":
+        import lz4.frame
+        return lz4.frame.compress(data)
+    return data
+
+
+def write_test_bag(path, messages, compression="none", chunk_size=1024,
+                   types=None, index=True):
+    """
+    Write a bag file by hand, independently of the package.
+
+    Parameters
+    ----------
+    path : str
+        The output file.
+    messages : List[Tuple[str, int, bytes]]
+        The topic, time in nanoseconds and data of every message, in order.
+    compression : str
+        The chunk compression.
+    chunk_size : int
+        The uncompressed size above which a chunk is closed.
+    types : Dict[str, Tuple[str, str, str]]
+        The datatype, md5sum and message definition per topic.
+    index : bool
+        Write the index section.
+
+    """
+    types = types or {}
+    conn_ids = {}
+    for topic, _, _ in messages:
+        conn_ids.setdefault(topic, len(conn_ids))
+
+    def connection(topic):
+        datatype, md5sum, msg_def = types.get(topic, STRING_TYPE)
+        fields = [("op", b"\x07"),
+                  ("conn", struct.pack("<I", conn_ids[topic])),
+                  ("topic", topic.encode("utf-8"))]
+        data = _header([("topic", topic.encode("utf-8")),
+                        ("type", datatype.encode("utf-8")),
+                        ("md5sum", md5sum.encode("utf-8")),
+                        ("message_definition", msg_def.encode("utf-8"))])
+        return _record(fields, data)
+
+    chunks = []
+    current = []
+    size = 0
+    for message in messages:
+        current.append(message)
+        size += len(message[2])
+        if size >= chunk_size:
+            chunks.append(current)
+            current = []
+            size = 0
+    if current:
+        chunks.append(current)
+
+    body = bytearray()
+    chunk_infos = []
+    offset = 13 + 4096
+    for chunk in chunks:
+        data = bytearray()
+        entries = {}
+        seen = set()
+        for topic, nsec, payload in chunk:
+            conn = conn_ids[topic]
+            if conn not in seen:
+                data += connection(topic)
+                seen.add(conn)
+            entries.setdefault(conn, []).append((nsec, len(data)))
+            data += _record([("op", b"\x02"),
+                             ("conn", struct.pack("<I", conn)),
+                             ("time", _time(nsec))], payload)
+        chunk_pos = offset + len(body)
+        body += _record([("op", b"\x05"),
+                         ("compression", compression.encode("ascii")),
+                         ("size", struct.pack("<I", len(data)))],
+                        _compress(bytes(data), compression))
+        for conn, conn_entries in sorted(entries.items()):
+            body += _record(
+                [("op", b"\x04"), ("ver", struct.pack("<I", 1)),
+                 ("conn", struct.pack("<I", conn)),
+                 ("count", struct.pack("<I", len(conn_entries)))],
+                b"".join(_time(nsec) + struct.pack("<I", pos)
+                         for nsec, pos in conn_entries))
+        times = [nsec for _, nsec, _ in chunk]
+        chunk_infos.append((chunk_pos, min(times), max(times),
+                            sorted((conn, len(e)) for conn, e in
+                                   entries.items())))
+
+    index_pos = offset + len(body)
+    if index:
+        for topic in sorted(conn_ids, key=conn_ids.get):
+            body += connection(topic)
+        for chunk_pos, start, end, counts in chunk_infos:
+            body += _record(
+                [("op", b"\x06"), ("ver", struct.pack("<I", 1)),
+                 ("chunk_pos", struct.pack("<Q", chunk_pos)),
+                 ("start_time", _time(start)), ("end_time", _time(end)),
+                 ("count", struct.pack("<I", len(counts)))],
+                b"".join(struct.pack("<II", conn, count)
+                         for conn, count in counts))
+
+    header = _header([("op", b"\x03"),
+                      ("index_pos", struct.pack("<Q", index_pos if index
+                                                else 0)),
+                      ("conn_count", struct.pack("<I", len(conn_ids))),
+                      ("chunk_count", struct.pack("<I", len(chunks)))])
+    padding = 4096 - 8 - len(header)
+    with open(path, "wb") as bag_file:
+        bag_file.write(b"#ROSBAG V2.0\n")
+        bag_file.write(struct.pack("<I", len(header)) + header +
+                       struct.pack("<I", padding) + b" " * padding)
+        bag_file.write(bytes(body))
+
+
+def sample_messages(count=100, topics=("/a", "/b"), start=10 ** 18,
+                    step=10 ** 7):
+    """
+    Generate messages alternating between topics.
+
+    """
+    messages = []
+    for i in range(count):
+        text = "message {}".format(i).encode("ascii")
+        messages.append((topics[i % len(topics)], start + i * step,
+                         struct.pack("<I", len(text)) + text))
+    return messages
+
+
+def wait_for(condition, timeout=5):
+    """
+    Poll a condition until it holds, failing after a timeout.
+
+    """
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "Timed out."
+        time.sleep(0.001)
+
+
+def invocations(log):
+    """
+    Read the arguments of every call to the fake ``rosbag`` from its log.
+
+    """
+    if not log.exists():
+        return []
+    return [line.split() for line in log.read().splitlines()]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures shared by the tests.
+
+"""
+import os
+import stat
+import sys
+
+import pytest
+
+from .bagtools import write_test_bag
+
+
+FAKE_ROSBAG = os.path.join(os.path.dirname(__file__), "fake_rosbag.py")
+
+
+@pytest.fixture
+def make_bag(tmpdir):
+    """
+    Write bag files into a temporary directory.
+
+    """
+    def make(messages, name="test.bag", **kwargs):
+        path = str(tmpdir.join(name))
+        write_test_bag(path, messages, **kwargs)
+        return path
+    return make
+
+
+@pytest.fixture
+def fake_rosbag(tmpdir, monkeypatch):
+    """
+    Put a stand-in ``rosbag`` executable first on the PATH.
+
+    Returns the file to which it logs its arguments.
+
+    """
+    bin_dir = tmpdir.mkdir("bin")
+    executable = bin_dir.join("rosbag")
+    executable.write('#!/bin/sh\nexec "{}" "{}" "$@"\n'.format(
+        sys.executable, FAKE_ROSBAG))
+    executable.chmod(executable.stat().mode | stat.S_IEXEC)
+    log = tmpdir.join("rosbag.log")
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep +
+                       os.environ.get("PATH", ""))
+    monkeypatch.setenv("FAKE_ROSBAG_LOG", str(log))
+    return log
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Stand-in for the ``rosbag`` executable, for tests without ROS.
+
+``rosbag play`` is imitated: the status line is written to stdout as the bag
+time advances, space toggles pause and ``s`` steps while paused. The bag
+lasts ``FAKE_ROSBAG_DURATION`` seconds (default 0.2), from the start time of
+the bag files if they exist, and the process exits
+with ``FAKE_ROSBAG_EXIT`` (default 0). If ``FAKE_ROSBAG_LOG`` is set, the
+arguments are appended to that file, one invocation per line.
+
+``rosbag play`` stops cleanly when interrupted. The signals named in
+``FAKE_ROSBAG_IGNORE`` (e.g. ``INT,TERM``) are ignored instead. If
+``FAKE_ROSBAG_CHILD`` is set, a child process which ignores SIGINT and
+SIGTERM is started, and its pid is written to that file.
+
+If ``FAKE_ROSBAG_WRAPPER`` is set, the real ``rosbag`` wrapper is imitated:
+SIGINT is ignored, and the command is run again as a child, whose pid is
+written to that file, and whose exit status is returned.
+
+``rosbag record`` writes ``FAKE_ROSBAG_BLOCK`` bytes (default 100) to the
+active file every step, and splits the output if asked, counting
+``FAKE_ROSBAG_MB`` bytes (default 1000) as a megabyte. It prints where it
+records to, and ``FAKE_ROSBAG_OVERFLOW`` buffer warnings (default 0), to
+stderr, and closes its file cleanly when interrupted.
+
+"""
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+
+STEP = 0.01
+BAG_START = 1000000000.0
+
+
+def parse(arguments):
+    options = {"rate": 1.0, "start": 0.0, "duration": None, "paused": False,
+               "immediate": False, "loop": False, "keep_alive": False,
+               "quiet": False}
+    for argument in arguments:
+        if argument == "--pause":
+            options["paused"] = True
+        elif argument == "-i":
+            options["immediate"] = True
+        elif argument == "-l":
+            options["loop"] = True
+        elif argument == "-k":
+            options["keep_alive"] = True
+        elif argument == "-q":
+            options["quiet"] = True
+        elif argument.startswith("--rate="):
+            options["rate"] = float(argument.split("=", 1)[1])
+        elif argument.startswith("--start="):
+            options["start"] = float(argument.split("=", 1)[1])
+        elif argument.startswith("--duration="):
+            options["duration"] = float(argument.split("=", 1)[1])
+    return options
+
+
+def bag_start(filenames):
+    filenames = [name for name in filenames if os.path.isfile(name)]
+    if not filenames:
+        return BAG_START
+    sys.path.insert(0, os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    from pyrosbag.bagfile import BagIndex
+    starts = [BagIndex(name).start_time for name in filenames]
+    starts = [start for start in starts if start is not None]
+    return min(starts) / 1e9 if starts else BAG_START
+
+
+class Player(object):
+    def __init__(self, options, length, start=BAG_START):
+        self.options = options
+        self.length = length
+        self.start = start
+        self.position = options["start"]
+        self.end = length
+        if options["duration"] is not None:
+            self.end = min(length, self.position + options["duration"])
+        self.paused = options["paused"]
+        self.lock = threading.Lock()
+        self.done = False
+        self.interrupted = False
+
+    def interrupt(self, signum, frame):
+        self.interrupted = True
+
+    def status(self):
+        state = "PAUSED " if self.paused else "RUNNING"
+        line = "\r [{}]  Bag Time: {:13.6f}   Duration: {:.6f} / {:.6f}     " \
+               "          \r".format(state, self.start + self.position,
+                                     self.position, self.length)
+        if not self.options["quiet"]:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+    def keys(self):
+        while True:
+            key = sys.stdin.read(1)
+            if not key:
+                return
+            with self.lock:
+                if key == " ":
+                    self.paused = not self.paused
+                elif key == "s" and self.paused:
+                    self.position = min(self.end, self.position + STEP)
+                self.status()
+
+    def run(self):
+        if not self.options["quiet"]:
+            sys.stdout.write("[ INFO] [0.000000]: Opening bag\n"
+                             "Waiting 0.2 seconds after advertising topics."
+                             "\nHit space to toggle paused, or 's' to step."
+                             "\n")
+            sys.stdout.flush()
+        while not self.interrupted:
+            with self.lock:
+                if not self.paused:
+                    if self.options["immediate"]:
+                        self.position = self.end
+                    else:
+                        self.position = min(self.end, self.position +
+                                            STEP * self.options["rate"])
+                self.status()
+                finished = self.position >= self.end
+            if finished:
+                if self.options["loop"]:
+                    with self.lock:
+                        self.position = self.options["start"]
+                elif not self.options["keep_alive"]:
+                    break
+            time.sleep(STEP)
+        if not self.options["quiet"]:
+            sys.stdout.write("\nDone.\n")
+            sys.stdout.flush()
+
+
+class Recorder(object):
+    def __init__(self, arguments):
+        self.split = False
+        self.size = None
+        self.duration = None
+        self.max_splits = None
+        output, prefix = "", False
+        iterator = iter(arguments)
+        for argument in iterator:
+            if argument in ("-O", "-o"):
+                output, prefix = next(iterator), argument == "-o"
+            elif argument == "--split":
+                self.split = True
+            elif argument.startswith("--size="):
+                self.size = int(argument.split("=", 1)[1])
+            elif argument.startswith("--duration="):
+                self.duration = float(argument.split("=", 1)[1].rstrip("s"))
+            elif argument.startswith("--max-splits="):
+                self.max_splits = int(argument.split("=", 1)[1])
+        if output.endswith(".bag"):
+            output = output[:-len(".bag")]
+        if prefix:
+            output += time.strftime("_%Y-%m-%d-%H-%M-%S")
+        self.output = output
+        self.block = b"\0" * int(os.environ.get("FAKE_ROSBAG_BLOCK", 100))
+        self.megabyte = int(os.environ.get("FAKE_ROSBAG_MB", 1000))
+        self.interrupted = False
+        self.splits = []
+
+    def name(self):
+        if not self.split:
+            return self.output + ".bag"
+        return "{}_{}.bag".format(self.output, len(self.splits))
+
+    def interrupt(self, signum, frame):
+        self.interrupted = True
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.interrupt)
+        sys.stderr.write("[ INFO] [0.000000]: Recording to {}.\n".format(
+            self.name()))
+        for _ in range(int(os.environ.get("FAKE_ROSBAG_OVERFLOW", 0))):
+            sys.stderr.write("[ WARN] [0.000000]: rosbag record buffer "
+                             "exceeded.  Dropping oldest queued message.\n")
+        sys.stderr.flush()
+        start = time.time()
+        name = self.name()
+        active = open(name + ".active", "wb")
+        while not self.interrupted:
+            active.write(self.block)
+            active.flush()
+            if (self.split and self.size is not None and
+                    active.tell() >= self.size * self.megabyte):
+                active.close()
+                os.rename(name + ".active", name)
+                self.splits.append(name)
+                if (self.max_splits is not None and
+                        len(self.splits) > self.max_splits):
+                    os.remove(self.splits[-self.max_splits - 1])
+                name = self.name()
+                active = open(name + ".active", "wb")
+            if (self.duration is not None and not self.split and
+                    time.time() - start >= self.duration):
+                break
+            time.sleep(STEP)
+        active.close()
+        os.rename(name + ".active", name)
+
+
+def start_child(filename):
+    def ignore():
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    process = subprocess.Popen(["sleep", "60"], preexec_fn=ignore)
+    with open(filename + ".tmp", "w") as pid_file:
+        pid_file.write(str(process.pid))
+    os.rename(filename + ".tmp", filename)
+
+
+def wrap(filename):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    environment = dict(os.environ)
+    del environment["FAKE_ROSBAG_WRAPPER"]
+    process = subprocess.Popen(
+        [sys.executable] + sys.argv, env=environment,
+        preexec_fn=lambda: signal.signal(signal.SIGINT, signal.SIG_DFL))
+    with open(filename + ".tmp", "w") as pid_file:
+        pid_file.write(str(process.pid))
+    os.rename(filename + ".tmp", filename)
+    return process.wait()
+
+
+def main():
+    wrapper = os.environ.get("FAKE_ROSBAG_WRAPPER")
+    if wrapper:
+        return wrap(wrapper)
+    log = os.environ.get("FAKE_ROSBAG_LOG")
+    if log:
+        with open(log, "a") as log_file:
+            log_file.write(" ".join(sys.argv[1:]) + "\n")
+    if sys.argv[1:2] == ["record"]:
+        Recorder(sys.argv[2:]).run()
+        return int(os.environ.get("FAKE_ROSBAG_EXIT", 0))
+    if sys.argv[1:2] != ["play"]:
+        return int(os.environ.get("FAKE_ROSBAG_EXIT", 0))
+    player = Player(parse(sys.argv[2:]),
+                    float(os.environ.get("FAKE_ROSBAG_DURATION", 0.2)),
+                    bag_start([argument for argument in sys.argv[2:]
+                               if not argument.startswith("-")]))
+    signal.signal(signal.SIGINT, player.interrupt)
+    for name in os.environ.get("FAKE_ROSBAG_IGNORE", "").split(","):
+        if name:
+            signal.signal(getattr(signal, "SIG" + name), signal.SIG_IGN)
+    child = os.environ.get("FAKE_ROSBAG_CHILD")
+    if child:
+        start_child(child)
+    keys = threading.Thread(target=player.keys)
+    keys.daemon = True
+    keys.start()
+    player.run()
+    return int(os.environ.get("FAKE_ROSBAG_EXIT", 0))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for ``pyrosbag.aio`` module.
+
+"""
+import asyncio
+import signal
+import time
+
+import pytest
+
+from pyrosbag import aio
+from pyrosbag import pyrosbag as prb
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAsyncBagPlayer(object):
+    def test_play_and_wait(self, fake_rosbag):
+        async def main():
+            player = aio.AsyncBagPlayer("example.bag")
+            await player.play(wait=True, immediate=True)
+            return player
+
+        player = run(main())
+        assert player.process.returncode == 0
+        assert not player.is_running
+        with open(fake_rosbag) as log:
+            assert log.read().split() == ["play", "example.bag", "-i"]
+
+    def test_wait_returns_returncode(self, fake_rosbag, monkeypatch):
+        monkeypatch.setenv("FAKE_ROSBAG_EXIT", "3")
+
+        async def main():
+            player = aio.AsyncBagPlayer("example.bag")
+            await player.play(immediate=True)
+            assert player.is_running
+            return await player.wait()
+
+        assert run(main()) == 3
+
+    def test_many_players_on_one_loop(self, fake_rosbag):
+        async def main():
+            players = [aio.AsyncBagPlayer("{}.bag".format(i))
+                       for i in range(8)]
+            await asyncio.gather(*(player.play() for player in players))
+            return await asyncio.gather(*(player.wait()
+                                          for player in players))
+
+        start = time.time()
+        assert run(main()) == [0] * 8
+        assert time.time() - start < 8 * 0.2
+
+    def test_controls(self, fake_rosbag):
+        async def main():
+            player = aio.AsyncBagPlayer("example.bag")
+            await player.play(start_paused=True)
+            await player.step()
+            await player.resume()
+            await player.pause()
+            return await player.stop()
+
+        assert run(main()) is not None
+
+    def test_stop_does_not_sleep(self, fake_rosbag, monkeypatch):
+        monkeypatch.setenv("FAKE_ROSBAG_DURATION", "60")
+
+        async def main():
+            player = aio.AsyncBagPlayer("example.bag")
+            await player.play(stdout=asyncio.subprocess.PIPE)
+            assert await player.process.stdout.readline()
+            start = time.time()
+            result = await player.stop()
+            assert result is player.shutdown_result
+            assert (result.returncode, result.signal) == (0, signal.SIGINT)
+            return time.time() - start
+
+        assert run(main()) < 0.5
+
+    def test_not_running(self):
+        async def main():
+            player = aio.AsyncBagPlayer("example.bag")
+            with pytest.raises(prb.BagNotRunningError):
+                await player.send("s")
+            with pytest.raises(prb.BagNotRunningError):
+                await player.wait()
+            with pytest.raises(prb.BagNotRunningError):
+                await player.stop()
+
+        run(main())
+
+    def test_cannot_play_twice(self, fake_rosbag, monkeypatch):
+        monkeypatch.setenv("FAKE_ROSBAG_DURATION", "60")
+
+        async def main():
+            player = aio.AsyncBagPlayer("example.bag")
+            await player.play()
+            try:
+                with pytest.raises(prb.BagError):
+                    await player.play()
+            finally:
+                await player.stop()
+
+        run(main())
+
+    def test_async_context_manager_stops_on_error(self, fake_rosbag,
+                                                  monkeypatch):
+        monkeypatch.setenv("FAKE_ROSBAG_DURATION", "60")
+        players = []
+
+        async def main():
+            async with aio.AsyncBagPlayer("example.bag") as player:
+                players.append(player)
+                await player.play()
+                raise ValueError("Oops.")
+
+        with pytest.raises(ValueError):
+            run(main())
+        assert not players[0].is_running
+
+    def test_sync_context_manager_is_rejected(self):
+        with pytest.raises(TypeError):
+            with aio.AsyncBagPlayer("example.bag"):
+                pass
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for ``pyrosbag.bagfile`` module.
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import pytest
+
+from pyrosbag import bagfile
+from pyrosbag import pyrosbag as prb
+
+from .bagtools import sample_messages
+
+
+class TestBagIndex(object):
+    def test_reads_connections(self, make_bag):
+        index = bagfile.BagIndex(make_bag(sample_messages()))
+        topics = sorted(c.topic for c in index.connections.values())
+        assert topics == ["/a", "/b"]
+        connection = index.connections[0]
+        assert connection.datatype == "std_msgs/String"
+        assert connection.md5sum == "992ce8a1687cec8c8bd883ec73ca41d1"
+        assert connection.msg_def == "string data\n"
+
+    def test_reads_chunk_infos(self, make_bag):
+        messages = sample_messages()
+        index = bagfile.BagIndex(make_bag(messages, chunk_size=200))
+        assert len(index.chunk_infos) > 1
+        assert index.start_time == messages[0][1]
+        assert index.end_time == messages[-1][1]
+        assert sum(index.message_counts().values()) == len(messages)
+
+    def test_info(self, make_bag):
+        messages = sample_messages(10, step=10 ** 8)
+        info = bagfile.BagIndex(make_bag(messages)).info()
+        assert info.message_count == 10
+        assert info.duration == pytest.approx(0.9)
+        assert info.start_time == pytest.approx(1e9)
+        assert info.topics["/a"] == bagfile.TopicInfo(
+            "std_msgs/String", "992ce8a1687cec8c8bd883ec73ca41d1", 5, 1)
+        assert info.compression is None
+
+    @pytest.mark.parametrize("compression", ["none", "bz2"])
+    def test_info_with_compression(self, make_bag, compression):
+        info = bagfile.BagIndex(make_bag(sample_messages(),
+                                         compression=compression,
+                                         chunk_size=200)).info(True)
+        assert info.compression == {compression: info.chunk_count}
+
+    def test_empty_bag(self, make_bag):
+        info = bagfile.BagIndex(make_bag([])).info()
+        assert info.message_count == 0
+        assert info.start_time is None
+        assert info.duration == 0.0
+
+    def test_unindexed_bag(self, make_bag):
+        with pytest.raises(bagfile.UnindexedBagError):
+            bagfile.BagIndex(make_bag(sample_messages(), index=False))
+
+    def test_not_a_bag(self, tmpdir):
+        path = tmpdir.join("not.bag")
+        path.write("#ROSBAG V1.2\n")
+        with pytest.raises(bagfile.BagFormatError):
+            bagfile.BagIndex(str(path))
+
+
+class TestBagInfo(object):
+    def test_info_per_file(self, make_bag):
+        first = make_bag(sample_messages(10), name="first.bag")
+        second = make_bag(sample_messages(20), name="second.bag")
+        infos = prb.Bag([first, second]).info()
+        assert [info.filename for info in infos] == [first, second]
+        assert [info.message_count for info in infos] == [10, 20]
+
+    def test_indexes_are_read_once(self, make_bag):
+        bag = prb.Bag(make_bag(sample_messages()))
+        assert bag.indexes is bag.indexes
+
+
+class TestBagReader(object):
+    @pytest.mark.parametrize("compression", ["none", "bz2", "lz4"])
+    def test_reads_every_message(self, make_bag, compression):
+        if compression == "lz4":
+            pytest.importorskip("lz4.frame")
+        messages = sample_messages()
+        path = make_bag(messages, compression=compression, chunk_size=200)
+        with bagfile.BagReader(path) as reader:
+            read = [(m.topic, m.timestamp, bytes(m.data))
+                    for m in reader.read_messages()]
+        assert read == messages
+
+    def test_uncompressed_messages_are_views_into_the_file(self, make_bag):
+        with bagfile.BagReader(make_bag(sample_messages())) as reader:
+            message = next(reader.read_messages())
+            assert isinstance(message.data, memoryview)
+            assert isinstance(message.data.obj, bagfile.mmap.mmap)
+
+    def test_filters_by_topic(self, make_bag):
+        path = make_bag(sample_messages(), chunk_size=200)
+        with bagfile.BagReader(path) as reader:
+            topics = set(m.topic for m in reader.read_messages("/b"))
+            assert topics == {"/b"}
+            assert len(list(reader.read_messages(["/a", "/b"]))) == 100
+            assert not list(reader.read_messages("/missing"))
+
+    def test_filters_by_time(self, make_bag):
+        messages = sample_messages(step=10 ** 8)
+        path = make_bag(messages, chunk_size=200)
+        with bagfile.BagReader(path) as reader:
+            read = list(reader.read_messages(start=1e9 + 2, end=1e9 + 3))
+        assert [m.timestamp for m in read] == [
+            t for _, t, _ in messages if 10 ** 18 + 2 * 10 ** 9 <= t <=
+            10 ** 18 + 3 * 10 ** 9]
+        assert read[0].time == pytest.approx(1e9 + 2)
+
+    def test_overlapping_chunks_are_merged(self, make_bag):
+        messages = sample_messages()
+        shuffled = messages[1::2] + messages[::2]
+        path = make_bag(shuffled, chunk_size=100)
+        with bagfile.BagReader(path) as reader:
+            read = [m.timestamp for m in reader.read_messages()]
+        assert read == [t for _, t, _ in messages]
+
+    def test_bag_interleaves_files(self, make_bag):
+        messages = sample_messages()
+        first = make_bag(messages[::2], name="first.bag")
+        second = make_bag(messages[1::2], name="second.bag",
+                          compression="bz2")
+        read = [(m.topic, m.timestamp, bytes(m.data))
+                for m in prb.Bag([first, second]).read_messages()]
+        assert read == messages
+
+
+class RecordingExecutor(ThreadPoolExecutor):
+    def __init__(self, *args, **kwargs):
+        super(RecordingExecutor, self).__init__(*args, **kwargs)
+        self.outstanding = 0
+        self.max_outstanding = 0
+        self.submitted = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            self.submitted += 1
+            self.outstanding += 1
+            self.max_outstanding = max(self.max_outstanding,
+                                       self.outstanding)
+        future = super(RecordingExecutor, self).submit(fn, *args, **kwargs)
+
+        def done(result):
+            with self._lock:
+                self.outstanding -= 1
+
+        return RecordedFuture(future, done)
+
+
+class RecordedFuture(object):
+    def __init__(self, future, on_result):
+        self._future = future
+        self._on_result = on_result
+
+    def result(self):
+        result = self._future.result()
+        self._on_result(result)
+        return result
+
+    def cancel(self):
+        self._on_result(None)
+        return self._future.cancel()
+
+
+class TestParallelDecompression(object):
+    @pytest.mark.parametrize("workers", [1, 4])
+    def test_same_output_as_sequential(self, make_bag, workers):
+        messages = sample_messages(500)
+        path = make_bag(messages[1::2] + messages[::2], compression="bz2",
+                        chunk_size=300)
+        bag = prb.Bag(path)
+        sequential = [(m.topic, m.timestamp, bytes(m.data))
+                      for m in bag.read_messages()]
+        parallel = [(m.topic, m.timestamp, bytes(m.data))
+                    for m in bag.read_messages(workers=workers, prefetch=3)]
+        assert parallel == sequential == sorted(messages, key=lambda m: m[1])
+
+    def test_prefetch_window_is_bounded(self, make_bag):
+        path = make_bag(sample_messages(500), compression="bz2",
+                        chunk_size=300)
+        executor = RecordingExecutor(4)
+        with bagfile.BagReader(path) as reader:
+            count = len(list(reader.read_messages(executor=executor,
+                                                  prefetch=3)))
+        executor.shutdown()
+        assert count == 500
+        assert executor.submitted == len(reader.index.chunk_infos)
+        assert executor.max_outstanding <= 3
+
+    def test_time_filter_with_prefetch(self, make_bag):
+        messages = sample_messages(500, step=10 ** 8)
+        path = make_bag(messages, compression="bz2", chunk_size=300)
+        bag = prb.Bag(path)
+        expected = [m.timestamp for m in bag.read_messages(
+            "/a", start=1e9 + 10.05, end=1e9 + 20)]
+        read = [m.timestamp for m in bag.read_messages(
+            "/a", start=1e9 + 10.05, end=1e9 + 20, workers=2, prefetch=2)]
+        assert read == expected
+        assert len(read) == 50
+
+    def test_uncompressed_chunks_are_not_submitted(self, make_bag):
+        executor = RecordingExecutor(2)
+        with bagfile.BagReader(make_bag(sample_messages())) as reader:
+            assert len(list(reader.read_messages(executor=executor))) == 100
+        executor.shutdown()
+        assert executor.submitted == 0
+
+
+class TestSeek(object):
+    def setup_method(self):
+        self.messages = sample_messages(1000, step=10 ** 8)
+
+    def test_chunks_between(self, make_bag):
+        index = bagfile.BagIndex(make_bag(self.messages, chunk_size=300))
+        t = 10 ** 18 + 50 * 10 ** 9
+        chunks = index.chunks_between(t, t + 10 ** 9)
+        assert chunks[0].start_time <= t <= chunks[0].end_time
+        assert chunks[-1].start_time <= t + 10 ** 9 <= chunks[-1].end_time
+        assert chunks == sorted(
+            (c for c in index.chunk_infos
+             if c.end_time >= t and c.start_time <= t + 10 ** 9),
+            key=lambda c: c.start_time)
+        assert index.chunks_between() == index.chunk_infos
+
+    def test_read_does_not_touch_earlier_chunks(self, make_bag):
+        path = make_bag(self.messages, chunk_size=300)
+        t = 10 ** 18 + 50 * 10 ** 9
+        touched = []
+        with bagfile.BagReader(path) as reader:
+            original = reader.chunk_entries
+
+            def chunk_entries(chunk_info, *args):
+                touched.append(chunk_info)
+                return original(chunk_info, *args)
+
+            reader.chunk_entries = chunk_entries
+            message = next(reader.read_messages(start=bagfile.to_sec(t)))
+        assert message.timestamp == t
+        assert min(chunk.end_time for chunk in touched) >= t
+
+    @pytest.mark.parametrize("cached", [False, True])
+    def test_seek(self, make_bag, cached):
+        path = make_bag(self.messages, chunk_size=300, compression="bz2")
+        bag = prb.Bag(path)
+        if cached:
+            bag.indexes[0].load_message_index()
+        message = bag.seek(1e9 + 50.05)
+        assert message.timestamp == 10 ** 18 + 501 * 10 ** 8
+        assert bytes(message.data) == self.messages[501][2]
+        message = bag.seek(1e9 + 50.05, topics="/a")
+        assert message.timestamp == 10 ** 18 + 502 * 10 ** 8
+        assert message.topic == "/a"
+        assert bag.seek(1e9 + 1000) is None
+        assert bag.seek(0).timestamp == 10 ** 18
+
+    def test_seek_with_cache_reads_one_chunk(self, make_bag):
+        path = make_bag(self.messages, chunk_size=300)
+        index = bagfile.BagIndex(path)
+        index.load_message_index()
+        with bagfile.BagReader(index) as reader:
+            reader.chunk_entries = None
+            message = reader.seek(1e9 + 50)
+        assert message.timestamp == 10 ** 18 + 500 * 10 ** 8
+
+    def test_seek_across_files(self, make_bag):
+        first = make_bag(self.messages[::2], name="first.bag")
+        second = make_bag(self.messages[1::2], name="second.bag")
+        message = prb.Bag([first, second]).seek(1e9 + 50.05)
+        assert message.timestamp == 10 ** 18 + 501 * 10 ** 8
+
+
+class TestTopicTable(object):
+    def setup_method(self):
+        pytest.importorskip("numpy")
+
+    @pytest.mark.parametrize("compression", ["none", "bz2"])
+    def test_table(self, make_bag, compression):
+        messages = sample_messages(300, topics=("/a", "/b", "/c"))
+        path = make_bag(messages[1::2] + messages[::2], chunk_size=400,
+                        compression=compression)
+        tables = prb.Bag(path).topic_table()
+        assert sorted(tables) == ["/a", "/b", "/c"]
+        for topic, table in tables.items():
+            expected = [m for m in messages if m[0] == topic]
+            assert list(table["timestamp"]) == [t for _, t, _ in expected]
+            assert list(table["size"]) == [len(d) for _, _, d in expected]
+            assert (table["file"] == 0).all()
+            assert len(set(table["connection"])) == 1
+
+    def test_table_without_sizes_does_not_read_chunks(self, make_bag):
+        path = make_bag(sample_messages(), chunk_size=200)
+        with bagfile.BagReader(path) as reader:
+            reader.chunk_data = reader._chunk_payload = None
+            table = reader.topic_table("/a", sizes=False)["/a"]
+        assert len(table) == 50
+        assert (table["size"] == 0).all()
+
+    def test_table_locates_messages(self, make_bag):
+        messages = sample_messages(100)
+        path = make_bag(messages, chunk_size=200)
+        with bagfile.BagReader(path) as reader:
+            row = reader.topic_table("/b")["/b"][10]
+            chunk = reader.chunk_data(bagfile.ChunkInfo(int(row["chunk_pos"]),
+                                                        0, 0, {}))
+            message = reader.message_at(chunk, int(row["offset"]),
+                                        int(row["timestamp"]),
+                                        int(row["connection"]))
+        assert bytes(message.data) == messages[21][2]
+
+    def test_table_across_files(self, make_bag):
+        messages = sample_messages()
+        first = make_bag(messages[::2], name="first.bag")
+        second = make_bag(messages[1::2], name="second.bag",
+                          compression="bz2")
+        tables = prb.Bag([first, second]).topic_table(["/a", "/b"])
+        assert list(tables["/a"]["timestamp"]) == [
+            t for topic, t, _ in messages if topic == "/a"]
+        assert (tables["/a"]["file"] == 0).all()
+        assert (tables["/b"]["file"] == 1).all()
+
+    def test_rates_from_table(self, make_bag):
+        np = pytest.importorskip("numpy")
+        path = make_bag(sample_messages(101, step=10 ** 7))
+        table = prb.Bag(path).topic_table("/a")["/a"]
+        gaps = np.diff(table["timestamp"]) / 1e9
+        assert np.allclose(gaps, 0.02)
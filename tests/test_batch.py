@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for ``pyrosbag.batch`` module.
+
+"""
+import os
+
+import pytest
+
+from pyrosbag import bagfile
+from pyrosbag import batch
+from pyrosbag import pyrosbag as prb
+
+from .bagtools import sample_messages
+
+
+def read_bag(path):
+    with bagfile.BagReader(path) as reader:
+        return [(m.topic, m.timestamp, bytes(m.data))
+                for m in reader.read_messages()]
+
+
+def compression(path):
+    return bagfile.BagIndex(path).info(compression=True).compression
+
+
+class TestConvert(object):
+    @pytest.mark.parametrize("source, target", [
+        ("none", "bz2"), ("bz2", "lz4"), ("lz4", "lz4")])
+    def test_compress(self, make_bag, source, target):
+        if "lz4" in (source, target):
+            pytest.importorskip("lz4.frame")
+        messages = sample_messages(200)
+        path = make_bag(messages, compression=source, chunk_size=300)
+        chunks = len(bagfile.BagIndex(path).chunk_infos)
+        result = batch.convert(path, "compress", target)
+        assert result.succeeded
+        assert result.bytes_out == os.path.getsize(path)
+        assert read_bag(path) == messages
+        assert compression(path) == {target: chunks}
+
+    def test_decompress(self, make_bag):
+        messages = sample_messages(200)
+        path = make_bag(messages, compression="bz2", chunk_size=300)
+        batch.convert(path, "decompress")
+        assert read_bag(path) == messages
+        assert list(compression(path)) == ["none"]
+
+    @pytest.mark.parametrize("kind", ["none", "bz2"])
+    def test_reindex(self, make_bag, kind):
+        messages = sample_messages(200)
+        reference = make_bag(messages, compression=kind, chunk_size=300,
+                             name="reference.bag")
+        chunks = bagfile.BagIndex(reference).chunk_infos
+        path = make_bag(messages, compression=kind, chunk_size=300,
+                        index=False)
+        with pytest.raises(bagfile.UnindexedBagError):
+            bagfile.BagIndex(path)
+        assert batch.convert(path, "reindex").succeeded
+        assert read_bag(path) == messages
+        assert bagfile.BagIndex(path).chunk_infos == chunks
+        assert sorted(c.topic for c in
+                      bagfile.BagIndex(path).connections.values()) == [
+            "/a", "/b"]
+
+    def test_output(self, make_bag, tmpdir):
+        pytest.importorskip("lz4.frame")
+        path = make_bag(sample_messages())
+        output = str(tmpdir.join("out.bag"))
+        result = batch.convert(path, "compress", "lz4", output)
+        assert result.output == output
+        assert list(compression(path)) == ["none"]
+        assert list(compression(output)) == ["lz4"]
+
+    def test_failure_keeps_original(self, tmpdir):
+        path = tmpdir.join("bad.bag")
+        path.write(b"not a bag", mode="wb")
+        result = batch.convert(str(path), "compress")
+        assert not result.succeeded
+        assert result.error
+        assert path.read_binary() == b"not a bag"
+        assert tmpdir.listdir() == [path]
+
+    def test_throughput(self, make_bag):
+        result = batch.convert(make_bag(sample_messages()), "compress")
+        assert result.bytes_in > 0
+        assert result.megabytes_per_sec > 0
+
+
+class TestBatch(object):
+    def make_bags(self, make_bag, count=3):
+        return [make_bag(sample_messages(50), name="{}.bag".format(i))
+                for i in range(count)]
+
+    def test_directory_in_process_pool(self, make_bag, tmpdir):
+        pytest.importorskip("lz4.frame")
+        paths = self.make_bags(make_bag)
+        done = []
+        results = batch.batch_convert(str(tmpdir), "compress", "lz4",
+                                      workers=2, callback=done.append)
+        assert [r.filename for r in results] == sorted(paths)
+        assert sorted(done) == sorted(results)
+        assert all(r.succeeded for r in results)
+        for path in paths:
+            assert list(compression(path)) == ["lz4"]
+            assert read_bag(path) == sample_messages(50)
+
+    def test_glob_and_output_dir(self, make_bag, tmpdir):
+        self.make_bags(make_bag)
+        out = tmpdir.mkdir("out")
+        results = batch.batch_convert(str(tmpdir.join("[01].bag")),
+                                      "compress", workers=1,
+                                      output_dir=str(out))
+        assert len(results) == 2
+        assert sorted(p.basename for p in out.listdir()) == ["0.bag",
+                                                             "1.bag"]
+
+    def test_find_bags(self, make_bag, tmpdir):
+        paths = self.make_bags(make_bag)
+        tmpdir.join("0.orig.bag").write("backup")
+        tmpdir.join("1.fixing.bag").write("partial")
+        assert batch.find_bags(str(tmpdir)) == sorted(paths)
+        assert batch.find_bags(str(tmpdir.join("*.bag"))) == sorted(paths)
+        assert batch.find_bags(paths[::-1]) == paths[::-1]
+
+    def test_output_collision(self, make_bag, tmpdir):
+        first = make_bag(sample_messages(10))
+        second = str(tmpdir.mkdir("other").join("test.bag"))
+        os.rename(make_bag(sample_messages(10), name="copy.bag"), second)
+        out = tmpdir.mkdir("out")
+        with pytest.raises(prb.BagError):
+            batch.batch_convert([first, second], "compress",
+                                output_dir=str(out))
+        assert out.listdir() == []
+
+    def test_unknown_operation(self):
+        with pytest.raises(prb.BagError):
+            batch.batch_convert([], "shrink")
+
+
+class TestBagMethods(object):
+    def test_compress_and_decompress(self, make_bag):
+        messages = sample_messages()
+        bag = prb.Bag(make_bag(messages))
+        chunks = bag.info()[0].chunk_count
+        assert bag.compress("bz2")[0].succeeded
+        assert bag.info(compression=True)[0].compression == {"bz2": chunks}
+        bag.decompress()
+        assert bag.info(compression=True)[0].compression == {"none": chunks}
+        assert [bytes(m.data) for m in bag.read_messages()] == [
+            d for _, _, d in messages]
+
+    def test_reindex(self, make_bag):
+        bag = prb.Bag(make_bag(sample_messages(), index=False))
+        assert bag.reindex()[0].succeeded
+        assert bag.info()[0].message_count == 100
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the benchmark suite.
+
+"""
+import json
+
+import pytest
+
+from benchmarks import run as bench
+
+
+SPEC = bench.BagSpec(0.05, 2, "lz4", 256, 5.0)
+
+
+class TestBenchmarks(object):
+    def test_generate_bag(self, tmpdir):
+        pytest.importorskip("lz4.frame")
+        path = bench.generate_bag(SPEC, str(tmpdir))
+        info = bench.prb.Bag(path).info()[0]
+        assert info.message_count == SPEC.message_count == 195
+        assert sorted(info.topics) == ["/bench_0", "/bench_1"]
+        assert bench.generate_bag(SPEC, str(tmpdir)) == path
+        assert len(tmpdir.listdir()) == 1
+
+    def test_run(self, tmpdir, fake_rosbag, monkeypatch):
+        pytest.importorskip("lz4.frame")
+        monkeypatch.setenv("FAKE_ROSBAG_DURATION", "5")
+        results = bench.run([SPEC], str(tmpdir), repeat=2, benchmarks=[
+            "index_open", "sequential_read", "time_to_first_message"])
+        assert [result.key.split("/bench_")[0] for result in results] == [
+            "index_open/file", "index_open/cached", "sequential_read/serial",
+            "sequential_read/4_workers", "time_to_first_message/engine",
+            "time_to_first_message/rosbag",
+            "time_to_first_message/rosbag_standby"]
+        for result in results:
+            assert result.error is None
+            assert len(result.samples) == 2
+            summary = result.as_dict()
+            assert summary["min"] <= summary["median"] <= summary["max"]
+
+    def test_failures_are_reported(self, tmpdir):
+        def fail():
+            raise ValueError("broken")
+        result = bench._measure("name", "variant", SPEC, "s", "lower", fail)
+        assert result.error == "ValueError: broken"
+        assert "median" not in result.as_dict()
+
+    def test_compare(self):
+        def result(name, better, median):
+            return dict(key=name, better=better, median=median, unit="s")
+        baseline = [result("latency", "lower", 1.0),
+                    result("throughput", "higher", 100.0),
+                    result("gone", "lower", 1.0)]
+        assert bench.compare(baseline, baseline, 0.1) == []
+        regressions = bench.compare(
+            [result("latency", "lower", 1.5),
+             result("throughput", "higher", 95.0),
+             dict(key="new", error="failed")], baseline, 0.1)
+        assert regressions == ["latency: 1 s -> 1.5 s (+50%)"]
+        regressions = bench.compare([result("throughput", "higher", 50.0)],
+                                    baseline, 0.1)
+        assert regressions == ["throughput: 100 s -> 50 s (+50%)"]
+
+    def test_main(self, tmpdir):
+        output = tmpdir.join("results.json")
+        arguments = ["--size", "0.05", "--topics", "1", "--repeat", "1",
+                     "--no-rosbag", "--benchmark", "index_open",
+                     "--workdir", str(tmpdir), "-o", str(output)]
+        assert bench.main(arguments) == 0
+        document = json.loads(output.read())
+        assert document["repeat"] == 1
+        assert len(document["results"]) == 2
+        for result in document["results"]:
+            result["median"] = 0
+        output.write(json.dumps(document))
+        assert bench.main(arguments[:-2] + ["--baseline", str(output)]) == 1
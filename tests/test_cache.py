@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for ``pyrosbag.cache`` module.
+
+"""
+from unittest.mock import patch
+import os
+
+from pyrosbag import bagfile
+from pyrosbag import cache
+from pyrosbag import pyrosbag as prb
+
+from .bagtools import sample_messages
+
+
+class TestIndexCache(object):
+    def test_load_stores_and_reuses_index(self, make_bag, tmpdir):
+        path = make_bag(sample_messages(), chunk_size=200)
+        index_cache = cache.IndexCache(str(tmpdir.join("cache")))
+        first = index_cache.load(path)
+        assert first.message_index is not None
+        with patch.object(cache, "BagIndex") as mock_index:
+            second = index_cache.load(path)
+            assert not mock_index.called
+        assert second.connections == first.connections
+        assert second.chunk_infos == first.chunk_infos
+        assert second.message_index == first.message_index
+
+    def test_message_index_is_ordered(self, make_bag, tmpdir):
+        messages = sample_messages()
+        path = make_bag(messages, chunk_size=200)
+        index = cache.IndexCache(str(tmpdir.join("cache"))).load(path)
+        timestamps = sorted(index.message_index[0].timestamps +
+                            index.message_index[1].timestamps)
+        assert list(index.message_index[0].timestamps) == [
+            t for topic, t, _ in messages if topic == "/a"]
+        assert timestamps == [t for _, t, _ in messages]
+
+    def test_invalidated_when_bag_changes(self, make_bag, tmpdir):
+        path = make_bag(sample_messages(10))
+        index_cache = cache.IndexCache(str(tmpdir.join("cache")))
+        index_cache.load(path)
+        make_bag(sample_messages(20))
+        os.utime(path, (0, 0))
+        assert index_cache.get(path) is None
+        assert sum(index_cache.load(path).message_counts().values()) == 20
+
+    def test_evicts_least_recently_used(self, make_bag, tmpdir):
+        index_cache = cache.IndexCache(str(tmpdir.join("cache")))
+        paths = [make_bag(sample_messages(), name="{}.bag".format(i))
+                 for i in range(3)]
+        for i, path in enumerate(paths):
+            index_cache.load(path)
+            os.utime(index_cache._entry(path), (i, i))
+        entry_size = os.path.getsize(index_cache._entry(paths[0]))
+        index_cache.max_size = 2 * entry_size
+        index_cache.evict()
+        assert index_cache.get(paths[0]) is None
+        assert index_cache.get(paths[1]) is not None
+        assert index_cache.get(paths[2]) is not None
+
+    def test_evicts_only_over_budget(self, make_bag, tmpdir):
+        index_cache = cache.IndexCache(str(tmpdir.join("cache")))
+        paths = [make_bag(sample_messages(), name="{}.bag".format(i))
+                 for i in range(4)]
+        index_cache.load(paths[0])
+        entry_size = os.path.getsize(index_cache._entry(paths[0]))
+        index_cache.max_size = 2 * entry_size
+        with patch.object(cache.IndexCache, "evict",
+                          autospec=True,
+                          side_effect=cache.IndexCache.evict) as mock_evict:
+            index_cache.load(paths[1])
+            index_cache.load(paths[1])
+            assert not mock_evict.called
+            index_cache.load(paths[2])
+            assert mock_evict.call_count == 1
+            index_cache.load(paths[3])
+            assert mock_evict.call_count == 2
+        assert index_cache.size <= index_cache.max_size
+        assert index_cache.get(paths[3]) is not None
+
+    def test_corrupt_entries_are_discarded(self, make_bag, tmpdir):
+        path = make_bag(sample_messages())
+        index_cache = cache.IndexCache(str(tmpdir.join("cache")))
+        index_cache.load(path)
+        with open(index_cache._entry(path), "wb") as entry:
+            entry.write(b"garbage")
+        assert index_cache.get(path) is None
+        assert not os.path.exists(index_cache._entry(path))
+
+    def test_outdated_entries_are_discarded(self, make_bag, tmpdir):
+        path = make_bag(sample_messages(10))
+        index_cache = cache.IndexCache(str(tmpdir.join("cache")))
+        index_cache.load(path)
+        with patch.object(cache, "CACHE_VERSION", cache.CACHE_VERSION + 1):
+            assert index_cache.get(path) is None
+        assert not os.path.exists(index_cache._entry(path))
+
+    def test_changed_while_reading(self, make_bag, tmpdir):
+        path = make_bag(sample_messages(10))
+        index_cache = cache.IndexCache(str(tmpdir.join("cache")))
+        read_index = cache.BagIndex
+
+        def read_then_append(filename):
+            index = read_index(filename)
+            make_bag(sample_messages(20))
+            return index
+
+        with patch.object(cache, "BagIndex", side_effect=read_then_append):
+            index_cache.load(path)
+        assert index_cache.get(path) is None
+        assert sum(index_cache.load(path).message_counts().values()) == 20
+
+    def test_time_order_is_not_cached(self, make_bag, tmpdir):
+        path = make_bag(sample_messages(), chunk_size=200)
+        index_cache = cache.IndexCache(str(tmpdir.join("cache")))
+        index = index_cache.load(path)
+        index.chunks_between()
+        assert index._chunk_order is not None
+        index_cache.put(index)
+        cached = index_cache.get(path)
+        assert cached._chunk_order is None
+        assert cached.chunks_between() == index.chunks_between()
+
+    def test_clear(self, make_bag, tmpdir):
+        index_cache = cache.IndexCache(str(tmpdir.join("cache")))
+        index_cache.load(make_bag(sample_messages()))
+        assert index_cache.size > 0
+        index_cache.clear()
+        assert index_cache.size == 0
+
+    def test_bag_uses_cache(self, make_bag, tmpdir):
+        path = make_bag(sample_messages())
+        index_cache = cache.IndexCache(str(tmpdir.join("cache")))
+        bag = prb.Bag(path, cache=index_cache)
+        assert isinstance(bag.indexes[0], bagfile.BagIndex)
+        assert index_cache.get(path) is not None
+        messages = prb.Bag(path, cache=index_cache).read_messages()
+        assert len(list(messages)) == 100
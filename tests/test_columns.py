@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for ``pyrosbag.columns`` module.
+
+"""
+import struct
+
+import pytest
+
+from pyrosbag import columns
+from pyrosbag import decoder
+from pyrosbag import pyrosbag as prb
+
+from .bagtools import write_test_bag
+from .test_decoder import (IMAGE_DEF, POINT_DEF, POLYGON_DEF, header,
+                           string)
+
+
+np = pytest.importorskip("numpy")
+
+TYPES = {
+    "/point": ("geometry_msgs/Point", "4a842b65f413084dc2b10fb484ea7f17",
+               POINT_DEF),
+    "/image": ("sensor_msgs/Image", "060021388200f6f0f447d0fcd9c64743",
+               IMAGE_DEF),
+    "/polygon": ("geometry_msgs/Polygon", "cd60a26494a087f577976f0329fa120e",
+                 POLYGON_DEF),
+}
+START = 1483228800 * 10 ** 9
+
+
+def image(i):
+    return (header(i, START + i, b"camera") + struct.pack("<II", 1, 4) +
+            string(b"mono8") + struct.pack("<BI", 0, 4) +
+            string(bytes(bytearray([i] * 4))))
+
+
+def polygon(i):
+    return (struct.pack("<I", i % 3) + struct.pack("<3f", i, 0, 0) * (i % 3) +
+            struct.pack("<3f", 1, 2, i) + struct.pack("<ii", i, 0))
+
+
+def sample_bag(path, count=30):
+    messages = []
+    for i in range(count):
+        time = START + i * 10 ** 7
+        messages.append(("/point", time, struct.pack("<ddd", i, -i, 0.5)))
+        messages.append(("/image", time + 1, image(i)))
+        messages.append(("/polygon", time + 2, polygon(i)))
+    write_test_bag(path, messages, compression="bz2", chunk_size=512,
+                   types=TYPES)
+    return messages
+
+
+class TestToColumns(object):
+    def setup_method(self):
+        self.messages = None
+
+    @pytest.fixture
+    def bag(self, tmpdir):
+        path = str(tmpdir.join("columns.bag"))
+        self.messages = sample_bag(path)
+        return prb.Bag(path)
+
+    def test_single_batches(self, bag):
+        batches = dict((batch.topic, batch) for batch in bag.to_columns())
+        assert sorted(batches) == ["/image", "/point", "/polygon"]
+
+        point = batches["/point"]
+        assert point.datatype == "geometry_msgs/Point"
+        assert list(point.columns) == ["timestamp", "x", "y", "z"]
+        assert point.rows == 30
+        assert point.columns["x"].dtype == np.float64
+        assert point.columns["y"].tolist() == [-i for i in range(30)]
+        assert point.columns["timestamp"].tolist() == [
+            m[1] for m in self.messages if m[0] == "/point"]
+
+        image = batches["/image"].columns
+        assert list(image)[:5] == ["timestamp", "header.seq", "header.stamp",
+                                   "header.frame_id", "height"]
+        assert image["header.stamp"].dtype == np.int64
+        assert image["header.frame_id"][3] == "camera"
+        assert image["data"][3] == b"\x03" * 4
+
+        polygon = batches["/polygon"].columns
+        assert polygon["points"][2] == [{"x": 2, "y": 0, "z": 0}] * 2
+        assert polygon["scale"][4].tolist() == [1, 2, 4]
+        assert polygon["timeout"][5] == 5 * 10 ** 9
+
+    def test_bounded_batches(self, bag):
+        batches = list(bag.to_columns("/point", row_group_size=24 * 7))
+        assert [batch.rows for batch in batches] == [7, 7, 7, 7, 2]
+        assert np.concatenate([batch.columns["x"] for batch in batches]
+                              ).tolist() == list(range(30))
+
+    def test_column_names(self):
+        types = decoder.parse_definition("sensor_msgs/Image", IMAGE_DEF)
+        names = columns.column_names(decoder.MessageDecoder(
+            "sensor_msgs/Image", types))
+        assert names == ["header.seq", "header.stamp", "header.frame_id",
+                         "height", "width", "encoding", "is_bigendian",
+                         "step", "data"]
+
+
+class TestExportParquet(object):
+    def setup_method(self):
+        self.pq = pytest.importorskip("pyarrow.parquet")
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_export(self, tmpdir, workers):
+        path = str(tmpdir.join("columns.bag"))
+        sample_bag(path)
+        out = tmpdir.mkdir("out")
+        reported = []
+        results = prb.Bag(path).to_parquet(str(out), workers=workers,
+                                           row_group_size=256,
+                                           callback=reported.append)
+        assert [result.topic for result in results] == ["/image", "/point",
+                                                        "/polygon"]
+        assert sorted(reported) == sorted(results)
+        assert all(result.succeeded for result in results)
+        assert sorted(p.basename for p in out.listdir()) == [
+            "image.parquet", "point.parquet", "polygon.parquet"]
+
+        for result in results:
+            parquet = self.pq.ParquetFile(result.output)
+            assert parquet.metadata.num_rows == result.rows == 30
+            assert parquet.metadata.num_row_groups == result.row_groups > 1
+
+        table = self.pq.read_table(str(out.join("image.parquet")))
+        assert table.column("header.frame_id")[0].as_py() == "camera"
+        assert table.column("data")[5].as_py() == b"\x05" * 4
+        table = self.pq.read_table(str(out.join("polygon.parquet")))
+        assert table.column("points")[1].as_py() == [{"x": 1, "y": 0,
+                                                      "z": 0}]
+        assert table.column("scale")[2].as_py() == [1, 2, 2]
+
+    def test_time_range_and_missing_topic(self, tmpdir):
+        path = str(tmpdir.join("columns.bag"))
+        sample_bag(path)
+        results = columns.export_parquet(
+            path, str(tmpdir), ["/point", "/missing"], workers=1,
+            start=(START + 10 ** 8) / 1e9)
+        assert [(r.topic, r.rows, r.succeeded) for r in results] == [
+            ("/missing", 0, True), ("/point", 20, True)]
+        assert not tmpdir.join("missing.parquet").exists()
+        table = self.pq.read_table(str(tmpdir.join("point.parquet")))
+        assert table.column("x").to_pylist() == list(range(10, 30))
+
+    def test_without_pyarrow(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(columns, "pq", None)
+        with pytest.raises(prb.BagError):
+            columns.export_parquet([], str(tmpdir))
+
+    def test_parquet_filename(self):
+        assert (columns.parquet_filename("/camera/image_raw") ==
+                "camera__image_raw.parquet")
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for ``pyrosbag.decoder`` module.
+
+"""
+import struct
+
+import pytest
+
+from pyrosbag import bagfile
+from pyrosbag import decoder
+from pyrosbag import pyrosbag as prb
+
+from .bagtools import write_test_bag
+
+
+SEPARATOR = "=" * 80 + "\n"
+HEADER_DEF = """uint32 seq
+time stamp
+string frame_id
+"""
+POINT_DEF = "float64 x\nfloat64 y\nfloat64 z\n"
+IMAGE_DEF = ("""Header header
+uint32 height
+uint32 width
+string encoding
+uint8 is_bigendian
+uint32 step
+uint8[] data
+""" + SEPARATOR + "MSG: std_msgs/Header\n" + HEADER_DEF)
+POLYGON_DEF = ("""# A polygon.
+Point32[] points  # In order
+uint8 OPEN=0
+string NAME=a # polygon
+float32[3] scale
+duration timeout
+""" + SEPARATOR + "MSG: geometry_msgs/Point32\n" +
+               "float32 x\nfloat32 y\nfloat32 z\n")
+LABELS_DEF = ("""Label[] labels
+bool[] flags
+""" + SEPARATOR + "MSG: test_msgs/Label\nstring text\nint16 id\n")
+
+
+def string(value):
+    return struct.pack("<I", len(value)) + value
+
+
+def header(seq, stamp, frame_id):
+    return struct.pack("<III", seq, stamp // 10 ** 9,
+                       stamp % 10 ** 9) + string(frame_id)
+
+
+def connection(datatype, msg_def, md5sum="0" * 32):
+    return bagfile.Connection(0, "/topic", datatype, md5sum, msg_def, {})
+
+
+def view(datatype, msg_def, data):
+    return decoder.deserialize(connection(datatype, msg_def), data)
+
+
+IMAGE = (header(7, 1483228800 * 10 ** 9 + 5, b"camera") +
+         struct.pack("<II", 2, 3) + string(b"mono8") +
+         struct.pack("<BI", 0, 3) + string(bytes(bytearray(range(6)))))
+
+
+class TestParseDefinition(object):
+    def test_sections(self):
+        types = decoder.parse_definition("sensor_msgs/Image", IMAGE_DEF)
+        assert sorted(types) == ["sensor_msgs/Image", "std_msgs/Header"]
+        fields, constants = types["sensor_msgs/Image"]
+        assert fields[0] == decoder.Field("header", "std_msgs/Header",
+                                          False, None)
+        assert fields[-1] == decoder.Field("data", "uint8", True, None)
+        assert constants == {}
+
+    def test_constants_and_arrays(self):
+        fields, constants = decoder.parse_definition(
+            "geometry_msgs/Polygon", POLYGON_DEF)["geometry_msgs/Polygon"]
+        assert fields == [
+            decoder.Field("points", "geometry_msgs/Point32", True, None),
+            decoder.Field("scale", "float32", True, 3),
+            decoder.Field("timeout", "duration", False, None),
+        ]
+        assert constants == {"OPEN": 0, "NAME": "a # polygon"}
+
+    def test_bad_line(self):
+        with pytest.raises(bagfile.BagFormatError):
+            decoder.parse_definition("a/B", "int32 x y\n")
+
+    def test_missing_type(self):
+        with pytest.raises(bagfile.BagFormatError):
+            view("a/B", "Missing m\n", b"")
+
+
+class TestMessageView(object):
+    def test_fixed_size(self):
+        point = view("geometry_msgs/Point", POINT_DEF,
+                     struct.pack("<ddd", 1, 2, 3))
+        assert point._decoder.struct is not None
+        assert point._decoder.size == 24
+        assert (point.x, point.y, point.z) == (1, 2, 3)
+        assert point._type == "geometry_msgs/Point"
+        assert point._fields == ("x", "y", "z")
+
+    def test_lazy(self):
+        image = view("sensor_msgs/Image", IMAGE_DEF, IMAGE)
+        assert image.step == 3
+        assert image._values.count(decoder._MISSING) == 6
+        assert image.encoding == "mono8"
+        assert image.header.frame_id == "camera"
+        assert image.header.stamp == 1483228800 * 10 ** 9 + 5
+        assert image._decoder.size is None
+
+    def test_invalid_utf8_string(self):
+        label = view("test_msgs/Label", "string text\nint16 id\n",
+                     string(b"\xe9t\xc3\xa9") + b"\x07\x00")
+        assert label.text == "\ufffdt\xe9"
+        assert label.id == 7
+
+    def test_numpy_views(self):
+        np = pytest.importorskip("numpy")
+        data = bytearray(IMAGE)
+        image = view("sensor_msgs/Image", IMAGE_DEF, data)
+        pixels = image.data
+        assert isinstance(pixels, np.ndarray)
+        assert pixels.tolist() == list(range(6))
+        data[-1] = 42
+        assert pixels[-1] == 42
+
+    def test_arrays_of_messages(self):
+        data = (struct.pack("<I", 2) + struct.pack("<6f", *range(6)) +
+                struct.pack("<3f", 1, 2, 3) + struct.pack("<ii", -1, 5))
+        polygon = view("geometry_msgs/Polygon", POLYGON_DEF, data)
+        assert polygon.timeout == -10 ** 9 + 5
+        assert [p.z for p in polygon.points] == [2, 5]
+        assert list(polygon.scale) == [1, 2, 3]
+        assert polygon.OPEN == 0
+
+        data = (struct.pack("<I", 2) + string(b"left") + b"\x01\x00" +
+                string(b"right") + b"\x02\x00" + struct.pack("<I", 2) +
+                b"\x01\x00")
+        labels = view("test_msgs/Labels", LABELS_DEF, data)
+        assert list(labels.flags) == [True, False]
+        assert [(x.text, x.id) for x in labels.labels] == [("left", 1),
+                                                           ("right", 2)]
+
+    def test_asdict(self):
+        point = view("geometry_msgs/Point", POINT_DEF,
+                     struct.pack("<ddd", 1, 2, 3))
+        assert point._asdict() == {"x": 1, "y": 2, "z": 3}
+        assert repr(point) == "geometry_msgs/Point(x=1.0, y=2.0, z=3.0)"
+
+    def test_read_only(self):
+        point = view("geometry_msgs/Point", POINT_DEF, b"\0" * 24)
+        with pytest.raises(AttributeError):
+            point.x = 1
+
+
+class TestGetDecoder(object):
+    def test_cached_by_md5sum(self):
+        first = decoder.get_decoder(connection("a/Point", POINT_DEF, "1" * 32))
+        second = decoder.get_decoder(bagfile.Connection(
+            3, "/other", "a/Point", "1" * 32, POINT_DEF, {}))
+        assert first is second
+        assert first is not decoder.get_decoder(
+            connection("a/Point", POINT_DEF, "2" * 32))
+
+    def test_from_bag(self, tmpdir):
+        path = str(tmpdir.join("points.bag"))
+        messages = [("/point", i * 10 ** 9, struct.pack("<ddd", i, 0, -i))
+                    for i in range(1, 4)]
+        write_test_bag(path, messages, types={
+            "/point": ("geometry_msgs/Point",
+                       "4a842b65f413084dc2b10fb484ea7f17", POINT_DEF)})
+        bag = prb.Bag(path)
+        assert [(m.msg.x, m.msg.z) for m in bag.read_messages()] == [
+            (1, -1), (2, -2), (3, -3)]
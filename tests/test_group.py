@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for ``pyrosbag.group`` module.
+
+"""
+import time
+
+import pytest
+
+from pyrosbag import group
+from pyrosbag import pyrosbag as prb
+
+from .bagtools import invocations, sample_messages, wait_for
+
+
+START = 10 ** 18
+
+
+class TestBagPlayerGroup(object):
+    def setup_method(self):
+        self.group = None
+
+    def teardown_method(self):
+        if self.group is not None:
+            self.group.stop()
+
+    @pytest.fixture(autouse=True)
+    def long_bag(self, monkeypatch):
+        monkeypatch.setenv("FAKE_ROSBAG_DURATION", "30")
+
+    @pytest.fixture
+    def bags(self, make_bag):
+        return [make_bag(sample_messages(200, start=START), "a.bag"),
+                make_bag(sample_messages(200, start=START + 3 * 10 ** 8),
+                         "b.bag")]
+
+    def statuses(self):
+        return [player.progress.latest for player in self.group.players]
+
+    def test_offsets(self, bags):
+        self.group = group.BagPlayerGroup(bags)
+        assert self.group.reference == pytest.approx(1e9)
+        assert self.group.offsets == [0, pytest.approx(0.3, abs=1e-6)]
+
+    def test_later_bags_start_later(self, fake_rosbag, bags):
+        self.group = group.BagPlayerGroup(bags)
+        self.group.play()
+        assert self.group.is_playing
+        first, second = self.statuses()
+        assert not first.is_paused and second.is_paused
+        assert self.group.skew().positions[1] is None
+        wait_for(lambda: not self.statuses()[1].is_paused)
+        assert self.group.position >= 0.29
+        time.sleep(0.1)
+        report = self.group.skew()
+        assert None not in report.positions
+        assert report.skew < 0.05
+
+    def test_start_at_position(self, fake_rosbag, bags):
+        self.group = group.BagPlayerGroup(bags)
+        self.group.play(position=1.0, start_paused=True)
+        assert not self.group.is_playing
+        assert [status.bag_time for status in self.statuses()] == [
+            pytest.approx(1e9 + 1, abs=1e-5)] * 2
+        starts = sorted(float(arguments[-1].split("=")[1])
+                        for arguments in invocations(fake_rosbag))
+        assert starts == [pytest.approx(0.7, abs=1e-5), 1.0]
+
+    def test_pause_and_resume(self, fake_rosbag, bags):
+        self.group = group.BagPlayerGroup(bags)
+        self.group.play(position=0.5)
+        assert self.group.skew().resume_window < 0.05
+        time.sleep(0.05)
+        self.group.pause()
+        assert all(status.is_paused for status in self.statuses())
+        position = self.group.position
+        time.sleep(0.05)
+        assert self.group.position == position
+        assert self.group.skew().skew < 0.05
+        self.group.resume()
+        assert not any(status.is_paused for status in self.statuses())
+        assert self.group.position > position
+
+    def test_set_rate(self, fake_rosbag, bags):
+        self.group = group.BagPlayerGroup(bags)
+        self.group.play(position=0.5)
+        time.sleep(0.05)
+        self.group.set_rate(2)
+        assert self.group.rate == 2
+        assert self.group.is_playing
+        rates = [arguments for arguments in invocations(fake_rosbag)
+                 if "--rate=2.0" in arguments]
+        assert len(rates) == 2
+        time.sleep(0.1)
+        assert self.group.skew().skew < 0.05
+        assert [player.is_running for player in self.group.players] == [
+            True, True]
+
+    def test_set_rate_after_bag_ended(self, fake_rosbag, bags, make_bag):
+        short = make_bag(sample_messages(10, start=START), "short.bag")
+        self.group = group.BagPlayerGroup(bags + [short])
+        self.group.play()
+        wait_for(lambda: self.group.position > 0.1)
+        self.group.set_rate(2)
+        assert self.group.is_playing
+        rates = [arguments for arguments in invocations(fake_rosbag)
+                 if "--rate=2.0" in arguments]
+        assert len(rates) == 2
+        assert not any(short in arguments for arguments in rates)
+        assert [player.is_running for player in self.group.players] == [
+            True, True, False]
+
+    def test_start_after_bag_ended(self, fake_rosbag, bags, make_bag):
+        short = make_bag(sample_messages(10, start=START), "short.bag")
+        self.group = group.BagPlayerGroup(bags + [short])
+        self.group.play(position=0.5)
+        assert len(invocations(fake_rosbag)) == 2
+        assert [player.is_running for player in self.group.players] == [
+            True, True, False]
+        assert self.group.skew().positions[2] is None
+
+    def test_stop(self, fake_rosbag, bags):
+        with group.BagPlayerGroup(bags) as self.group:
+            self.group.play()
+        assert not any(player.is_running for player in self.group.players)
+        assert self.group.stop() == [None, None]
+
+    def test_options_set_by_group(self, bags):
+        self.group = group.BagPlayerGroup(bags)
+        with pytest.raises(prb.BagError):
+            self.group.play(start_time=3)
+
+    def test_empty(self):
+        with pytest.raises(prb.BagError):
+            group.BagPlayerGroup([])
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for ``pyrosbag.playback`` module.
+
+"""
+import threading
+import time
+
+import pytest
+
+from pyrosbag import playback
+from pyrosbag import pyrosbag as prb
+
+from .bagtools import sample_messages, wait_for
+
+
+START = 10 ** 18
+
+
+class Recorder(object):
+    def __init__(self, count=None):
+        self.messages = []
+        self.times = []
+        self.done = threading.Event()
+        self.count = count
+
+    def __call__(self, message):
+        self.times.append(time.time())
+        self.messages.append(message)
+        if self.count is not None and len(self.messages) >= self.count:
+            self.done.set()
+
+    @property
+    def timestamps(self):
+        return [message.timestamp for message in self.messages]
+
+
+class TestPlaybackEngine(object):
+    def test_immediate_plays_every_message(self, make_bag):
+        messages = sample_messages(200, step=10 ** 9)
+        sink = Recorder()
+        player = prb.BagPlayer(make_bag(messages, chunk_size=200))
+        player.play(sink=sink, immediate=True, wait=True)
+        assert isinstance(player.process, playback.PlaybackEngine)
+        assert player.process.returncode == 0
+        assert not player.is_running
+        assert sink.timestamps == [t for _, t, _ in messages]
+        assert [bytes(m.data) for m in sink.messages] == [
+            d for _, _, d in messages]
+
+    def test_paces_messages_with_rate(self, make_bag):
+        messages = sample_messages(11, step=4 * 10 ** 7)
+        sink = Recorder()
+        player = prb.BagPlayer(make_bag(messages))
+        player.play(sink=sink, publish_rate_multiplier=2, wait=True)
+        offsets = [t - sink.times[0] for t in sink.times]
+        for i, offset in enumerate(offsets):
+            assert offset == pytest.approx(i * 0.02, abs=0.01)
+
+    def test_start_time_and_duration(self, make_bag):
+        messages = sample_messages(100, step=10 ** 8)
+        sink = Recorder()
+        player = prb.BagPlayer(make_bag(messages))
+        player.play(sink=sink, immediate=True, start_time=2, duration=1,
+                    wait=True)
+        assert sink.timestamps == [START + i * 10 ** 8 for i in range(20, 31)]
+
+    def test_pause_step_resume(self, make_bag):
+        messages = sample_messages(10, step=10 ** 7)
+        sink = Recorder(10)
+        player = prb.BagPlayer(make_bag(messages))
+        player.play(sink=sink, start_paused=True)
+        engine = player.process
+        time.sleep(0.05)
+        assert not sink.messages
+        assert engine.is_paused
+        engine.step()
+        engine.step()
+        wait_for(lambda: len(sink.messages) == 2)
+        assert engine.bag_time == pytest.approx(1e9 + 0.01)
+        engine.resume()
+        assert sink.done.wait(5)
+        assert sink.timestamps == [t for _, t, _ in messages]
+        assert engine.wait(5) == 0
+
+    def test_confirmed_steps(self, make_bag):
+        sink = Recorder()
+        player = prb.BagPlayer(make_bag(sample_messages(10, step=10 ** 7)))
+        player.play(sink=sink, start_paused=True)
+        ack = player.step(3, confirm=True)
+        assert len(sink.messages) == 3
+        assert player.process.steps_played == 3
+        assert ack.command == "step" and ack.steps == 3
+        assert ack.bag_time == pytest.approx(1e9 + 0.02)
+        assert player.pause(confirm=True).latency >= 0
+        player.resume()
+        assert not player.process.wait_for_steps(4, timeout=1)
+        assert player.wait() == 0
+
+    def test_keystrokes(self, make_bag):
+        sink = Recorder()
+        player = prb.BagPlayer(make_bag(sample_messages(10, step=10 ** 8)))
+        player.play(sink=sink, start_paused=True)
+        player.step()
+        wait_for(lambda: len(sink.messages) == 1)
+        player.resume()
+        wait_for(lambda: len(sink.messages) >= 2)
+        player.pause()
+        assert player.process.is_paused
+        player.stop()
+        assert player.wait() == 0
+
+    def test_seek(self, make_bag):
+        messages = sample_messages(100, step=10 ** 8)
+        sink = Recorder()
+        player = prb.BagPlayer(make_bag(messages, chunk_size=200))
+        player.play(sink=sink, start_paused=True)
+        player.process.seek(5)
+        player.process.step()
+        wait_for(lambda: len(sink.messages) == 1)
+        assert sink.timestamps == [START + 50 * 10 ** 8]
+        player.process.seek(1.05)
+        player.process.step()
+        wait_for(lambda: len(sink.messages) == 2)
+        assert sink.timestamps[1] == START + 11 * 10 ** 8
+        player.stop()
+
+    def test_loop(self, make_bag):
+        sink = Recorder(25)
+        player = prb.BagPlayer(make_bag(sample_messages(10)))
+        player.play(sink=sink, immediate=True, loop=True)
+        assert sink.done.wait(5)
+        player.stop()
+        player.wait()
+        assert sink.timestamps[10:20] == sink.timestamps[:10]
+
+    def test_keep_alive(self, make_bag):
+        sink = Recorder(10)
+        player = prb.BagPlayer(make_bag(sample_messages(10)))
+        player.play(sink=sink, immediate=True, keep_alive=True)
+        assert sink.done.wait(5)
+        time.sleep(0.05)
+        assert player.is_running
+        player.stop()
+        assert player.wait() == 0
+
+    def test_publishes_clock(self, make_bag):
+        clock = []
+        player = prb.BagPlayer(make_bag(sample_messages(11, step=10 ** 7)))
+        player.play(sink=Recorder(), clock_sink=clock.append,
+                    publish_clock=True, clock_publish_freq=1000, wait=True)
+        assert len(clock) > 10
+        assert clock == sorted(clock)
+        assert 1e9 <= clock[0] <= clock[-1] <= 1e9 + 0.11
+
+    def test_sink_errors_end_playback(self, make_bag):
+        def sink(message):
+            raise ValueError("Bad message.")
+
+        player = prb.BagPlayer(make_bag(sample_messages(10)))
+        player.play(sink=sink, immediate=True, wait=True)
+        assert player.process.returncode == 1
+        assert isinstance(player.process.error, ValueError)
+
+    def test_cannot_play_twice(self, make_bag):
+        engine = playback.PlaybackEngine(prb.Bag(make_bag(sample_messages())),
+                                         Recorder())
+        engine.play(immediate=True)
+        with pytest.raises(prb.BagError):
+            engine.play()
+        engine.wait()
+
+
+class TestPlaybackMetrics(object):
+    def test_record_and_summarize(self):
+        metrics = playback.PlaybackMetrics(late_threshold=0.001)
+        for i in range(100):
+            metrics.record(i * 0.01, i * 0.01 + (0.005 if i == 50 else 0.0),
+                           1000)
+        metrics.record_drop()
+        summary = metrics.summary()
+        assert summary.messages == 100
+        assert summary.dropped == 1
+        assert summary.late == 1
+        assert summary.elapsed == pytest.approx(0.99)
+        assert summary.messages_per_sec == pytest.approx(100)
+        assert summary.megabytes_per_sec == pytest.approx(0.1)
+        assert summary.max_lag == pytest.approx(0.005)
+        assert summary.median_lag == 0
+        assert metrics.histogram() == [(0.0001, 99), (0.001, 0), (0.01, 1),
+                                       (0.1, 0), (1.0, 0),
+                                       (float("inf"), 0)]
+
+    def test_keeps_latest_timings(self):
+        metrics = playback.PlaybackMetrics(history=3)
+        for i in range(5):
+            metrics.record(i, i + 0.5, 10 * i)
+        assert metrics.timings() == [(2, 2.5, 20), (3, 3.5, 30),
+                                     (4, 4.5, 40)]
+        assert metrics.messages == 5
+
+    def test_percentiles_are_estimated(self):
+        metrics = playback.PlaybackMetrics()
+        for i in range(1, 1001):
+            metrics.record(0.0, i * 1e-5, 1)
+        summary = metrics.summary()
+        assert summary.mean_lag == pytest.approx(5.005e-3)
+        assert summary.max_lag == pytest.approx(0.01)
+        assert summary.median_lag == pytest.approx(5.01e-3, rel=0.01)
+        assert summary.p99_lag == pytest.approx(9.91e-3, rel=0.01)
+
+    def test_empty_summary(self):
+        summary = playback.PlaybackMetrics().summary()
+        assert summary.messages == 0
+        assert summary.messages_per_sec == 0
+
+    def test_player_records_metrics(self, make_bag):
+        summaries = []
+        player = prb.BagPlayer(make_bag(sample_messages(21, step=10 ** 7)))
+        player.play(sink=Recorder(), metrics_callback=summaries.append,
+                    metrics_interval=0.05, wait=True)
+        metrics = player.metrics
+        assert metrics.messages == 21
+        assert len(summaries) >= 3
+        assert summaries[-1].messages == 21
+        assert summaries[-1].messages_per_sec == pytest.approx(100, rel=0.2)
+        assert summaries[-1].median_lag < 0.005
+        assert metrics.bytes == sum(len(d) for _, _, d in
+                                    sample_messages(21))
+        timings = metrics.timings()
+        assert [t.size for t in timings] == [len(d) for _, _, d in
+                                             sample_messages(21)]
+        assert all(t.actual >= t.scheduled for t in timings)
+
+    def test_late_messages_are_dropped(self, make_bag):
+        def slow_sink(message):
+            time.sleep(0.03)
+
+        player = prb.BagPlayer(make_bag(sample_messages(10, step=10 ** 7)))
+        player.play(sink=slow_sink, max_lag=0.015, wait=True)
+        summary = player.metrics.summary()
+        assert summary.dropped > 0
+        assert summary.messages + summary.dropped == 10
+
+    def test_subprocess_has_no_metrics(self):
+        player = prb.BagPlayer("example.bag")
+        assert player.metrics is None
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for ``pyrosbag.pool`` module.
+
+"""
+from unittest.mock import MagicMock, patch
+import subprocess as sp
+import threading
+
+import pytest
+
+from pyrosbag import pool
+from pyrosbag import pyrosbag as prb
+
+from .bagtools import wait_for
+
+
+def make_process(returncode=0):
+    process = MagicMock()
+    process.wait.return_value = returncode
+    process.returncode = returncode
+    return process
+
+
+class TestBagPlayerPool(object):
+    def test_max_workers_capped_at_core_count(self):
+        with patch.object(pool.multiprocessing, "cpu_count", return_value=4):
+            assert pool.BagPlayerPool(100).max_workers == 4
+            assert pool.BagPlayerPool().max_workers == 4
+            assert pool.BagPlayerPool(2).max_workers == 2
+            assert pool.BagPlayerPool(0).max_workers == 1
+            assert pool.BagPlayerPool(8, cap_to_cpus=False).max_workers == 8
+
+    def test_plays_every_bag_in_order(self):
+        with patch.object(prb, "sp", autospec=True) as mock_sp:
+            mock_sp.PIPE = sp.PIPE
+            mock_sp.Popen.return_value = make_process()
+            result = pool.BagPlayerPool(2).play(
+                ["a.bag", ["b.bag", "c.bag"], "d.bag"], immediate=True)
+        assert result.succeeded
+        assert [r.filenames for r in result.results] == [
+            ["a.bag"], ["b.bag", "c.bag"], ["d.bag"]]
+        assert all(r.attempts == 1 for r in result.results)
+        assert mock_sp.Popen.call_count == 3
+        for call in mock_sp.Popen.call_args_list:
+            assert "-i" in call[0][0]
+
+    def test_failures_are_retried_and_reported(self):
+        with patch.object(prb, "sp", autospec=True) as mock_sp:
+            mock_sp.PIPE = sp.PIPE
+            mock_sp.Popen.return_value = make_process(1)
+            result = pool.BagPlayerPool(1, retries=2).play(["a.bag"])
+        assert not result.succeeded
+        failure, = result.failures
+        assert failure.attempts == 3
+        assert failure.returncode == 1
+        assert "code 1" in failure.error
+
+    def test_retry_succeeds(self):
+        with patch.object(prb, "sp", autospec=True) as mock_sp:
+            mock_sp.PIPE = sp.PIPE
+            mock_sp.Popen.side_effect = [make_process(1), make_process(0)]
+            result = pool.BagPlayerPool(1, retries=1).play(["a.bag"])
+        assert result.succeeded
+        assert result.results[0].attempts == 2
+
+    def test_launch_errors_are_reported(self):
+        with patch.object(prb, "sp", autospec=True) as mock_sp:
+            mock_sp.PIPE = sp.PIPE
+            mock_sp.Popen.side_effect = OSError("rosbag not found")
+            result = pool.BagPlayerPool(1).play(["a.bag", ""])
+        assert [r.error for r in result.results] == [
+            "rosbag not found", "MissingBagError"]
+        assert result.results[0].returncode is None
+
+    def test_unexpected_errors_are_reported(self):
+        def fail(filenames, **kwargs):
+            if filenames == "b.bag":
+                raise ValueError("bad player")
+            return prb.BagPlayer(filenames, **kwargs)
+
+        def callback(result):
+            raise RuntimeError("bad callback")
+
+        with patch.object(prb, "sp", autospec=True) as mock_sp:
+            mock_sp.PIPE = sp.PIPE
+            mock_sp.Popen.return_value = make_process()
+            result = pool.BagPlayerPool(1, player_class=fail).play(
+                ["a.bag", "b.bag", "c.bag"], callback=callback)
+        errors = [r.error for r in result.results]
+        assert errors == [None, "bad player", None]
+        assert [r.filenames for r in result.failures] == [["b.bag"]]
+
+    def test_callback_called_per_bag(self):
+        done = []
+        with patch.object(prb, "sp", autospec=True) as mock_sp:
+            mock_sp.PIPE = sp.PIPE
+            mock_sp.Popen.return_value = make_process()
+            pool.BagPlayerPool(2).play(["a.bag", "b.bag"],
+                                       callback=done.append)
+        assert sorted(r.filenames[0] for r in done) == ["a.bag", "b.bag"]
+
+    def test_runs_players_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def wait():
+            barrier.wait()
+            return 0
+
+        def popen(*args, **kwargs):
+            process = make_process()
+            process.wait.side_effect = wait
+            return process
+
+        with patch.object(pool.multiprocessing, "cpu_count", return_value=2):
+            with patch.object(prb, "sp", autospec=True) as mock_sp:
+                mock_sp.PIPE = sp.PIPE
+                mock_sp.Popen.side_effect = popen
+                result = pool.BagPlayerPool(2).play(["a.bag", "b.bag"])
+        assert result.succeeded
+
+    def test_stop_cancels_queued_bags(self):
+        bag_pool = pool.BagPlayerPool(1)
+
+        def wait():
+            bag_pool.stop()
+            return -15
+
+        with patch.object(prb, "sp", autospec=True) as mock_sp, \
+                patch.object(prb, "shutdown") as mock_shutdown:
+            mock_sp.PIPE = sp.PIPE
+            process = make_process(-15)
+            process.wait.side_effect = wait
+            mock_sp.Popen.return_value = process
+            result = bag_pool.play(["a.bag", "b.bag"])
+        mock_shutdown.assert_called_once_with(process, prb.ShutdownPolicy())
+        assert result.results[1].error == "Cancelled."
+        assert result.results[1].attempts == 0
+
+    def test_interrupt_stops_players(self, fake_rosbag, monkeypatch):
+        monkeypatch.setenv("FAKE_ROSBAG_DURATION", "30")
+        bag_pool = pool.BagPlayerPool(1)
+        running = []
+
+        def interrupt(thread, timeout=None):
+            wait_for(lambda: any(player.is_running
+                                 for player in list(bag_pool._players)))
+            running.extend(bag_pool._players)
+            raise KeyboardInterrupt
+
+        with patch.object(pool.threading.Thread, "join", interrupt):
+            with pytest.raises(KeyboardInterrupt):
+                bag_pool.play(["a.bag", "b.bag"])
+        player, = running
+        wait_for(lambda: not player.is_running)
+        assert player.shutdown_result is not None
+
+    def test_options_per_entry(self):
+        with patch.object(prb, "sp", autospec=True) as mock_sp:
+            mock_sp.PIPE = sp.PIPE
+            mock_sp.Popen.return_value = make_process()
+            result = pool.BagPlayerPool(1).play(
+                ["a.bag", "b.bag"],
+                options=[dict(publish_rate_multiplier=2), dict()],
+                publish_rate_multiplier=3)
+        assert [r.index for r in result.results] == [0, 1]
+        assert result.results[0].started <= result.results[1].started
+        first, second = (call[0][0] for call in mock_sp.Popen.call_args_list)
+        assert "--rate=2" in first
+        assert "--rate=3" in second
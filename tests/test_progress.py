@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for ``pyrosbag.progress`` module.
+
+"""
+import os
+import threading
+
+import pytest
+
+from pyrosbag import progress
+from pyrosbag import pyrosbag as prb
+
+
+def status(state, elapsed, duration=10.0, start=100.0):
+    return "\r [{}]  Bag Time: {:13.6f}   Duration: {:.6f} / {:.6f}     " \
+           "\r".format(state, start + elapsed, elapsed, duration).encode()
+
+
+class TestProgressReader(object):
+    def setup_method(self):
+        read_fd, self.write_fd = os.pipe()
+        self.stream = os.fdopen(read_fd, "rb")
+
+    def teardown_method(self):
+        self.stream.close()
+
+    def test_tracks_latest_status(self):
+        reader = progress.ProgressReader(self.stream)
+        assert reader.bag_time is None
+        os.write(self.write_fd, status("RUNNING", 1))
+        events = reader.events(timeout=5)
+        assert next(events).bag_time == 101
+        data = status("RUNNING", 2) + status("PAUSED ", 3)
+        os.write(self.write_fd, data[:30])
+        os.write(self.write_fd, data[30:])
+        latest = next(events)
+        while latest.elapsed < 3:
+            latest = next(events)
+        assert latest.is_paused
+        assert latest.fraction == pytest.approx(0.3)
+        os.close(self.write_fd)
+        assert list(events) == []
+        reader.join(5)
+        assert reader.finished
+        assert reader.latest == latest
+
+    def test_parses_status(self):
+        reader = progress.ProgressReader(self.stream)
+        os.write(self.write_fd, b"[ INFO] Opening bag\n" +
+                 status("RUNNING", 1.5))
+        latest = next(reader.events(timeout=5))
+        assert latest[:4] == ("RUNNING", 101.5, 1.5, 10.0)
+        assert not latest.is_paused
+        os.close(self.write_fd)
+        reader.join(5)
+
+    def test_last_status_wins(self):
+        reader = progress.ProgressReader(self.stream)
+        os.write(self.write_fd, b"Opening bag\n" + status("RUNNING", 1) +
+                 status("PAUSED ", 2))
+        os.close(self.write_fd)
+        reader.join(5)
+        assert reader.updates == 1
+        assert reader.latest[:4] == ("PAUSED", 102, 2, 10)
+        assert reader.latest.is_paused
+
+    def test_ignores_other_output(self):
+        reader = progress.ProgressReader(self.stream)
+        os.write(self.write_fd, b"[ INFO] Opening bag\n")
+        os.close(self.write_fd)
+        reader.join(5)
+        assert reader.finished
+        assert (reader.latest, reader.updates) == (None, 0)
+
+    def test_drains_large_output(self):
+        reader = progress.ProgressReader(self.stream)
+        data = b"".join(status("RUNNING", i * 0.001) for i in range(10000))
+        os.write(self.write_fd, data)
+        os.close(self.write_fd)
+        reader.join(5)
+        assert reader.bag_time == pytest.approx(109.999)
+        assert 1 <= reader.updates < 10000
+
+    def test_callback(self):
+        received = []
+        done = threading.Event()
+
+        def callback(event):
+            received.append(event)
+            done.set()
+
+        reader = progress.ProgressReader(self.stream, callback)
+        os.write(self.write_fd, status("RUNNING", 1))
+        assert done.wait(5)
+        assert received[0].state == "RUNNING"
+        os.close(self.write_fd)
+        reader.join(5)
+
+    def test_events_timeout(self):
+        reader = progress.ProgressReader(self.stream)
+        assert list(reader.events(timeout=0.01)) == []
+        os.close(self.write_fd)
+        reader.join(5)
+
+
+class TestBagPlayerProgress(object):
+    def test_follows_progress(self, fake_rosbag):
+        player = prb.BagPlayer("example.bag")
+        player.play(progress=True)
+        events = list(player.progress_events(timeout=5))
+        assert player.wait() == 0
+        assert events[-1].bag_time == pytest.approx(1e9 + 0.2)
+        assert events[-1].elapsed == pytest.approx(0.2)
+        assert [e.bag_time for e in events] == sorted(e.bag_time
+                                                      for e in events)
+        assert player.bag_time == pytest.approx(1e9 + 0.2)
+
+    def test_progress_callback(self, fake_rosbag):
+        received = []
+        player = prb.BagPlayer("example.bag")
+        player.play(start_paused=True, progress_callback=received.append)
+        events = player.progress_events(timeout=5)
+        assert next(events).is_paused
+        assert player.progress.latest.elapsed == 0
+        player.stop()
+        player.wait()
+        player.progress.join(5)
+        assert received[-1] == player.progress.latest
+
+    def test_progress_of_quiet_player(self, fake_rosbag):
+        player = prb.BagPlayer("example.bag")
+        with pytest.raises(prb.BagError):
+            player.play(progress=True, quiet=True)
+        with pytest.raises(prb.BagError):
+            player.play(progress_callback=print, quiet=True)
+        assert not player.is_running
+
+    def test_not_following_progress(self, fake_rosbag):
+        player = prb.BagPlayer("example.bag")
+        assert player.bag_time is None
+        player.play(stdout=open(os.devnull, "w"))
+        assert player.bag_time is None
+        with pytest.raises(prb.BagError):
+            player.progress_events()
+        player.wait()
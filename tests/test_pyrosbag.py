@@ -4,18 +4,21 @@
 Tests for ``pyrosbag`` module.
 
 """
-try:
-    from unittest.mock import MagicMock, patch
-except ImportError:
-    from mock import MagicMock, patch
+from unittest.mock import MagicMock, patch
 import logging
+import os
+import signal
 import subprocess as sp
+import time
 
 import hypothesis as hyp
 import hypothesis.strategies as hst
 import pytest
 
 from pyrosbag import pyrosbag as prb
+from pyrosbag.shutdown import popen_options
+
+from .bagtools import invocations, sample_messages, wait_for
 
 
 class TestErrors(object):
@@ -112,58 +115,53 @@ class TestBag(object):
 
     @hyp.given(hst.one_of(hst.text(), hst.lists(hst.text())))
     def test_enter_returns_self(self, filenames):
-        with patch.object(prb, "time", autospec=True):
-            try:
-                raw_bag = prb.Bag(filenames)
-                with prb.Bag(filenames) as context_bag:
-                    assert context_bag.filenames == raw_bag.filenames
-                    assert context_bag.process == raw_bag.process
-            except prb.MissingBagError:
-                hyp.reject()
+        try:
+            raw_bag = prb.Bag(filenames)
+            with prb.Bag(filenames) as context_bag:
+                assert context_bag.filenames == raw_bag.filenames
+                assert context_bag.process == raw_bag.process
+        except prb.MissingBagError:
+            hyp.reject()
 
     def test_exit_while_running_generates_warning(self):
         with patch.object(prb, "logger", autospec=True) as mock_logger:
-            with patch.object(prb, "time", autospec=True):
-                with prb.Bag("example.bag") as context_bag:
-                    context_bag.process = MagicMock()
-                    context_bag.process.poll.return_value = None
-                assert mock_logger.warning.called
-                assert mock_logger.info.called
+            with prb.Bag("example.bag") as context_bag:
+                context_bag.process = MagicMock()
+                context_bag.process.poll.return_value = None
+            assert mock_logger.warning.called
+            assert mock_logger.info.called
 
     def test_exit_while_running_with_error_stops_but_no_warning(self):
         with patch.object(prb, "logger", autospec=True) as mock_logger:
-            with patch.object(prb, "time", autospec=True):
-                with patch.object(prb.Bag, "stop", autospec=True) as mock_stop:
-                    try:
-                        with prb.Bag("example.bag") as context_bag:
-                            context_bag.process = MagicMock()
-                            context_bag.process.poll.return_value = None
-                            raise prb.BagError
-                    except prb.BagError:
-                        assert not mock_logger.warning.called
-                        assert mock_logger.critical.called
-                        assert not mock_logger.info.called
-                        mock_stop.assert_called_once_with(context_bag)
-
-    def test_normal_exceptions_get_reraised(self):
-        with patch.object(prb, "time", autospec=True):
-            for exception in (prb.BagError, AssertionError):
-                with pytest.raises(exception):
+            with patch.object(prb.Bag, "stop", autospec=True) as mock_stop:
+                try:
                     with prb.Bag("example.bag") as context_bag:
                         context_bag.process = MagicMock()
                         context_bag.process.poll.return_value = None
-                        raise exception
+                        raise prb.BagError
+                except prb.BagError:
+                    assert not mock_logger.warning.called
+                    assert mock_logger.critical.called
+                    assert not mock_logger.info.called
+                    mock_stop.assert_called_once_with(context_bag)
 
-    def test_keyboard_interrupt_does_not_reraise_exception(self):
-        with patch.object(prb, "logger", autospec=True) as mock_logger:
-            with patch.object(prb, "time", autospec=True):
+    def test_normal_exceptions_get_reraised(self):
+        for exception in (prb.BagError, AssertionError):
+            with pytest.raises(exception):
                 with prb.Bag("example.bag") as context_bag:
                     context_bag.process = MagicMock()
                     context_bag.process.poll.return_value = None
-                    raise KeyboardInterrupt
-                assert not mock_logger.warning.called
-                assert not mock_logger.critical.called
-                assert mock_logger.info.called
+                    raise exception
+
+    def test_keyboard_interrupt_does_not_reraise_exception(self):
+        with patch.object(prb, "logger", autospec=True) as mock_logger:
+            with prb.Bag("example.bag") as context_bag:
+                context_bag.process = MagicMock()
+                context_bag.process.poll.return_value = None
+                raise KeyboardInterrupt
+            assert not mock_logger.warning.called
+            assert not mock_logger.critical.called
+            assert mock_logger.info.called
 
     @hyp.given(hst.text())
     def test_repr_with_single_filename(self, filename):
@@ -210,19 +208,20 @@ class TestBagPlayer(object):
             self.running_bag.play()
             arguments = ["rosbag", "play", self.running_bag.filenames[0]]
             mock_sp.Popen.assert_called_once_with(arguments,
-                    stdin=mock_sp.PIPE, stdout=None, stderr=None)
+                    stdin=mock_sp.PIPE, stdout=None, stderr=None,
+                    **popen_options())
 
     @hyp.given(hst.lists(hst.text()))
     def test_play_with_multiple_filenames(self, filenames):
         with patch.object(prb, "sp", autospec=True) as mock_sp:
             mock_sp.PIPE = sp.PIPE
             try:
-                with patch.object(prb, "time", autospec=True):
-                    with prb.BagPlayer(filenames) as running_bag:
-                        running_bag.play()
-                        arguments = ["rosbag", "play"] + running_bag.filenames
-                        mock_sp.Popen.assert_called_once_with(arguments,
-                                stdin=mock_sp.PIPE, stdout=None, stderr=None)
+                with prb.BagPlayer(filenames) as running_bag:
+                    running_bag.play()
+                    arguments = ["rosbag", "play"] + running_bag.filenames
+                    mock_sp.Popen.assert_called_once_with(arguments,
+                            stdin=mock_sp.PIPE, stdout=None, stderr=None,
+                            **popen_options())
             except prb.MissingBagError:
                 hyp.reject()
 
@@ -234,7 +233,8 @@ class TestBagPlayer(object):
             arguments = ["rosbag", "play", self.running_bag.filenames[0],
                          addition]
             mock_sp.Popen.assert_called_once_with(arguments,
-                    stdin=mock_sp.PIPE, stdout=None, stderr=None)
+                    stdin=mock_sp.PIPE, stdout=None, stderr=None,
+                    **popen_options())
 
     def _run_argument_false(self, argument, addition=None):
         with patch.object(prb, "sp", autospec=True) as mock_sp:
@@ -247,7 +247,8 @@ class TestBagPlayer(object):
                 arguments = ["rosbag", "play", self.running_bag.filenames[0],
                              addition]
             mock_sp.Popen.assert_called_once_with(arguments,
-                    stdin=mock_sp.PIPE, stdout=None, stderr=None)
+                    stdin=mock_sp.PIPE, stdout=None, stderr=None,
+                    **popen_options())
 
     def _run_boolean_argument(self, argument, addition, addition_if_false=None):
         self._run_argument_true(argument, addition)
@@ -281,7 +282,8 @@ class TestBagPlayer(object):
                 arguments = ["rosbag", "play", self.running_bag.filenames[0],
                              "--{}={}".format(addition, number)]
                 mock_sp.Popen.assert_called_once_with(arguments,
-                        stdin=mock_sp.PIPE, stdout=None, stderr=None)
+                        stdin=mock_sp.PIPE, stdout=None, stderr=None,
+                        **popen_options())
 
         numeric_argument_run()
 
@@ -310,3 +312,247 @@ class TestBagPlayer(object):
                               autospec=True) as mock_wait:
                 self.running_bag.play(wait=True)
                 mock_wait.assert_called_once_with(self.running_bag)
+
+
+class TestRecordArguments(object):
+    def test_topics(self):
+        assert prb.record_arguments("out", ["/a", "/b"]) == [
+            "rosbag", "record", "-O", "out", "/a", "/b"]
+
+    def test_options(self):
+        arguments = prb.record_arguments(
+            "out", "/cam.*", regex=True, exclude="/cam/raw", prefix=True,
+            split_size=1024, max_splits=4, buffer_size=1024, chunk_size=4096,
+            compression="lz4", tcp_nodelay=True)
+        assert arguments == [
+            "rosbag", "record", "-o", "out", "-e", "-x", "/cam/raw",
+            "--split", "--size=1024", "--max-splits=4", "--buffsize=1024",
+            "--chunksize=4096", "--lz4", "--tcpnodelay", "/cam.*"]
+
+    def test_split_by_duration(self):
+        assert prb.record_arguments("out", all_topics=True,
+                                    split_duration="5m")[4:] == [
+            "-a", "--split", "--duration=5m"]
+
+    @pytest.mark.parametrize("options", [
+        {},
+        {"topics": "/a", "compression": "gzip"},
+        {"topics": "/a", "split_size": 1, "split_duration": 1},
+        {"topics": "/a", "split_duration": 1, "duration": 1},
+    ])
+    def test_inconsistent_options(self, options):
+        with pytest.raises(prb.BagError):
+            prb.record_arguments("out", **options)
+
+
+class TestBagPlayerControl(object):
+    def setup_method(self):
+        self.player = None
+
+    def teardown_method(self):
+        if self.player is not None and self.player.is_running:
+            self.player.stop()
+            self.player.wait()
+
+    @pytest.fixture(autouse=True)
+    def long_bag(self, monkeypatch):
+        monkeypatch.setenv("FAKE_ROSBAG_DURATION", "30")
+
+    def play(self, **kwargs):
+        self.player = prb.BagPlayer("a.bag")
+        self.player.play(progress=True, **kwargs)
+        wait_for(lambda: self.player.progress.latest is not None)
+        return self.player
+
+    def test_send_encodes_and_flushes(self):
+        player = prb.BagPlayer("a.bag")
+        player.process = MagicMock()
+        player.send(u"s")
+        player.process.stdin.write.assert_called_once_with(b"s")
+        player.process.stdin.flush.assert_called_once_with()
+
+    def test_send_to_closed_stdin(self, fake_rosbag):
+        player = self.play()
+        player.process.stdin.close()
+        with pytest.raises(prb.BagNotRunningError):
+            player.send(" ")
+
+    def test_pause_and_resume_are_idempotent(self, fake_rosbag):
+        player = self.play()
+        assert player.is_paused is False
+        ack = player.pause(confirm=True)
+        assert ack.command == "pause"
+        assert 0 < ack.latency < 5
+        assert player.progress.latest.is_paused
+        assert player.pause(confirm=True).latency == 0
+        assert player.is_paused
+        player.resume(confirm=True)
+        player.resume(confirm=True)
+        wait_for(lambda: player.progress.latest.bag_time > ack.bag_time)
+        assert not player.progress.latest.is_paused
+
+    def test_pause_state_follows_output(self, fake_rosbag):
+        player = self.play()
+        player.process.stdin.write(b" ")
+        player.process.stdin.flush()
+        wait_for(lambda: player.progress.latest.is_paused)
+        assert player.is_paused
+        player.resume(confirm=True)
+        assert not player.is_paused
+        ack = player.pause(confirm=True)
+        assert ack.latency > 0
+        assert player.progress.latest.is_paused
+
+    def test_toggle_in_flight(self, fake_rosbag):
+        player = self.play()
+        player.pause()
+        assert player.is_paused
+        player.resume(confirm=True)
+        assert not player.progress.latest.is_paused
+
+    def test_confirmed_steps(self, fake_rosbag):
+        player = self.play(start_paused=True)
+        before = player.bag_time
+        ack = player.step(5, confirm=True)
+        assert ack.steps == 5
+        assert ack.bag_time == pytest.approx(before + 0.05)
+        assert player.step(confirm=True).bag_time == pytest.approx(
+            before + 0.06)
+        assert player.progress.latest.is_paused
+
+    def test_cannot_confirm_steps_while_playing(self, fake_rosbag):
+        player = self.play()
+        with pytest.raises(prb.BagError):
+            player.step(confirm=True)
+
+    def test_confirm_needs_progress(self):
+        player = prb.BagPlayer("a.bag")
+        player.process = MagicMock()
+        with pytest.raises(prb.BagError):
+            player.pause(confirm=True)
+
+
+class TestTimeWindows(object):
+    def test_windows(self):
+        assert prb.time_windows(9, 3) == [(0, 3, 0), (3, 3, 0), (6, 3, 0)]
+
+    def test_overlap(self):
+        assert prb.time_windows(9, 3, overlap=1) == [
+            (0, 3, 0), (2, 4, 1), (5, 4, 1)]
+        assert prb.time_windows(2, 2, overlap=5) == [(0, 1, 0), (0, 2, 1)]
+
+    @pytest.mark.parametrize("shards, overlap", [(0, 0), (2, -1)])
+    def test_invalid(self, shards, overlap):
+        with pytest.raises(prb.BagError):
+            prb.time_windows(10, shards, overlap)
+
+
+class TestPlayShards(object):
+    @pytest.fixture
+    def bag(self, make_bag):
+        return make_bag(sample_messages(101, step=10 ** 8))
+
+    def test_plays_windows_in_parallel(self, fake_rosbag, monkeypatch, bag):
+        monkeypatch.setenv("FAKE_ROSBAG_DURATION", "10")
+        reported = []
+        results = prb.BagPlayer(bag).play_shards(
+            4, overlap=0.5, workers=4, immediate=False,
+            publish_rate_multiplier=100, callback=reported.append)
+        assert sorted(reported) == results
+        assert [result.index for result in results] == [0, 1, 2, 3]
+        assert all(result.succeeded for result in results)
+        assert [(r.start_time, r.duration, r.warmup) for r in results] == [
+            pytest.approx(window) for window in
+            [(0, 2.5, 0), (2, 3, 0.5), (4.5, 3, 0.5), (7, 3, 0.5)]]
+        assert max(result.started for result in results) < min(
+            result.started + result.elapsed for result in results)
+
+        arguments = sorted(invocations(fake_rosbag))
+        assert [argument[-2:] for argument in arguments[:3]] == [
+            ["--start=0.0", "--duration=2.5"],
+            ["--start=2.0", "--duration=3.0"],
+            ["--start=4.5", "--duration=3.0"]]
+        assert arguments[3][-1] == "--start=7.0"
+
+    def test_immediate_by_default(self, fake_rosbag, bag):
+        results = prb.BagPlayer(bag).play_shards(2, workers=1)
+        assert [result.returncode for result in results] == [0, 0]
+        assert all("-i" in arguments for arguments in
+                   invocations(fake_rosbag))
+
+    def test_failures_are_reported(self, fake_rosbag, monkeypatch, bag):
+        monkeypatch.setenv("FAKE_ROSBAG_EXIT", "3")
+        results = prb.BagPlayer(bag).play_shards(2)
+        assert [result.error for result in results] == [
+            "Exited with code 3."] * 2
+
+    def test_options_set_per_window(self, bag):
+        with pytest.raises(prb.BagError):
+            prb.BagPlayer(bag).play_shards(2, duration=3)
+
+
+class TestBagRecorder(object):
+    def test_record_and_stop(self, fake_rosbag, tmpdir):
+        output = str(tmpdir.join("out.bag"))
+        recorder = prb.BagRecorder(output)
+        recorder.record("/a", buffer_size=512, chunk_size=1024)
+        wait_for(lambda: recorder.stats().bytes_written >= 500)
+        stats = recorder.stats()
+        assert stats.current_file == output
+        assert stats.bytes_per_sec > 0
+        result = recorder.stop()
+        assert result is recorder.shutdown_result
+        assert (result.returncode, result.signal) == (0, signal.SIGINT)
+        assert not recorder.is_running
+        assert os.path.exists(output)
+        assert recorder.stats().current_file is None
+        assert recorder.stats().files == [output]
+        assert recorder.stats().bytes_written == os.path.getsize(output)
+        elapsed = recorder.stats().elapsed
+        time.sleep(0.05)
+        assert recorder.stats().elapsed == elapsed
+        with open(str(fake_rosbag)) as log:
+            assert "--buffsize=512 --chunksize=1024" in log.read()
+
+    def test_split_rotation(self, fake_rosbag, tmpdir, monkeypatch):
+        monkeypatch.setenv("FAKE_ROSBAG_MB", "200")
+        output = str(tmpdir.join("out"))
+        recorder = prb.BagRecorder(output)
+        recorder.record("/a", split_size=1, max_splits=2)
+        wait_for(lambda: len(recorder.stats().files) >= 5)
+        recorder.stop()
+        stats = recorder.stats()
+        assert stats.files[:3] == [output + "_{}.bag".format(i)
+                                   for i in range(3)]
+        assert stats.bytes_written >= 4 * 200
+        assert len(tmpdir.listdir(lambda p: p.ext == ".bag")) <= 3
+
+    def test_counts_buffer_overflows(self, fake_rosbag, tmpdir, monkeypatch,
+                                     caplog):
+        monkeypatch.setenv("FAKE_ROSBAG_OVERFLOW", "3")
+        caplog.set_level(logging.DEBUG, logger="bag_player")
+        recorder = prb.BagRecorder(str(tmpdir.join("out")))
+        recorder.record(all_topics=True, duration=0.05, wait=True)
+        recorder._stderr_thread.join(5)
+        assert recorder.stats().buffer_exceeded == 3
+        levels = [(record.levelno, "Recording to" in record.getMessage())
+                  for record in caplog.records]
+        assert levels == [(logging.DEBUG, True)] + [
+            (logging.WARNING, False)] * 3
+
+    def test_ignores_existing_files(self, fake_rosbag, tmpdir):
+        tmpdir.join("out.bag").write("old")
+        tmpdir.join("other.bag").write("other")
+        recorder = prb.BagRecorder(str(tmpdir.join("out.bag")))
+        assert recorder.stats().files == []
+
+    def test_cannot_record_twice(self, fake_rosbag, tmpdir):
+        recorder = prb.BagRecorder(str(tmpdir.join("out")))
+        recorder.record("/a")
+        with pytest.raises(prb.BagError):
+            recorder.record("/a")
+        recorder.stop()
+
+    def test_stop_when_not_running(self):
+        with pytest.raises(prb.BagNotRunningError):
+            prb.BagRecorder("out").stop()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for ``pyrosbag.repair`` module.
+
+"""
+import io
+import os
+
+import pytest
+
+from pyrosbag import bagfile
+from pyrosbag import pyrosbag as prb
+from pyrosbag import repair
+from pyrosbag import writer
+
+from .bagtools import sample_messages
+
+
+def read_bag(path):
+    with bagfile.BagReader(path) as reader:
+        return [(m.topic, m.timestamp, bytes(m.data))
+                for m in reader.read_messages()]
+
+
+def patch_bytes(path, pos, data):
+    with open(path, "r+b") as bag_file:
+        bag_file.seek(pos)
+        bag_file.write(data)
+
+
+class Interrupt(Exception):
+    pass
+
+
+class TestRecordScanner(object):
+    def test_matches_iter_records(self, make_bag):
+        path = make_bag(sample_messages(), chunk_size=200)
+        with open(path, "rb") as bag_file:
+            content = bag_file.read()
+            scanned = [(pos, header, data) for pos, header, data in
+                       repair.RecordScanner(bag_file, read_size=100)]
+        expected = [(pos, header, content[data_pos:data_pos + data_len])
+                    for pos, header, data_pos, data_len in
+                    bagfile.iter_records(content, len(bagfile.MAGIC))]
+        assert scanned == expected
+
+    def test_stops_at_truncation(self):
+        record = writer.encode_record([("op", b"\x02")], b"data")
+        scanner = repair.RecordScanner(io.BytesIO(record + record[:-1]), 0)
+        assert len(list(scanner)) == 1
+        assert scanner.truncated
+        assert scanner.pos == len(record)
+
+
+class TestCheck(object):
+    def test_consistent(self, make_bag):
+        path = make_bag(sample_messages(), compression="bz2", chunk_size=200)
+        result = repair.check_bag(path, thorough=True)
+        assert result.ok
+        assert result.message_count == 100
+
+    def test_unindexed(self, make_bag):
+        result = repair.check_bag(make_bag(sample_messages(), index=False))
+        assert not result.ok
+        assert "not indexed" in result.problems[0]
+
+    def test_header_counts(self, make_bag):
+        path = make_bag(sample_messages(), chunk_size=200)
+        with open(path, "rb") as bag_file:
+            pos = bag_file.read(4096).index(b"chunk_count=") + 12
+        patch_bytes(path, pos, bagfile.UINT32.pack(1))
+        result = repair.check_bag(path)
+        assert len(result.problems) == 1
+        assert "chunk_count 1" in result.problems[0]
+
+    def test_thorough_finds_bad_messages(self, make_bag):
+        path = make_bag(sample_messages(), chunk_size=200)
+        index = bagfile.BagIndex(path)
+        chunk = index.chunk_infos[1]
+        data_pos = index.read_chunk_header(chunk)[2]
+        with bagfile.BagReader(index) as reader:
+            _, offset, _ = reader.chunk_entries(chunk)[0]
+        with open(path, "rb") as bag_file:
+            bag_file.seek(data_pos + offset)
+            time_pos = bag_file.read(100).index(b"time=") + 5
+        patch_bytes(path, data_pos + offset + time_pos, b"\xff")
+        assert repair.check_bag(path).ok
+        problems = repair.check_bag(path, thorough=True).problems
+        assert problems == ["Chunk at {} has no message at offset {} "
+                            "matching its index.".format(chunk.pos, offset)]
+
+    def test_bag_check(self, make_bag):
+        bag = prb.Bag([make_bag(sample_messages(), name="1.bag"),
+                       make_bag(sample_messages(), name="2.bag",
+                                index=False)])
+        assert [result.ok for result in bag.check()] == [True, False]
+
+
+class TestReindex(object):
+    def test_truncated(self, make_bag, tmpdir):
+        messages = sample_messages(200)
+        reference = make_bag(messages, compression="bz2", chunk_size=300,
+                             name="reference.bag")
+        chunks = bagfile.BagIndex(reference).chunk_infos
+        path = make_bag(messages, compression="bz2", chunk_size=300,
+                        index=False)
+        cut = chunks[-1].pos + 20
+        with open(path, "r+b") as bag_file:
+            bag_file.truncate(cut)
+        out = str(tmpdir.join("out.bag"))
+        result = repair.reindex_bag(path, out)
+        kept = sum(sum(c.connection_counts.values()) for c in chunks[:-1])
+        assert result.chunks == len(chunks) - 1
+        assert result.messages == kept
+        assert read_bag(out) == messages[:kept]
+        assert repair.check_bag(out, thorough=True).ok
+
+    def test_messages_outside_chunks(self, make_bag, tmpdir):
+        messages = sample_messages(10)
+        path = make_bag(messages[:6], index=False)
+        connection = bagfile.BagIndex(
+            make_bag(messages, name="reference.bag")).connections[0]
+        with open(path, "ab") as bag_file:
+            bag_file.write(writer.encode_record(
+                [("op", b"\x07"), ("conn", bagfile.UINT32.pack(0)),
+                 ("topic", b"/a")],
+                writer.encode_header(sorted(connection.header.items()))))
+            for topic, timestamp, data in messages[6:]:
+                if topic == "/a":
+                    bag_file.write(writer.encode_record(
+                        [("op", b"\x02"), ("conn", bagfile.UINT32.pack(0)),
+                         ("time", writer.pack_time(timestamp))], data))
+        out = str(tmpdir.join("out.bag"))
+        assert repair.reindex_bag(path, out).messages == 8
+        assert read_bag(out) == messages[:6] + [m for m in messages[6:]
+                                                if m[0] == "/a"]
+
+    def test_progress(self, make_bag, tmpdir):
+        path = make_bag(sample_messages(200), chunk_size=300)
+        reports = []
+        repair.reindex_bag(path, str(tmpdir.join("out.bag")),
+                           reports.append, progress_interval=0)
+        assert len(reports) > 5
+        assert reports[-1].bytes_read == reports[-1].total_bytes
+        assert reports[-1].fraction == 1
+        assert reports[-1].messages == 200
+        assert [r.bytes_read for r in reports] == sorted(
+            r.bytes_read for r in reports)
+
+    def test_resumes_from_checkpoint(self, make_bag, tmpdir):
+        messages = sample_messages(200)
+        path = make_bag(messages, compression="bz2", chunk_size=300,
+                        index=False)
+        out = str(tmpdir.join("out.bag"))
+        checkpoint = str(tmpdir.join("out.resume"))
+
+        def interrupt(progress):
+            if progress.chunks == 4:
+                raise Interrupt()
+
+        with pytest.raises(Interrupt):
+            repair.reindex_bag(path, out, interrupt, progress_interval=0,
+                               checkpoint=checkpoint, checkpoint_interval=0,
+                               read_size=256)
+        assert os.path.exists(checkpoint)
+        reports = []
+        result = repair.reindex_bag(path, out, reports.append,
+                                    progress_interval=0,
+                                    checkpoint=checkpoint)
+        assert reports[0].chunks >= 4
+        assert result.messages == 200
+        assert read_bag(out) == messages
+        assert repair.check_bag(out, thorough=True).ok
+        assert not os.path.exists(checkpoint)
+
+    def test_ignores_stale_checkpoint(self, make_bag, tmpdir):
+        path = make_bag(sample_messages(), index=False)
+        out = str(tmpdir.join("out.bag"))
+        checkpoint = tmpdir.join("out.resume")
+        checkpoint.write(b"garbage", mode="wb")
+        assert repair.reindex_bag(path, out,
+                                  checkpoint=str(checkpoint)).messages == 100
+
+    def test_not_a_bag(self, tmpdir):
+        path = tmpdir.join("bad.bag")
+        path.write(b"not a bag", mode="wb")
+        with pytest.raises(bagfile.BagFormatError):
+            repair.reindex_bag(str(path), str(tmpdir.join("out.bag")))
+
+
+class TestFix(object):
+    def test_fix_in_place(self, make_bag, tmpdir):
+        messages = sample_messages()
+        path = make_bag(messages, index=False)
+        original = tmpdir.join("test.bag").read_binary()
+        bag = prb.Bag(path)
+        results = bag.fix()
+        assert results[0].messages == 100
+        assert tmpdir.join("test.orig.bag").read_binary() == original
+        assert bag.info()[0].message_count == 100
+        assert sorted(p.basename for p in tmpdir.listdir()) == [
+            "test.bag", "test.orig.bag"]
+
+    def test_existing_backup(self, make_bag, tmpdir):
+        path = make_bag(sample_messages(), index=False)
+        tmpdir.join("test.orig.bag").write("old")
+        with pytest.raises(prb.BagError):
+            repair.fix_bag(path)
+
+    def test_without_backup(self, make_bag, tmpdir):
+        path = make_bag(sample_messages(), index=False)
+        repair.fix_bag(path, backup=False)
+        assert [p.basename for p in tmpdir.listdir()] == ["test.bag"]
+        assert read_bag(path) == sample_messages()
+
+    def test_syncs_before_renaming(self, make_bag, monkeypatch):
+        events = []
+        fsync, replace = os.fsync, os.replace
+
+        def record_fsync(fd):
+            events.append(("fsync", os.fstat(fd).st_ino))
+            fsync(fd)
+
+        def record_replace(source, destination):
+            events.append(("replace", os.stat(source).st_ino))
+            replace(source, destination)
+
+        monkeypatch.setattr(os, "fsync", record_fsync)
+        monkeypatch.setattr(os, "replace", record_replace)
+        path = make_bag(sample_messages(), index=False)
+        repair.fix_bag(path, checkpoint_interval=0)
+        renamed = [inode for event, inode in events if event == "replace"]
+        assert len(renamed) > 2
+        for inode in renamed:
+            assert (events.index(("fsync", inode)) <
+                    events.index(("replace", inode)))
+        assert read_bag(path) == sample_messages()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for ``pyrosbag.shutdown`` module.
+
+"""
+import os
+import signal
+import subprocess as sp
+import sys
+import time
+
+import pytest
+
+from pyrosbag import pyrosbag as prb
+from pyrosbag import shutdown
+
+from .bagtools import sample_messages, wait_for
+
+
+FAST = shutdown.ShutdownPolicy(interrupt_timeout=0.2, terminate_timeout=0.2)
+
+
+def alive(pid):
+    try:
+        with open("/proc/{}/stat".format(pid)) as stat:
+            return stat.read().rsplit(")", 1)[1].split()[0] not in "ZX"
+    except IOError:
+        return False
+
+
+def start_process(arguments, policy=FAST, **kwargs):
+    return shutdown.register(sp.Popen(arguments, **dict(
+        kwargs, **shutdown.popen_options(policy))), policy)
+
+
+def start(policy=FAST):
+    process = start_process(["rosbag", "play", "a.bag"], policy,
+                            stdout=sp.PIPE)
+    assert process.stdout.readline()
+    return process
+
+
+class TestShutdown(object):
+    @pytest.fixture(autouse=True)
+    def long_bag(self, monkeypatch):
+        monkeypatch.setenv("FAKE_ROSBAG_DURATION", "30")
+
+    def test_interrupt(self, fake_rosbag):
+        result = shutdown.shutdown(start(), FAST)
+        assert result.returncode == 0
+        assert result.signal == signal.SIGINT
+        assert not result.escalated
+        assert result.elapsed < 0.2
+
+    @pytest.mark.parametrize("ignored, sent, returncode", [
+        ("INT", signal.SIGTERM, -signal.SIGTERM),
+        ("INT,TERM", signal.SIGKILL, -signal.SIGKILL),
+    ])
+    def test_escalation(self, fake_rosbag, monkeypatch, ignored, sent,
+                        returncode):
+        monkeypatch.setenv("FAKE_ROSBAG_IGNORE", ignored)
+        result = shutdown.shutdown(start(), FAST)
+        assert result.returncode == returncode
+        assert result.signal == sent
+        assert result.escalated
+        stages = 1 if sent == signal.SIGTERM else 2
+        assert 0.2 * stages <= result.elapsed < 0.2 * stages + 0.5
+
+    def test_already_exited(self):
+        process = start_process([sys.executable, "-c", "pass"])
+        process.wait()
+        assert shutdown.shutdown(process) == (0, None, pytest.approx(0,
+                                                                     abs=0.1))
+
+    @pytest.mark.skipif(not os.path.exists("/proc"), reason="Needs /proc.")
+    def test_reaps_process_group(self, fake_rosbag, monkeypatch, tmpdir):
+        child = tmpdir.join("child")
+        monkeypatch.setenv("FAKE_ROSBAG_CHILD", str(child))
+        policy = FAST._replace(process_group=True)
+        process = start(policy)
+        wait_for(child.exists)
+        pid = int(child.read())
+        assert alive(pid)
+        assert os.getpgid(process.pid) == process.pid
+        assert shutdown.shutdown(process, policy).returncode == 0
+        wait_for(lambda: not alive(pid))
+
+    @pytest.mark.skipif(not os.path.exists("/proc"), reason="Needs /proc.")
+    def test_stays_in_caller_group(self, fake_rosbag, monkeypatch, tmpdir):
+        child = tmpdir.join("child")
+        monkeypatch.setenv("FAKE_ROSBAG_CHILD", str(child))
+        process = start()
+        wait_for(child.exists)
+        pid = int(child.read())
+        assert os.getpgid(process.pid) == os.getpgrp()
+        assert shutdown._live[process] == FAST
+        result = shutdown.shutdown(process, FAST)
+        assert process not in shutdown._live
+        assert result.returncode == 0
+        assert result.signal == signal.SIGKILL
+        assert not alive(pid)
+
+    def test_wait_exit(self):
+        process = start_process([sys.executable, "-c",
+                                 "import time; time.sleep(0.1)"])
+        assert not shutdown.wait_exit(process, 0)
+        start_time = time.time()
+        assert shutdown.wait_exit(process, 5)
+        assert time.time() - start_time < 1
+        assert process.returncode is None
+        assert process.wait() == 0
+
+
+class TestBagShutdown(object):
+    @pytest.fixture(autouse=True)
+    def long_bag(self, monkeypatch):
+        monkeypatch.setenv("FAKE_ROSBAG_DURATION", "30")
+
+    def test_stop(self, fake_rosbag):
+        player = prb.BagPlayer("a.bag", shutdown_policy=FAST)
+        player.play(progress=True)
+        wait_for(lambda: player.bag_time is not None)
+        result = player.stop()
+        assert result is player.shutdown_result
+        assert (result.returncode, result.signal) == (0, signal.SIGINT)
+        assert not player.is_running
+
+    @pytest.mark.skipif(not os.path.exists("/proc"), reason="Needs /proc.")
+    @pytest.mark.parametrize("process_group", [False, True])
+    def test_stop_wrapper(self, fake_rosbag, monkeypatch, tmpdir,
+                          process_group):
+        child = tmpdir.join("child")
+        monkeypatch.setenv("FAKE_ROSBAG_WRAPPER", str(child))
+        policy = FAST._replace(process_group=process_group)
+        player = prb.BagPlayer("a.bag", shutdown_policy=policy)
+        player.play(progress=True)
+        wait_for(lambda: player.bag_time is not None)
+        pid = int(child.read())
+        result = player.stop()
+        assert (result.returncode, result.signal) == (0, signal.SIGINT)
+        assert not alive(pid)
+
+    @pytest.mark.skipif(not os.path.exists("/proc"), reason="Needs /proc.")
+    def test_stop_recorder_wrapper(self, fake_rosbag, monkeypatch, tmpdir):
+        child = tmpdir.join("child")
+        monkeypatch.setenv("FAKE_ROSBAG_WRAPPER", str(child))
+        output = tmpdir.join("out.bag")
+        recorder = prb.BagRecorder(str(output), shutdown_policy=FAST)
+        recorder.record("/a")
+        wait_for(lambda: recorder.stats().bytes_written > 0)
+        pid = int(child.read())
+        assert recorder.stop().signal == signal.SIGINT
+        assert not alive(pid)
+        assert output.exists()
+        assert not tmpdir.join("out.bag.active").exists()
+
+    def test_stop_engine(self, make_bag):
+        player = prb.BagPlayer(make_bag(sample_messages(10, step=10 ** 8)))
+        player.play(sink=lambda message: None)
+        assert player.stop() == (0, None, pytest.approx(0, abs=0.5))
+
+    def test_exit_does_not_sleep(self, fake_rosbag):
+        start_time = time.time()
+        with prb.BagPlayer("a.bag") as player:
+            player.play()
+            raise KeyboardInterrupt
+        assert time.time() - start_time < 0.5
+        assert player.shutdown_result.signal == signal.SIGINT
+
+    def test_stop_when_not_running(self):
+        with pytest.raises(prb.BagNotRunningError):
+            prb.BagPlayer("a.bag").stop()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for ``pyrosbag.standby`` module.
+
+"""
+import pytest
+
+from pyrosbag import pyrosbag as prb
+from pyrosbag import standby
+
+from .bagtools import invocations, wait_for
+
+
+class TestStandbyPool(object):
+    def setup_method(self):
+        self.pool = None
+
+    def teardown_method(self):
+        if self.pool is not None:
+            self.pool.close()
+
+    @pytest.fixture(autouse=True)
+    def long_bag(self, monkeypatch):
+        monkeypatch.setenv("FAKE_ROSBAG_DURATION", "30")
+
+    def test_acquire_replaces(self, fake_rosbag):
+        self.pool = standby.StandbyPool(["rosbag", "play", "a.bag",
+                                         "--pause"], size=2)
+        player = self.pool.acquire()
+        assert player.is_ready
+        assert player.progress.latest.is_paused
+        wait_for(lambda: self.pool.stats().ready == 2)
+        assert self.pool.stats() == standby.StandbyStats(3, 2, 1, 0, 0)
+        player.resume()
+        wait_for(lambda: player.progress.latest.state == "RUNNING")
+        player.close()
+        assert player.process.returncode is not None
+
+    def test_dead_players(self, fake_rosbag):
+        self.pool = standby.StandbyPool(["rosbag", "play", "a.bag",
+                                         "--pause"])
+        wait_for(lambda: self.pool.stats().ready == 1)
+        self.pool._players[0].process.kill()
+        self.pool._players[0].process.wait()
+        assert self.pool.acquire(timeout=0) is None
+        stats = self.pool.stats()
+        assert (stats.died, stats.misses) == (1, 1)
+        wait_for(lambda: self.pool.stats().ready == 1)
+        assert self.pool.stats().spawned == 2
+        assert self.pool.acquire(timeout=5).is_ready
+
+    def test_respawns_are_limited(self, fake_rosbag):
+        self.pool = standby.StandbyPool(["rosbag", "info", "a.bag"],
+                                        max_respawns=2)
+        assert self.pool.acquire(timeout=5) is None
+        stats = self.pool.stats()
+        assert (stats.spawned, stats.died, stats.misses) == (3, 3, 1)
+        assert not self.pool._timers
+
+    def test_close(self, fake_rosbag):
+        self.pool = standby.StandbyPool(["rosbag", "play", "a.bag",
+                                         "--pause"], size=2)
+        players = list(self.pool._players)
+        self.pool.close()
+        assert all(p.process.poll() is not None for p in players)
+        assert self.pool.acquire() is None
+
+
+class TestWarmUp(object):
+    def setup_method(self):
+        self.player = prb.BagPlayer("example.bag")
+
+    def teardown_method(self):
+        if self.player.is_running:
+            self.player.stop()
+        self.player.cool_down()
+
+    @pytest.fixture(autouse=True)
+    def long_bag(self, monkeypatch):
+        monkeypatch.setenv("FAKE_ROSBAG_DURATION", "30")
+
+    def test_play_resumes_standby(self, fake_rosbag):
+        pool = self.player.warm_up(publish_rate_multiplier=2, quiet=True)
+        wait_for(lambda: pool.stats().ready == 1)
+        standby_process = pool._players[0].process
+        self.player.play(publish_rate_multiplier=2)
+        assert self.player.process is standby_process
+        wait_for(lambda: self.player.progress.latest.state == "RUNNING")
+        assert invocations(fake_rosbag)[0] == [
+            "play", "example.bag", "--pause", "--rate=2"]
+        wait_for(lambda: len(invocations(fake_rosbag)) == 2)
+
+    def test_start_paused(self, fake_rosbag):
+        self.player.warm_up()
+        self.player.play(start_paused=True)
+        assert self.player.progress.latest.is_paused
+        assert self.player.standby.stats().hits == 1
+
+    def test_progress_callback(self, fake_rosbag):
+        statuses = []
+        self.player.warm_up()
+        self.player.play(progress_callback=statuses.append)
+        wait_for(lambda: statuses and statuses[-1].state == "RUNNING")
+
+    def test_other_options_start_a_player(self, fake_rosbag):
+        pool = self.player.warm_up(immediate=True)
+        self.player.play(loop=True)
+        assert self.player.process not in [p.process for p in pool._players]
+        assert pool.stats().hits == 0
+        wait_for(lambda: len(invocations(fake_rosbag)) == 2)
+        assert ["play", "example.bag", "-l"] in invocations(fake_rosbag)
+
+    def test_context_manager_cools_down(self, fake_rosbag):
+        with self.player:
+            pool = self.player.warm_up(size=2)
+            players = list(pool._players)
+        assert self.player.standby is None
+        assert all(p.process.poll() is not None for p in players)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for ``pyrosbag.writer`` module.
+
+"""
+from unittest.mock import patch
+
+import pytest
+
+from pyrosbag import bagfile
+from pyrosbag import pyrosbag as prb
+from pyrosbag import writer
+
+from .bagtools import STRING_TYPE, sample_messages
+
+
+def write_bag(path, messages, **kwargs):
+    with writer.BagWriter(path, **kwargs) as bag:
+        for topic in sorted(set(topic for topic, _, _ in messages)):
+            bag.add_connection(topic, *STRING_TYPE)
+        for topic, timestamp, data in messages:
+            bag.write(topic, data, timestamp)
+    return bag
+
+
+def read_bag(path):
+    with bagfile.BagReader(path) as reader:
+        return [(m.topic, m.timestamp, bytes(m.data))
+                for m in reader.read_messages()]
+
+
+class TestBagWriter(object):
+    @pytest.mark.parametrize("compression", writer.COMPRESSIONS)
+    def test_round_trip(self, tmpdir, compression):
+        if compression == "lz4":
+            pytest.importorskip("lz4.frame")
+        path = str(tmpdir.join("out.bag"))
+        messages = sample_messages(500)
+        bag = write_bag(path, messages, compression=compression,
+                        chunk_threshold=1024)
+        assert read_bag(path) == messages
+        index = bagfile.BagIndex(path)
+        assert index.chunk_infos == bag.chunk_infos
+        assert len(index.chunk_infos) > 10
+        assert index.info(compression=True).compression == {
+            compression: len(index.chunk_infos)}
+        topic = index.info().topics["/a"]
+        assert topic == bagfile.TopicInfo(STRING_TYPE[0], STRING_TYPE[1],
+                                          250, 1)
+        assert index.connections[0].msg_def == STRING_TYPE[2]
+
+    def test_chunk_threshold(self, tmpdir):
+        path = str(tmpdir.join("out.bag"))
+        write_bag(path, sample_messages(100), chunk_threshold=1)
+        chunks = bagfile.BagIndex(path).chunk_infos
+        assert len(chunks) == 100
+        assert all(sum(c.connection_counts.values()) == 1 for c in chunks)
+
+    def test_message_index(self, tmpdir):
+        path = str(tmpdir.join("out.bag"))
+        messages = sample_messages(100)
+        write_bag(path, messages, chunk_threshold=300)
+        index = bagfile.BagIndex(path).load_message_index()
+        assert list(index[1].timestamps) == [t for topic, t, _ in messages
+                                             if topic == "/b"]
+
+    def test_empty_bag(self, tmpdir):
+        path = str(tmpdir.join("out.bag"))
+        writer.BagWriter(path).close()
+        info = bagfile.BagIndex(path).info()
+        assert info.message_count == 0
+        assert info.chunk_count == 0
+
+    def test_copy_messages(self, make_bag, tmpdir):
+        messages = sample_messages(50)
+        path = str(tmpdir.join("copy.bag"))
+        with bagfile.BagReader(make_bag(messages)) as reader:
+            with writer.BagWriter(path, compression="bz2") as bag:
+                for message in reader.read_messages():
+                    bag.write_message(message)
+        assert read_bag(path) == messages
+        assert sorted(c.topic for c in
+                      bagfile.BagIndex(path).connections.values()) == [
+            "/a", "/b"]
+
+    def test_connection_header(self, tmpdir):
+        path = str(tmpdir.join("out.bag"))
+        with writer.BagWriter(path) as bag:
+            first = bag.add_connection("/a", *STRING_TYPE,
+                                       header={"latching": b"1"})
+            assert bag.add_connection("/a", *STRING_TYPE,
+                                      header={"latching": b"1"}) is first
+            bag.write("/a", b"\0\0\0\0", 10 ** 9)
+        connection = bagfile.BagIndex(path).connections[0]
+        assert connection.header["latching"] == b"1"
+
+    def test_unknown_topic(self, tmpdir):
+        with writer.BagWriter(str(tmpdir.join("out.bag"))) as bag:
+            with pytest.raises(bagfile.BagError):
+                bag.write("/a", b"", 0)
+
+    def test_unknown_compression(self, tmpdir):
+        with pytest.raises(bagfile.BagError):
+            writer.BagWriter(str(tmpdir.join("out.bag")), compression="zip")
+
+    def test_write_after_close(self, tmpdir):
+        bag = writer.BagWriter(str(tmpdir.join("out.bag")))
+        bag.add_connection("/a", *STRING_TYPE)
+        bag.close()
+        with pytest.raises(bagfile.BagError):
+            bag.write("/a", b"", 0)
+
+
+class TestFilter(object):
+    def test_copies_whole_chunks(self, make_bag, tmpdir):
+        messages = sample_messages(200)
+        path = make_bag(messages, compression="bz2", chunk_size=200)
+        out = str(tmpdir.join("out.bag"))
+        with patch.object(bagfile, "decompress") as mock_decompress:
+            assert prb.Bag(path).filter(out) == 200
+            assert not mock_decompress.called
+        assert read_bag(out) == messages
+        source = bagfile.BagIndex(path)
+        copied = bagfile.BagIndex(out)
+        assert len(copied.chunk_infos) == len(source.chunk_infos)
+        assert copied.info(compression=True).compression == {
+            "bz2": len(source.chunk_infos)}
+
+    def test_topics_and_time_range(self, make_bag, tmpdir):
+        messages = sample_messages(200, topics=("/a", "/b", "/c"))
+        path = make_bag(messages, chunk_size=300)
+        out = str(tmpdir.join("out.bag"))
+        start, end = 1e9 + 0.5, 1e9 + 1.5
+        count = prb.Bag(path).filter(out, ["/a", "/c"], start, end)
+        expected = [m for m in messages if m[0] != "/b" and
+                    start * 1e9 <= m[1] <= end * 1e9]
+        assert count == len(expected)
+        assert read_bag(out) == expected
+        assert sorted(bagfile.BagIndex(out).info().topics) == ["/a", "/c"]
+
+    def test_recompresses(self, make_bag, tmpdir):
+        messages = sample_messages(100)
+        path = make_bag(messages, chunk_size=200)
+        out = str(tmpdir.join("out.bag"))
+        prb.Bag(path).filter(out, compression="bz2")
+        assert read_bag(out) == messages
+        assert list(bagfile.BagIndex(out).info(
+            compression=True).compression) == ["bz2"]
+
+    def test_predicate(self, make_bag, tmpdir):
+        messages = sample_messages(100)
+        out = str(tmpdir.join("out.bag"))
+        count = prb.Bag(make_bag(messages)).filter(
+            out, predicate=lambda m: bytes(m.data).endswith(b"7"))
+        assert count == 10
+        assert read_bag(out) == [m for m in messages if m[2].endswith(b"7")]
+
+    def test_several_files(self, make_bag, tmpdir):
+        first = sample_messages(50)
+        second = sample_messages(50, start=10 ** 18 + 5)
+        bag = prb.Bag([make_bag(first, name="1.bag"),
+                       make_bag(second, name="2.bag")])
+        out = str(tmpdir.join("out.bag"))
+        assert bag.filter(out, "/a") == 50
+        assert read_bag(out) == sorted(m for m in first + second
+                                       if m[0] == "/a")
+        assert len(bagfile.BagIndex(out).connections) == 1
+
+
+class TestMerge(object):
+    def make_bags(self, make_bag, count=4, compression="bz2"):
+        streams = [sample_messages(50, topics=("/{}".format(i),),
+                                   start=10 ** 18 + i * 10 ** 6)
+                   for i in range(count)]
+        paths = [make_bag(messages, name="{}.bag".format(i),
+                          compression=compression, chunk_size=100)
+                 for i, messages in enumerate(streams)]
+        return paths, sorted(sum(streams, []), key=lambda m: m[1])
+
+    def test_merges_to_stream(self, make_bag):
+        paths, expected = self.make_bags(make_bag)
+        messages = prb.Bag(paths).merge()
+        assert [(m.topic, m.timestamp, bytes(m.data))
+                for m in messages] == expected
+
+    def test_merges_to_bag(self, make_bag, tmpdir):
+        pytest.importorskip("lz4.frame")
+        paths, expected = self.make_bags(make_bag, compression="none")
+        out = str(tmpdir.join("merged.bag"))
+        assert prb.Bag(paths).merge(out, compression="lz4") == 200
+        assert read_bag(out) == expected
+        info = bagfile.BagIndex(out).info(compression=True)
+        assert sorted(info.topics) == ["/0", "/1", "/2", "/3"]
+        assert list(info.compression) == ["lz4"]
+
+    def test_topics_and_time_range(self, make_bag, tmpdir):
+        paths, expected = self.make_bags(make_bag)
+        out = str(tmpdir.join("merged.bag"))
+        prb.Bag(paths).merge(out, ["/1", "/2"], 1e9 + 0.1, 1e9 + 0.3)
+        assert read_bag(out) == [
+            m for m in expected if m[0] in ("/1", "/2") and
+            1e18 + 1e8 <= m[1] <= 1e18 + 3e8]
+
+    def test_decompresses_in_parallel(self, make_bag):
+        paths, _ = self.make_bags(make_bag)
+        with patch.object(prb, "ThreadPoolExecutor",
+                          wraps=prb.ThreadPoolExecutor) as mock_executor:
+            list(prb.Bag(paths).merge(workers=3))
+        mock_executor.assert_called_once_with(3)